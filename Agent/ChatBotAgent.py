@@ -1,24 +1,88 @@
+import time
+from typing import Any, Dict, Iterator
+
 from tools_Agent import *
 from langchain.chat_models import init_chat_model
 from dotenv import load_dotenv
-from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.prebuilt import create_react_agent
 load_dotenv()
 from langchain_openai import ChatOpenAI
+from session_store import SessionStore, trim_history
+from llm_limiter import limited
+from model_cascade import CASCADE_ENABLED, build_cascade
+from tracing import record_ttft, span
 
 class ChatBot:
     def __init__(self):
-        self.model_llm = ChatOpenAI(
+        # LM Studio xử lý được ít request cùng lúc: bọc bằng bộ giới hạn, tắt gọi lại riêng của client OpenAI
+        self.model_llm = limited(ChatOpenAI(
             model= 'gemma-3-1b-it-qat',
             api_key="api_key",  # API key có thể là bất kỳ giá trị nào
-            base_url="http://localhost:1234/v1"  # Địa chỉ server LM Studio
-        )
-        self.check_point = InMemorySaver()
-        self.tools = [create_invoice_docx, get_prompt_for_data_excel, read_excel_data]
-        self.prompt = 'Bạn là trợ lý ảo cho doanh nghiệp được huấn luyện để có thể thao tác với người dùng. Để tạo hoá đơn từ file .xlsx đầu tiên là đọc file sau đó trích xuất dữ liệu prompt từ tool tạo prompt sau đó đưa dữ liệu thích hợp vào tool tạo hoá đơn đầu ra'
-        self.config = {"configurable": {"thread_id": "1"}}
-        self.Agent= create_react_agent(model= self.model_llm, tools= self.tools, prompt= self.prompt, checkpointer= self.check_point)
-    def chat(self, message: str) -> str:
+            base_url="http://localhost:1234/v1",  # Địa chỉ server LM Studio
+            max_retries=0
+        ))
+        # Checkpoint lưu trên đĩa theo từng phiên (session_id), phiên nhàn rỗi quá TTL bị xoá
+        self.sessions = SessionStore()
+        self.check_point = self.sessions.saver
+        # EXTRACT_CASCADE=1: kết quả trích xuất của model local không hợp lệ thì gọi lại bằng Gemini
+        extractor = build_cascade(local=self.model_llm) if CASCADE_ENABLED else self.model_llm
+        self.tools = [make_create_invoice_from_excel(extractor), create_invoice_docx, get_prompt_for_data_excel, read_excel_data]
+        self.prompt = ('Bạn là trợ lý ảo cho doanh nghiệp được huấn luyện để có thể thao tác với người dùng. '
+                       'Để tạo hoá đơn từ file .xlsx hãy gọi MỘT lần tool create_invoice_from_excel với tên file Excel và tên file đầu ra, '
+                       'tool này tự đọc file, trích xuất dữ liệu và tạo hoá đơn. '
+                       'Chỉ khi người dùng tự cung cấp thông tin hoá đơn trong tin nhắn thì mới đưa dữ liệu đó vào tool create_invoice_docx. '
+                       'read_excel_data trả về handle dạng artifact:..., hãy truyền nguyên handle đó cho các tool khác thay vì chép lại dữ liệu')
+        # trim_history giữ lịch sử trong giới hạn token để mỗi lượt không chậm dần theo độ dài hội thoại
+        self.Agent= create_react_agent(model= self.model_llm, tools= self.tools, prompt= self.prompt,
+                                       checkpointer= self.check_point, pre_model_hook= trim_history)
+    def chat(self, message: str, session_id: str) -> str:
+        """Gửi tin nhắn vào phiên session_id, mỗi phiên có lịch sử hội thoại riêng"""
+        self.sessions.expire()
         input_message = {"role": "user", "content": message}
-        res = self.Agent.invoke(input={"messages": [input_message]}, config=self.config)
+        res = self.Agent.invoke(input={"messages": [input_message]}, config=self.sessions.config(session_id))
+        self.sessions.touch(session_id)
+        self.sessions.compact(session_id)
         return res
+
+    def stream_chat(self, message: str, session_id: str) -> Iterator[Dict[str, Any]]:
+        """Như chat nhưng trả về dần các sự kiện để hiển thị câu trả lời ngay khi model sinh token
+
+        Yields:
+            Dict[str, Any]: {"event": "token", "text"} từng đoạn câu trả lời của model,
+                {"event": "tool", "tool"} khi một tool chạy xong,
+                {"event": "done", "response", "ttft_ms", "total_ms"} ở cuối
+        """
+        self.sessions.expire()
+        input_message = {"role": "user", "content": message}
+        start = time.perf_counter()
+        ttft = None
+        response = ""
+        try:
+            with span("agent.request", stream=True):
+                for mode, payload in self.Agent.stream(input={"messages": [input_message]}, config=self.sessions.config(session_id),
+                                                       stream_mode=["messages", "updates"]):
+                    if mode == "updates":
+                        for node, update in payload.items():
+                            for msg in (update or {}).get("messages", []):
+                                if node == "tools":
+                                    yield {"event": "tool", "tool": getattr(msg, "name", None)}
+                                elif node == "agent" and not getattr(msg, "tool_calls", None):
+                                    response = msg.content
+                        continue
+                    chunk, metadata = payload
+                    # Chỉ lấy token của node gọi model, bỏ qua nội dung tool trả về
+                    if metadata.get("langgraph_node") != "agent" or not isinstance(chunk.content, str) or not chunk.content:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                        record_ttft("agent", ttft)
+                    yield {"event": "token", "text": chunk.content}
+        finally:
+            self.sessions.touch(session_id)
+            self.sessions.compact(session_id)
+        yield {
+            "event": "done",
+            "response": response,
+            "ttft_ms": round(ttft * 1000, 3) if ttft is not None else None,
+            "total_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
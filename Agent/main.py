@@ -1,7 +1,14 @@
+import os
+import sys
+from uuid import uuid4
 from ChatBotAgent import ChatBot
 
 prompt_hoa_don = '''ngày 12 thang 7 nam 2025 kí hiệu là HD001 tên người bán : Lê Việt Anh mã số thuế người bán: 123456789 địa chỉ bán là: Hà Nội, điện thoại người bán: 0123456789, số tài khoản người bán: 12345678, tên người mua: Nguyễn Văn B, mã số thuế người mua: 987654321, địa chỉ người mua: TP.HCM, số điện thoại người mua: 0987654321, số tài khoản người mua: 87654321, hình thức thanh toán: Chuyển khoản'''
 chat_bot = ChatBot()
+# Tiếp tục hội thoại trước đó bằng session_id cũ: `python main.py <session_id>` hoặc AGENT_SESSION_ID=<session_id>,
+# không truyền thì mở phiên mới
+session_id = (sys.argv[1] if len(sys.argv) > 1 else os.getenv('AGENT_SESSION_ID')) or uuid4().hex
+print(f'🔑 Phiên: {session_id} (chạy lại với `python main.py {session_id}` để tiếp tục)')
 
 while True:
     mes = input('Nhập nội dung: ')
@@ -9,8 +16,22 @@ while True:
         break
     
     print()
-    res = chat_bot.chat(message= mes)
-    print(f'chatbot: {res['messages'][-1].content}')
+    # In câu trả lời dần từng token, các tool agent gọi in trên dòng riêng
+    print('chatbot: ', end='', flush=True)
+    streamed = ''
+    for event in chat_bot.stream_chat(message= mes, session_id= session_id):
+        if event['event'] == 'token':
+            print(event['text'], end='', flush=True)
+            streamed += event['text']
+        elif event['event'] == 'tool':
+            print(f"\n   🛠️ Đã gọi tool {event['tool']}", end='', flush=True)
+        elif event['event'] == 'done':
+            res = event
+    print()
+    if res['response'] and res['response'].strip() != streamed.strip():
+        print(f"chatbot: {res['response']}")
+    if res['ttft_ms'] is not None:
+        print(f"⏱️ Token đầu tiên sau {res['ttft_ms']:.0f} ms, tổng {res['total_ms']:.0f} ms")
     print()
     print('-' * 100)
     print()
@@ -0,0 +1,122 @@
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import HumanMessage, RemoveMessage
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+from tracing import log
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# File SQLite lưu checkpoint của các phiên chat, đổi bằng biến môi trường AGENT_CHECKPOINT_PATH
+CHECKPOINT_PATH = os.getenv("AGENT_CHECKPOINT_PATH", os.path.join(_ROOT, ".cache", "agent_checkpoints.sqlite"))
+# Phiên không hoạt động quá thời gian này (giây) thì bị xoá
+SESSION_TTL_SECONDS = float(os.getenv("AGENT_SESSION_TTL_SECONDS", str(24 * 3600)))
+# Số token tối đa của lịch sử hội thoại giữ lại trong state (phần cũ hơn bị cắt)
+MAX_HISTORY_TOKENS = int(os.getenv("AGENT_MAX_HISTORY_TOKENS", "3000"))
+
+
+def trim_history(state: Dict[str, Any]) -> Dict[str, Any]:
+    """pre_model_hook cho create_react_agent: cắt lịch sử cũ khi vượt MAX_HISTORY_TOKENS
+
+    Lịch sử bị cắt hẳn khỏi state (không chỉ khỏi input của model) nên checkpoint không lớn dần
+    và thời gian mỗi lượt không tăng theo độ dài hội thoại.
+    """
+    messages: List[Any] = state["messages"]
+    if count_tokens_approximately(messages) <= MAX_HISTORY_TOKENS:
+        return {}
+    trimmed = trim_messages(
+        messages,
+        max_tokens=MAX_HISTORY_TOKENS,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+        include_system=True,
+    )
+    if not trimmed:
+        # Riêng lượt hiện tại đã vượt giới hạn thì vẫn giữ nguyên lượt đó
+        last_human = max(i for i, message in enumerate(messages) if isinstance(message, HumanMessage))
+        trimmed = messages[last_human:]
+    log(f"✂️ Cắt lịch sử hội thoại: {len(messages)} -> {len(trimmed)} tin nhắn")
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *trimmed]}
+
+
+class SessionStore:
+    """Checkpointer SQLite theo phiên chat: mỗi session_id là một thread, phiên hết hạn theo TTL
+    và chỉ giữ checkpoint mới nhất của mỗi phiên"""
+
+    def __init__(self, path: str = CHECKPOINT_PATH, ttl_seconds: Optional[float] = SESSION_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.saver = SqliteSaver(self.conn)
+        self.saver.setup()
+        with self.saver.cursor() as cur:
+            cur.execute("CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_active REAL NOT NULL)")
+
+    def config(self, session_id: str) -> Dict[str, Any]:
+        """Config của graph cho phiên session_id"""
+        return {"configurable": {"thread_id": session_id}}
+
+    def touch(self, session_id: str) -> None:
+        """Cập nhật thời điểm hoạt động gần nhất của phiên"""
+        with self.saver.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, last_active) VALUES (?, ?)",
+                (session_id, time.time()),
+            )
+
+    def expire(self) -> int:
+        """Xoá các phiên không hoạt động quá ttl_seconds, trả về số phiên đã xoá"""
+        if self.ttl_seconds is None:
+            return 0
+        with self.saver.cursor() as cur:
+            cur.execute("SELECT session_id FROM sessions WHERE last_active < ?", (time.time() - self.ttl_seconds,))
+            expired = [row[0] for row in cur.fetchall()]
+        for session_id in expired:
+            self.delete(session_id)
+        if expired:
+            log(f"🧹 Đã xoá {len(expired)} phiên hết hạn")
+        return len(expired)
+
+    def delete(self, session_id: str) -> None:
+        """Xoá toàn bộ checkpoint của một phiên"""
+        self.saver.delete_thread(session_id)
+        with self.saver.cursor() as cur:
+            cur.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def compact(self, session_id: str) -> int:
+        """Chỉ giữ checkpoint mới nhất (kèm các writes của nó) của phiên, trả về số checkpoint đã xoá
+
+        State của react agent lưu đầy đủ trong mỗi checkpoint nên các checkpoint cũ không cần
+        để khôi phục hội thoại, giữ lại chỉ làm file lớn dần.
+        """
+        with self.saver.cursor() as cur:
+            cur.execute(
+                """DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id NOT IN (
+                       SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? GROUP BY checkpoint_ns)""",
+                (session_id, session_id),
+            )
+            removed = cur.rowcount
+            cur.execute(
+                """DELETE FROM writes WHERE thread_id = ? AND checkpoint_id NOT IN (
+                       SELECT checkpoint_id FROM checkpoints WHERE thread_id = ?)""",
+                (session_id, session_id),
+            )
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        """Số phiên, số checkpoint và dung lượng file"""
+        with self.saver.cursor(transaction=False) as cur:
+            cur.execute("SELECT COUNT(*) FROM sessions")
+            sessions = cur.fetchone()[0]
+            cur.execute("SELECT COUNT(*) FROM checkpoints")
+            checkpoints = cur.fetchone()[0]
+        size = os.path.getsize(self.path) if self.path != ":memory:" and os.path.exists(self.path) else 0
+        return {"sessions": sessions, "checkpoints": checkpoints, "bytes": size}
@@ -2,27 +2,47 @@ from langchain_core.tools import tool
 from docx import Document
 from dotenv import load_dotenv
 import os
+import sys
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 load_dotenv()
-import pandas as pd
-from typing import List, Optional
+from typing import List, Optional, Union
 from pydantic import BaseModel, Field
 
+# Agent chạy trong thư mục Agent/, thêm thư mục gốc để dùng chung các module ở đó
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from workbook_cache import cached_read_excel_rows
+from invoice_template import TEMPLATE_PATH, get_invoice_template
+from docx_table import add_table_rows
+from sheet_serializer import DEFAULT_TOKEN_BUDGET, serialize_sheet, log_prompt_stats
+from invoice_extractor import extract_invoice
+from invoice_totals import apply_totals
+from artifact_store import describe_rows, get_artifact_store, is_handle, parse_handle
+from tracing import log, traced
+
 @tool
-def read_excel_data(file_path: str) -> List[List[str]]:
-    """Đọc nội dung từ file Excel hoá đơn và trả về nội dung dưới dạng list, list chứa các chuỗi
+@traced("tool.read_excel_data")
+def read_excel_data(
+    file_path: str,
+    sheet_name: Optional[Union[str, int]] = None,
+    cell_range: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> str:
+    """Đọc nội dung từ file Excel hoá đơn, lưu vào kho artifact và trả về handle kèm mô tả ngắn
     Args:
-        file_name (str): Tên file Excel cần đọc
+        file_path (str): Tên file Excel cần đọc
+        sheet_name (str | int, optional): Tên hoặc vị trí sheet, mặc định là sheet đầu tiên
+        cell_range (str, optional): Vùng ô cần đọc, ví dụ 'A1:F200'
+        max_rows (int, optional): Số hàng tối đa cần đọc
 
     Returns:
-        list[list[str]]: Nội dung của file Excel theo định dạng list, mỗi list con là một hàng trong file Excel
-        Nếu có lỗi xảy ra, trả về thông báo lỗi
+        str: Handle dạng 'artifact:...' của dữ liệu (truyền handle này cho get_prompt_for_data_excel)
+        và mô tả kích thước, vài hàng đầu. Nếu có lỗi xảy ra, trả về thông báo lỗi
     """
-    print(f"--- TOOL: Đang đọc file: {file_path} ---")
+    log(f"--- TOOL: Đang đọc file: {file_path} ---")
     try:
-        df = pd.read_excel(file_path)
-        # Chuyển DataFrame thành chuỗi để LLM có thể đọc dễ dàng
-        return df.values.tolist()
+        rows = cached_read_excel_rows(file_path, sheet_name=sheet_name, cell_range=cell_range, max_rows=max_rows)
+        # Không trả cả sheet về message (bị lưu vào checkpoint và gửi lại model ở mỗi bước), chỉ trả handle
+        return f"{get_artifact_store().put(rows)} ({describe_rows(rows)})"
     except FileNotFoundError:
         return "Lỗi: Không tìm thấy file Excel."
     except Exception as e:
@@ -47,14 +67,29 @@ class InvoiceDetails(BaseModel):
     dien_thoai_mua: Optional[str] = Field(default=None, description='Điện thoại người mua')
     so_tai_khoan_mua: Optional[str] = Field(default=None, description='Số tài khoản người mua')
     hinh_thuc_thanh_toan: Optional[str] = Field(default=None, description='Hình thức thanh toán')
+    # Các trường dưới đây được tính lại từ du_lieu_bang (invoice_totals), không cần LLM trích xuất
+    tong_tien_hang: Optional[str] = Field(default=None, description='Cộng tiền hàng, tự tính từ bảng hàng hoá')
+    thue_suat_gtgt: Optional[str] = Field(default=None, description='Thuế suất GTGT, ví dụ 10%')
+    tien_thue_gtgt: Optional[str] = Field(default=None, description='Tiền thuế GTGT, tự tính')
+    tong_thanh_toan: Optional[str] = Field(default=None, description='Tổng tiền thanh toán, tự tính')
+    so_tien_bang_chu: Optional[str] = Field(default=None, description='Tổng tiền thanh toán bằng chữ, tự tính')
 
 @tool
+@traced("tool.create_invoice_docx")
 def create_invoice_docx(invoice_data: InvoiceDetails, output_path: str) -> str:
     """
     Tạo một file DOCX hoá đơn từ đối tượng InvoiceDetails đã được trích xuất.
     """
-    print(f"--- TOOL: Đang tạo file DOCX tại: {output_path} ---")
+    log(f"--- TOOL: Đang tạo file DOCX tại: {output_path} ---")
     try:
+        if invoice_data.tong_thanh_toan is None:
+            # Thành tiền và các số tổng được tính lại từ bảng hàng, không dựa vào phép tính của LLM
+            invoice_data, _ = apply_totals(invoice_data)
+        if os.path.exists(TEMPLATE_PATH):
+            # Điền dữ liệu vào template.docx đã biên dịch sẵn (invoice_template)
+            get_invoice_template().save(invoice_data, output_path + '.docx')
+            return f'Đã tạo thành công hóa đơn {output_path}.docx'
+
         doc = Document()
         
         # Tiêu đề hóa đơn
@@ -111,22 +146,16 @@ def create_invoice_docx(invoice_data: InvoiceDetails, output_path: str) -> str:
         
         # Bảng hàng hóa
         if invoice_data.du_lieu_bang and len(invoice_data.du_lieu_bang) > 0:
-            # Tạo bảng
-            table = doc.add_table(rows=len(invoice_data.du_lieu_bang), cols=len(invoice_data.du_lieu_bang[0]))
-            table.style = 'Table Grid'
-            
-            # Điền dữ liệu vào bảng
-            for i, row in enumerate(invoice_data.du_lieu_bang):
-                for j, value in enumerate(row):
-                    cell = table.cell(i, j)
-                    cell.text = str(value) if value is not None else ""
-                    
-                    # Định dạng header
-                    if i == 0:  # Header row
-                        for paragraph in cell.paragraphs:
-                            for run in paragraph.runs:
-                                run.bold = True
-                                run.font.name = 'Times New Roman'
+            # Ghi toàn bộ các dòng trong một lượt, dòng tiêu đề in đậm qua table style
+            add_table_rows(doc, invoice_data.du_lieu_bang, style_name='Table Grid')
+
+        # Các số tổng (invoice_totals)
+        if invoice_data.tong_tien_hang:
+            doc.add_paragraph(f'Cộng tiền hàng: {invoice_data.tong_tien_hang}')
+        if invoice_data.thue_suat_gtgt:
+            doc.add_paragraph(f'Thuế suất GTGT: {invoice_data.thue_suat_gtgt}    Tiền thuế GTGT: {invoice_data.tien_thue_gtgt}')
+        doc.add_paragraph(f'Tổng tiền thanh toán: {invoice_data.tong_thanh_toan or ""}')
+        doc.add_paragraph(f'Số tiền bằng chữ: {invoice_data.so_tien_bang_chu or ""}')
         
         # Lưu file
         doc.save(output_path + '.docx')
@@ -135,18 +164,28 @@ def create_invoice_docx(invoice_data: InvoiceDetails, output_path: str) -> str:
     except Exception as e:
         return f'Lỗi {e} khi tạo hóa đơn {output_path}'
 @tool
-def get_prompt_for_data_excel(data_excel_str: List[List[str]]) -> str:
+@traced("tool.get_prompt_for_data_excel")
+def get_prompt_for_data_excel(data_excel_str: Union[str, List[List[str]]], token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET) -> str:
     """Tạo prompt hướng dẫn LLM trích xuất thông tin từ dữ liệu Excel
 
     Args:
-        data_excel_str (List[List[str]]): Dữ liệu Excel dưới dạng list of lists
+        data_excel_str (str | List[List[str]]): Handle 'artifact:...' do read_excel_data trả về hoặc dữ liệu Excel dạng list of lists
+        token_budget (int, optional): Số token tối đa cho phần dữ liệu Excel, vượt quá thì lược bớt đuôi bảng hàng
 
     Returns:
         str: Prompt được tạo để hướng dẫn LLM
     """
+    # Dữ liệu dạng TSV gọn thay cho repr của list (bỏ nan, hàng/cột trống, 150000.0 -> 150000)
+    if isinstance(data_excel_str, str):
+        try:
+            data_excel_str = get_artifact_store().get(parse_handle(data_excel_str))
+        except KeyError as e:
+            return f"Lỗi: {e}, hãy đọc lại file Excel bằng read_excel_data"
+    data_tsv, stats = serialize_sheet(data_excel_str, token_budget=token_budget)
+    log_prompt_stats(stats, source="agent")
     prompt = f"""
-    DỮ LIỆU EXCEL CẦN PHÂN TÍCH:
-    {data_excel_str}
+    DỮ LIỆU EXCEL CẦN PHÂN TÍCH (mỗi dòng là một hàng, các ô cách nhau bằng dấu tab, ô trống đã được bỏ):
+{data_tsv}
 
     HÃY TRÍCH XUẤT THÔNG TIN SAU ĐÂY TỪ DỮ LIỆU EXCEL TRÊN:
 
@@ -184,7 +223,49 @@ def get_prompt_for_data_excel(data_excel_str: List[List[str]]) -> str:
     LƯU Ý: 
     - Nếu không tìm thấy thông tin nào, hãy để giá trị None hoặc chuỗi rỗng
     - Đảm bảo dữ liệu bảng hàng hóa có đúng định dạng list of lists
-    - Tính toán lại thành tiền = số lượng x đơn giá nếu cần
+    - Giữ nguyên số lượng, đơn giá, thành tiền như trong file, không cần tự tính: thành tiền và các số tổng được tính lại tự động
     """
-    print(f"--- TOOL: Đang lấy prompt ---")
+    log(f"--- TOOL: Đang lấy prompt ---")
     return prompt
+
+def make_create_invoice_from_excel(llm):
+    """Tạo tool làm trọn quy trình Excel -> hoá đơn DOCX bằng chính model của Agent (hoặc ModelCascade)
+
+    Agent chỉ cần gọi một tool thay vì ba (đọc file -> lấy prompt -> tạo hoá đơn), việc trích xuất
+    dùng luật và một lần gọi LLM có structured output trả thẳng về InvoiceDetails.
+    """
+    @tool
+    @traced("tool.create_invoice_from_excel")
+    def create_invoice_from_excel(file_path: str, output_path: str, sheet_name: Optional[Union[str, int]] = None) -> str:
+        """Đọc file Excel hoá đơn, trích xuất thông tin và tạo file DOCX hoá đơn trong một bước
+        Args:
+            file_path (str): Tên file Excel cần đọc hoặc handle 'artifact:...' do read_excel_data trả về
+            output_path (str): Tên file hoá đơn đầu ra (không cần đuôi .docx)
+            sheet_name (str | int, optional): Tên hoặc vị trí sheet, mặc định là sheet đầu tiên
+
+        Returns:
+            str: Thông báo kết quả tạo hoá đơn hoặc thông báo lỗi
+        """
+        log(f"--- TOOL: Đang tạo hoá đơn từ file: {file_path} ---")
+        try:
+            if is_handle(parse_handle(file_path)):
+                # Dữ liệu đã đọc trước đó bằng read_excel_data
+                rows = get_artifact_store().get(parse_handle(file_path))
+            else:
+                rows = cached_read_excel_rows(file_path, sheet_name=sheet_name)
+        except KeyError as e:
+            return f"Lỗi: {e}, hãy đọc lại file Excel bằng read_excel_data"
+        except FileNotFoundError:
+            return "Lỗi: Không tìm thấy file Excel."
+        except Exception as e:
+            return f"Lỗi khi đọc file Excel: {e}"
+        try:
+            invoice, field_sources = extract_invoice(llm, rows)
+        except Exception as e:
+            return f"Lỗi khi trích xuất thông tin hoá đơn: {e}"
+        rule_count = sum(1 for source in field_sources.values() if source == "rule")
+        llm_count = sum(1 for source in field_sources.values() if source == "llm")
+        log(f"✅ Đã trích xuất {rule_count + llm_count} trường ({rule_count} bằng luật, {llm_count} bằng LLM)")
+        return create_invoice_docx.func(invoice, output_path)
+
+    return create_invoice_from_excel
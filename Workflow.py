@@ -1,22 +1,69 @@
-from typing import TypedDict, List
+import asyncio
+import os
+import time
+from typing import TypedDict, List, Dict, Any, AsyncIterator, Iterator, Optional, Tuple
 from uuid import uuid4
 
-from langgraph.graph import StateGraph, END, START
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Load environment variables
 load_dotenv()
 
-# Initialize LLM
-llm = ChatGoogleGenerativeAI(model='gemini-2.5-flash')
 # Import your existing tools
 from tools import (
     read_excel_data,
-    get_prompt_for_data_excel,
-    create_invoice_docx,
+    render_invoice_docx,
+    render_invoice_bytes,
     InvoiceDetails,
 )
+import invoice_extractor
+import model_cascade
+from artifact_store import get_artifact_store
+from llm_cache import cached_invoke, acached_invoke
+from intent_router import route_intent, log_decision, RouteDecision
+from llm_limiter import is_overloaded, limited
+from tracing import log, mark_error, record_ttft, span, traced
+
+# Client LLM và graph được tạo khi dùng lần đầu (get_llm / get_app) thay vì lúc import,
+# để CLI và các process worker không phải nạp langchain_google_genai / langgraph khi chưa cần
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+_llm = None
+_app = None
+
+def get_llm():
+    """Client LLM dùng chung, tạo ChatGoogleGenerativeAI ở lần gọi đầu tiên (đi qua bộ giới hạn llm_limiter)"""
+    global _llm
+    if _llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # max_retries=1 là chỉ gọi một lần, việc gọi lại khi lỗi 429/5xx do llm_limiter quyết định
+        _llm = limited(ChatGoogleGenerativeAI(model=LLM_MODEL, max_retries=1))
+    return _llm
+
+def get_extractor():
+    """Model cho bước trích xuất: cascade model local rồi get_llm() khi EXTRACT_CASCADE=1, ngược lại get_llm()"""
+    if model_cascade.CASCADE_ENABLED:
+        return model_cascade.build_cascade(remote=get_llm())
+    return get_llm()
+
+def set_llm(llm) -> None:
+    """Thay client LLM dùng chung (model khác, model giả khi đo benchmark, ...)"""
+    global _llm
+    _llm = llm
+
+def get_app():
+    """Graph đã compile dùng chung, build ở lần gọi đầu tiên"""
+    global _app
+    if _app is None:
+        _app = build_graph()
+    return _app
+
+def __getattr__(name: str):
+    # Giữ tương thích với code cũ dùng Workflow.llm / Workflow.app
+    if name == "llm":
+        return get_llm()
+    if name == "app":
+        return get_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # -------------------------
 # 1. Khai báo AgentState
@@ -24,23 +71,77 @@ from tools import (
 class AgentState(TypedDict):
     user_request: str
     file_name: str
-    raw_data: List[List[str]]
+    raw_data_ref: str  # handle của dữ liệu Excel trong artifact_store, không giữ cả sheet trong state
     extracted_data: InvoiceDetails
     final_docx: str
+    output_in_memory: bool  # True thì create_docx chỉ dựng file trong bộ nhớ (docx_bytes), không ghi ra đĩa
+    docx_bytes: bytes
     response: str
     should_process_invoice: bool
+    field_sources: Dict[str, str]
 
 # -------------------------
 # 2. LLM Chat Node - Xử lý câu hỏi và trả lời
 # -------------------------
 def llm_chat_node(state: AgentState) -> AgentState:
     """Node LLM để chat và xử lý câu hỏi từ user."""
-    print("💬 LLM đang xử lý câu hỏi...")
-    
+    log("💬 LLM đang xử lý câu hỏi...")
+    chat_prompt, llm_routed = _prepare_chat(state)
+    if chat_prompt is not None:
+        # Gọi LLM (có cache, tắt bằng LLM_CACHE_DISABLED_NODES=llm_chat)
+        try:
+            llm_response = cached_invoke(get_llm(), chat_prompt, node="llm_chat")
+            _apply_chat_response(state, llm_response, llm_routed)
+        except Exception as e:
+            _chat_error(state, e)
+    return _require_file_name(state)
+
+async def allm_chat_node(state: AgentState) -> AgentState:
+    """Bản async của llm_chat_node, gọi LLM bằng ainvoke để không chặn event loop"""
+    log("💬 LLM đang xử lý câu hỏi...")
+    chat_prompt, llm_routed = _prepare_chat(state)
+    if chat_prompt is not None:
+        try:
+            llm_response = await acached_invoke(get_llm(), chat_prompt, node="llm_chat")
+            _apply_chat_response(state, llm_response, llm_routed)
+        except Exception as e:
+            _chat_error(state, e)
+    return _require_file_name(state)
+
+def _chat_error(state: AgentState, error: Exception) -> None:
+    """Câu trả lời khi gọi LLM lỗi, model quá tải (đã gọi lại hết lượt) thì báo người dùng thử lại sau"""
+    state["should_process_invoice"] = False
+    if is_overloaded(error):
+        state["response"] = "Xin lỗi, dịch vụ AI đang quá tải, vui lòng thử lại sau ít phút."
+    else:
+        state["response"] = f"Xin lỗi, có lỗi xảy ra: {str(error)}"
+
+def _prepare_chat(state: AgentState) -> Tuple[Optional[str], bool]:
+    """Định tuyến cục bộ trước, trả về prompt cần gửi LLM (None nếu không cần gọi LLM)
+    và cờ cho biết LLM có phải tự quyết định định tuyến hay không"""
     user_question = state["user_request"]
-    
-    # Tạo prompt cho LLM
-    chat_prompt = f"""
+    decision = route_intent(user_question)
+    # file_name truyền sẵn trong state (API đã kiểm tra đường dẫn) được ưu tiên hơn tên file trong câu
+    if decision["file_name"] and not state.get("file_name"):
+        state["file_name"] = decision["file_name"]
+
+    if decision["route"] == "invoice":
+        state["should_process_invoice"] = True
+        state["response"] = f"Tôi sẽ giúp bạn tạo hóa đơn từ file Excel {state.get('file_name', '')}".strip()
+        return None, False
+    if decision["route"] == "chat":
+        return f"""
+Bạn là một trợ lý AI thông minh chuyên về xử lý hóa đơn và kế toán.
+
+Người dùng hỏi: "{user_question}"
+
+Hãy trả lời trực tiếp một cách thân thiện và hữu ích.
+
+Trả lời:
+""", False
+
+    # Router cục bộ không đủ tin cậy, để LLM vừa định tuyến vừa trả lời
+    return f"""
 Bạn là một trợ lý AI thông minh chuyên về xử lý hóa đơn và kế toán.
 
 Người dùng hỏi: "{user_question}"
@@ -54,25 +155,40 @@ Ví dụ:
 - "Hôm nay thế nào?" → "Tôi đang sẵn sàng hỗ trợ bạn! Bạn có cần giúp đỡ gì về hóa đơn không?"
 
 Trả lời:
-"""
-    
-    # Gọi LLM
-    try:
-        llm_response = llm.invoke(chat_prompt)
-        response_content = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
-        
-        # Kiểm tra xem có cần xử lý hóa đơn không
-        if "PROCESS_INVOICE:" in response_content:
-            state["should_process_invoice"] = True
-            state["response"] = response_content.replace("PROCESS_INVOICE:", "").strip()
-        else:
-            state["should_process_invoice"] = False
-            state["response"] = response_content
-            
-    except Exception as e:
+""", True
+
+# Tiền tố LLM dùng để báo cần tạo hoá đơn (xem _prepare_chat), không hiển thị cho người dùng
+PROCESS_INVOICE_MARKER = "PROCESS_INVOICE:"
+
+def _apply_chat_response(state: AgentState, llm_response: Any, llm_routed: bool) -> None:
+    """Ghi câu trả lời của LLM vào state"""
+    response_content = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
+    if not llm_routed:
         state["should_process_invoice"] = False
-        state["response"] = f"Xin lỗi, có lỗi xảy ra: {str(e)}"
-    
+        state["response"] = response_content
+        return
+
+    # Kiểm tra xem có cần xử lý hóa đơn không
+    if PROCESS_INVOICE_MARKER in response_content:
+        state["should_process_invoice"] = True
+        state["response"] = response_content.replace(PROCESS_INVOICE_MARKER, "").strip()
+    else:
+        state["should_process_invoice"] = False
+        state["response"] = response_content
+
+    # Quyết định của LLM được ghi lại làm nhãn để huấn luyện bộ phân loại của router
+    log_decision(state["user_request"], RouteDecision(
+        route="invoice" if state["should_process_invoice"] else "chat",
+        confidence=1.0,
+        source="llm",
+        file_name=state.get("file_name"),
+    ))
+
+def _require_file_name(state: AgentState) -> AgentState:
+    """Không có tên file thì chưa thể đọc Excel, hỏi lại người dùng"""
+    if state["should_process_invoice"] and not state.get("file_name"):
+        state["should_process_invoice"] = False
+        state["response"] = "Tôi sẽ giúp bạn tạo hóa đơn từ file Excel. Hãy cung cấp tên file Excel (.xlsx) của bạn."
     return state
 
 # -------------------------
@@ -80,78 +196,160 @@ Trả lời:
 # -------------------------
 def read_excel_node(state: AgentState) -> AgentState:
     """Đọc dữ liệu từ Excel"""
-    print("📥 Đọc dữ liệu từ Excel...")
+    log("📥 Đọc dữ liệu từ Excel...")
     # try:
-    state["raw_data"] = read_excel_data(file_path=state["file_name"])
-    print(f"✅ Đã đọc {len(state['raw_data'])} dòng dữ liệu")
+    _store_raw_data(state, read_excel_data(file_path=state["file_name"]))
     # except Exception as e:
     #     print(f"❌ Lỗi đọc Excel: {e}")
     #     state["response"] = f"Lỗi khi đọc file Excel: {str(e)}"
     
     return state
 
+async def aread_excel_node(state: AgentState) -> AgentState:
+    """Bản async của read_excel_node, đọc file trong thread riêng để không chặn event loop"""
+    log("📥 Đọc dữ liệu từ Excel...")
+    _store_raw_data(state, await asyncio.to_thread(read_excel_data, file_path=state["file_name"]))
+    return state
+
+def _store_raw_data(state: AgentState, raw_data) -> None:
+    """Lưu dữ liệu Excel vào artifact_store, state chỉ giữ handle"""
+    if isinstance(raw_data, str):
+        # read_excel_data trả về chuỗi thông báo lỗi
+        state["response"] = raw_data
+        return
+    state["raw_data_ref"] = get_artifact_store().put(raw_data)
+    log(f"✅ Đã đọc {len(raw_data)} dòng dữ liệu ({state['raw_data_ref'][:25]}...)")
+
+def extract_invoice(raw_data: List[List[str]]) -> Tuple[InvoiceDetails, Dict[str, str]]:
+    """Trích xuất InvoiceDetails từ dữ liệu Excel: dùng luật trước, các trường còn thiếu
+    lấy bằng LLM có structured output (xem invoice_extractor, model_cascade)
+
+    Args:
+        raw_data (List[List[str]]): Dữ liệu Excel dưới dạng list of lists
+
+    Returns:
+        Tuple[InvoiceDetails, Dict[str, str]]: Hoá đơn và nguồn của từng trường ("rule", "llm" hoặc "computed")
+    """
+    return invoice_extractor.extract_invoice(get_extractor(), raw_data)
+
 def extract_info_node(state: AgentState) -> AgentState:
     """Trích xuất thông tin từ dữ liệu Excel"""
-    print("🧠 Trích xuất thông tin từ dữ liệu Excel...")
+    log("🧠 Trích xuất thông tin từ dữ liệu Excel...")
     try:
-        prompt = get_prompt_for_data_excel(data_excel_str=state["raw_data"])
-        llm_response = llm.invoke(prompt)
-        response_content = llm_response.content if hasattr(llm_response, 'content') else str(llm_response)
-        
-        # TODO: Parse JSON response để tạo InvoiceDetails
-        # Hiện tại chỉ lưu response string
-        state["response"] = f"✅ Đã trích xuất thông tin: {response_content[:200]}..."
+        state["extracted_data"], field_sources = extract_invoice(_checked_raw_data(state))
+        _set_field_sources(state, field_sources)
         
     except Exception as e:
-        print(f"❌ Lỗi trích xuất: {e}")
+        log(f"❌ Lỗi trích xuất: {e}")
+        mark_error(e)
         state["response"] = f"Lỗi khi trích xuất thông tin: {str(e)}"
     
     return state
 
+async def aextract_info_node(state: AgentState) -> AgentState:
+    """Bản async của extract_info_node, gọi LLM bằng ainvoke"""
+    log("🧠 Trích xuất thông tin từ dữ liệu Excel...")
+    try:
+        state["extracted_data"], field_sources = await invoice_extractor.aextract_invoice(get_extractor(), _checked_raw_data(state))
+        _set_field_sources(state, field_sources)
+    except Exception as e:
+        log(f"❌ Lỗi trích xuất: {e}")
+        mark_error(e)
+        state["response"] = f"Lỗi khi trích xuất thông tin: {str(e)}"
+    return state
+
+def _checked_raw_data(state: AgentState) -> List[List[str]]:
+    """Dữ liệu Excel lấy lại từ artifact_store theo handle trong state"""
+    if not state.get("raw_data_ref"):
+        raise ValueError(state.get("response") or "Chưa đọc được dữ liệu Excel")
+    return get_artifact_store().get(state["raw_data_ref"])
+
+def _set_field_sources(state: AgentState, field_sources: Dict[str, str]) -> None:
+    state["field_sources"] = field_sources
+    rule_count = sum(1 for source in field_sources.values() if source == "rule")
+    llm_count = sum(1 for source in field_sources.values() if source == "llm")
+    state["response"] = (
+        f"✅ Đã trích xuất {rule_count + llm_count} trường "
+        f"({rule_count} bằng luật, {llm_count} bằng LLM), {len(field_sources) - rule_count - llm_count} trường tính lại"
+    )
+
 def create_docx_node(state: AgentState) -> AgentState:
     """Tạo file hóa đơn DOCX"""
-    print("📄 Tạo file hoá đơn DOCX...")
+    log("📄 Tạo file hoá đơn DOCX...")
     try:
+        if state.get("output_in_memory"):
+            state["docx_bytes"] = render_invoice_bytes(state["extracted_data"])
+            state["response"] = f"🎉 Đã tạo hóa đơn thành công ({len(state['docx_bytes'])} byte)"
+            return state
+
         if not state.get("final_docx"):
             state["final_docx"] = f"invoice_{uuid4().hex[:6]}.docx"
 
-        output_path = create_invoice_docx(
+        # render_invoice_docx tự thêm đuôi .docx và ném lỗi thay vì trả về chuỗi thông báo
+        output_path = render_invoice_docx(
             invoice_data=state["extracted_data"],
-            output_path=state["final_docx"],
+            output_path=os.path.splitext(state["final_docx"])[0],
         )
         state["final_docx"] = output_path
         state["response"] = f"🎉 Đã tạo hóa đơn thành công tại: {output_path}"
         
     except Exception as e:
-        print(f"❌ Lỗi tạo DOCX: {e}")
+        log(f"❌ Lỗi tạo DOCX: {e}")
+        mark_error(e)
         state["response"] = f"Lỗi khi tạo file DOCX: {str(e)}"
     
     return state
 
+async def acreate_docx_node(state: AgentState) -> AgentState:
+    """Bản async của create_docx_node, ghi DOCX trong thread riêng để không chặn event loop"""
+    return await asyncio.to_thread(create_docx_node, state)
+
 # -------------------------
 # 4. Function để định tuyến
 # -------------------------
 def determine_next_step(state: AgentState) -> str:
     """Xác định bước tiếp theo dựa trên state"""
     if state.get("should_process_invoice", False):
-        print("🧭 Routing: Chuyển đến xử lý hóa đơn")
+        log("🧭 Routing: Chuyển đến xử lý hóa đơn")
         return "read_excel"
     else:
-        print("🧭 Routing: Chỉ chat, kết thúc")
+        log("🧭 Routing: Chỉ chat, kết thúc")
         return "end"
 
+def after_read_excel(state: AgentState) -> str:
+    """Không đọc được dữ liệu Excel thì dừng, giữ nguyên thông báo lỗi của bước đọc trong response"""
+    if state.get("raw_data_ref"):
+        return "extract_info"
+    log("🧭 Routing: Không đọc được dữ liệu Excel, kết thúc")
+    return "end"
+
+def after_extract_info(state: AgentState) -> str:
+    """Trích xuất lỗi thì dừng thay vì tạo DOCX từ dữ liệu không có (create_docx sẽ ghi đè lỗi thật)"""
+    if state.get("extracted_data") is not None:
+        return "create_docx"
+    log("🧭 Routing: Trích xuất lỗi, kết thúc")
+    return "end"
+
 # -------------------------
 # 5. Xây dựng LangGraph
 # -------------------------
 def build_graph():
     """Xây dựng và trả về graph"""
+    from langgraph.graph import StateGraph, END
+    from langchain_core.runnables import RunnableLambda
+
     graph_builder = StateGraph(AgentState)
 
-    # Thêm các nodes
-    graph_builder.add_node(node= "llm_chat", action= llm_chat_node)
-    graph_builder.add_node("read_excel", read_excel_node)
-    graph_builder.add_node("extract_info", extract_info_node)
-    graph_builder.add_node("create_docx", create_docx_node)
+    # Thêm các nodes: mỗi node có cả bản sync và async, app.invoke chạy bản sync còn app.ainvoke chạy bản async
+    # mỗi node được bọc trong một span (tracing) để đo thời gian, thời gian LLM, token và cache hit
+    nodes = {
+        "llm_chat": (llm_chat_node, allm_chat_node),
+        "read_excel": (read_excel_node, aread_excel_node),
+        "extract_info": (extract_info_node, aextract_info_node),
+        "create_docx": (create_docx_node, acreate_docx_node),
+    }
+    for name, (func, afunc) in nodes.items():
+        graph_builder.add_node(name, RunnableLambda(traced(f"node.{name}")(func), afunc= traced(f"node.{name}")(afunc), name= name))
 
     # Set entry point
     graph_builder.set_entry_point("llm_chat")
@@ -166,21 +364,155 @@ def build_graph():
         },
     )
 
-    # Thêm các edges tuần tự cho quy trình xử lý hóa đơn
-    graph_builder.add_edge(start_key="read_excel", end_key= "extract_info")
-    graph_builder.add_edge("extract_info", "create_docx")
+    # Quy trình xử lý hóa đơn: bước nào lỗi thì kết thúc luôn để response giữ đúng nguyên nhân
+    graph_builder.add_conditional_edges(
+        source= "read_excel",
+        path= after_read_excel,
+        path_map= {
+            "extract_info": "extract_info",
+            "end": END,
+        },
+    )
+    graph_builder.add_conditional_edges(
+        source= "extract_info",
+        path= after_extract_info,
+        path_map= {
+            "create_docx": "create_docx",
+            "end": END,
+        },
+    )
     graph_builder.add_edge("create_docx", END)
 
     return graph_builder.compile()
 
-# Compile graph
-app = build_graph()
+async def arun_requests(user_requests: List[str], max_concurrency: int = 32) -> List[AgentState]:
+    """Chạy nhiều yêu cầu cùng lúc trên một event loop bằng app.ainvoke
+
+    Args:
+        user_requests (List[str]): Các câu của người dùng, mỗi câu là một lượt graph độc lập
+        max_concurrency (int): Số lượt graph (và lời gọi LLM) chạy đồng thời tối đa
+
+    Returns:
+        List[AgentState]: State cuối của từng yêu cầu, theo đúng thứ tự đầu vào
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(user_request: str) -> AgentState:
+        async with semaphore:
+            with span("graph.request"):
+                return await get_app().ainvoke({"user_request": user_request})
+
+    return await asyncio.gather(*(run(user_request) for user_request in user_requests))
+
+class _StreamEvents:
+    """Chuyển các khúc của app.stream(stream_mode=["messages", "updates"]) thành sự kiện cho người dùng
+
+    - "messages": token của LLM trong node llm_chat, bỏ tiền tố PROCESS_INVOICE_MARKER ở đầu câu trả lời
+    - "updates": một node vừa chạy xong, phần state node đó trả về được gộp lại để dựng kết quả cuối
+    """
+
+    def __init__(self, surface: str):
+        self.surface = surface
+        self.start = time.perf_counter()
+        self.ttft: Optional[float] = None
+        self.state: Dict[str, Any] = {}
+        self.streamed = ""
+        self._head = ""  # phần đầu câu trả lời, giữ lại tới khi biết có phải tiền tố hay không
+        self._head_checked = False
+
+    def handle(self, mode: str, payload: Any) -> List[Dict[str, Any]]:
+        if mode == "updates":
+            events = []
+            for node, update in payload.items():
+                if isinstance(update, dict):
+                    self.state.update(update)
+                    if node == "llm_chat" and not self.streamed and update.get("response"):
+                        # Trúng cache hoặc định tuyến cục bộ không gọi LLM: gửi cả câu trả lời ngay khi node xong
+                        events += self._token(update["response"])
+                events.append({"event": "node", "node": node})
+            return events
+        chunk, metadata = payload
+        if metadata.get("langgraph_node") != "llm_chat":
+            return []
+        return self._token(_chunk_text(chunk))
+
+    def _token(self, text: str) -> List[Dict[str, Any]]:
+        if not self._head_checked:
+            self._head += text
+            head = self._head.lstrip()
+            if len(head) < len(PROCESS_INVOICE_MARKER) and PROCESS_INVOICE_MARKER.startswith(head):
+                return []
+            self._head_checked = True
+            text = head[len(PROCESS_INVOICE_MARKER):].lstrip() if head.startswith(PROCESS_INVOICE_MARKER) else self._head
+        if not text:
+            return []
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.start
+            record_ttft(self.surface, self.ttft)
+        self.streamed += text
+        return [{"event": "token", "text": text}]
+
+    def finish(self) -> List[Dict[str, Any]]:
+        events = []
+        if not self._head_checked and self._head.strip():
+            # Câu trả lời ngắn hơn tiền tố, chưa được gửi
+            self._head_checked = True
+            events += self._token(self._head)
+        total = time.perf_counter() - self.start
+        done = {
+            "event": "done",
+            "response": self.state.get("response", ""),
+            "final_docx": self.state.get("final_docx"),
+            "should_process_invoice": bool(self.state.get("should_process_invoice")),
+            "ttft_ms": round(self.ttft * 1000, 3) if self.ttft is not None else None,
+            "total_ms": round(total * 1000, 3),
+        }
+        if self.state.get("docx_bytes"):
+            done["docx_bytes"] = self.state["docx_bytes"]
+        return events + [done]
+
+def _chunk_text(chunk: Any) -> str:
+    """Phần chữ của một khúc câu trả lời (content có thể là chuỗi hoặc list các phần)"""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content if isinstance(part, dict) and part.get("type") == "text")
+
+def stream_request(user_request: str, surface: str = "cli", **state: Any) -> Iterator[Dict[str, Any]]:
+    """Chạy một lượt graph dạng stream, trả về dần các sự kiện
+
+    Args:
+        user_request (str): Câu của người dùng
+        surface (str): Nơi hiển thị câu trả lời (cli, api, ...), dùng làm nhãn của metric invoice_ttft_seconds
+        **state: Các trường khác của AgentState (file_name, output_in_memory, ...)
+
+    Yields:
+        Dict[str, Any]: {"event": "token", "text"} từng đoạn câu trả lời của LLM,
+            {"event": "node", "node"} khi một node chạy xong,
+            {"event": "done", "response", "final_docx", "should_process_invoice", "ttft_ms", "total_ms"} ở cuối
+            (kèm "docx_bytes" khi output_in_memory)
+    """
+    events = _StreamEvents(surface)
+    with span("graph.request", stream=True):
+        for mode, payload in get_app().stream({"user_request": user_request, **state}, stream_mode=["messages", "updates"]):
+            yield from events.handle(mode, payload)
+        yield from events.finish()
+
+async def astream_request(user_request: str, surface: str = "api", **state: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Bản async của stream_request, dùng app.astream (các node chạy bản async)"""
+    events = _StreamEvents(surface)
+    with span("graph.request", stream=True):
+        async for mode, payload in get_app().astream({"user_request": user_request, **state}, stream_mode=["messages", "updates"]):
+            for event in events.handle(mode, payload):
+                yield event
+        for event in events.finish():
+            yield event
 
 # -------------------------
 # 6. Interactive Chat Function
 # -------------------------
 def chat_with_agent():
-    """Hàm chat tương tác với agent"""
+    """Hàm chat tương tác với agent, câu trả lời được in dần từng token"""
     print("🤖 Chào mừng! Tôi có thể giúp gì cho bạn?")
     print("(Gõ 'quit' để thoát)")
     
@@ -195,39 +527,32 @@ def chat_with_agent():
             continue
         
         try:
-            # Tạo state cho câu hỏi
-            initial_state = {
-                "user_request": user_input,
-                # "file_name": "test1.xlsx",  # Default file name
-                # "raw_data": [],
-                # "extracted_data": InvoiceDetails(
-                #     ten_nguoi_ban="",
-                #     dia_chi_nguoi_ban="",
-                #     ten_nguoi_mua="",
-                #     dia_chi_nguoi_mua="",
-                #     ngay_hoa_don="",
-                #     danh_sach_san_pham=[],
-                #     tong_cong=0.0,
-                #     thue_vat=0.0,
-                #     tong_thanh_toan=0.0,
-                # ),
-                # "final_docx": "",
-                # "response": "",
-                # "should_process_invoice": False
-            }
-            
-            # Chạy agent
-            result = app.invoke(initial_state)
-            
-            # In response
-            print(f"🤖 Agent: {result['response']}")
+            # Chạy agent dạng stream: in token ngay khi LLM trả về, các bước xử lý hoá đơn in trên dòng riêng
+            print("🤖 Agent: ", end="", flush=True)
+            result: Dict[str, Any] = {}
+            streamed = ""
+            for event in stream_request(user_input, surface="cli"):
+                if event["event"] == "token":
+                    print(event["text"], end="", flush=True)
+                    streamed += event["text"]
+                elif event["event"] == "node" and event["node"] != "llm_chat":
+                    print(f"\n   ⚙️ Xong bước {event['node']}", end="", flush=True)
+                elif event["event"] == "done":
+                    result = event
+            print()
+
+            # Sau khi xử lý hoá đơn thì câu trả lời cuối khác câu đã stream
+            if result.get("response") and result["response"].strip() != streamed.strip():
+                print(f"🤖 Agent: {result['response']}")
             
             # Nếu có tạo file thì thông báo
             if result.get('final_docx') and result['final_docx'] != "":
                 print(f"📁 File đã tạo: {result['final_docx']}")
+            if result.get("ttft_ms") is not None:
+                print(f"⏱️ Token đầu tiên sau {result['ttft_ms']:.0f} ms, tổng {result['total_ms']:.0f} ms")
                 
         except Exception as e:
-            print(f"❌ Lỗi: {e}")
+            print(f"\n❌ Lỗi: {e}")
 
 # -------------------------
 # 7. Main execution
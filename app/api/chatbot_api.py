@@ -1,15 +1,349 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from uuid import uuid4
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.background import BackgroundTask
+
+from schema.Job import BatchRequest, InvoiceRequest, JobStatus
 from schema.Message import Message
-from
+from tracing import METRICS, log, span
+from zip_export import QueueStream
+
 router = APIRouter()
 
-@router.on_event("startup")
-def startup():
+# Giới hạn hàng đợi và số worker, đổi bằng biến môi trường
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "32"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Job chờ trong hàng đợi quá lâu thì bỏ (expired) thay vì chạy muộn, job chạy quá lâu thì huỷ
+JOB_MAX_WAIT_SECONDS = float(os.getenv("JOB_MAX_WAIT_SECONDS", "120"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+# Số job đã xong được giữ lại để tra cứu trạng thái / tải kết quả
+JOB_HISTORY = int(os.getenv("JOB_HISTORY", "1000"))
+# Số kết nối /chat/stream mở cùng lúc tối đa (mỗi kết nối giữ một lượt graph đang chạy)
+STREAM_MAX_SESSIONS = int(os.getenv("STREAM_MAX_SESSIONS", "16"))
+# Số lượt xuất ZIP /invoices/batch chạy cùng lúc tối đa và số process tối đa của mỗi lượt
+BATCH_MAX_EXPORTS = int(os.getenv("BATCH_MAX_EXPORTS", "2"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", str(os.cpu_count() or 1)))
+# Service chỉ đọc file Excel trong thư mục này (file_name của mọi endpoint và tên file trong câu chat)
+INPUT_DIR = os.path.realpath(os.getenv("INPUT_DIR", os.getcwd()))
+# Client bị từ chối (429) nên thử lại sau số giây này
+RETRY_AFTER_SECONDS = 5
 
+_graph: Any = None
+_queue: Optional[asyncio.Queue] = None
+_workers = []
+_jobs: "OrderedDict[str, JobStatus]" = OrderedDict()
+# Nội dung file hoá đơn của job đã xong, giữ trong bộ nhớ (không ghi file tạm ra đĩa)
+_results: Dict[str, bytes] = {}
+_active_streams = 0
+_batch_slots = threading.BoundedSemaphore(BATCH_MAX_EXPORTS)
 
-@router.post("/chat")
-def chat(message: Message):
 
-from fastapi import APIRouter
+async def startup():
+    """Dựng graph (và client LLM) một lần, tạo hàng đợi và các worker"""
+    global _graph, _queue
+    import Workflow
 
-router = APIRouter()
+    Workflow.get_llm()
+    _graph = Workflow.get_app()
+    _queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    _workers.extend(asyncio.create_task(_worker(i)) for i in range(JOB_WORKERS))
+    log(f"🚀 Đã khởi động {JOB_WORKERS} worker, hàng đợi tối đa {JOB_QUEUE_SIZE} job")
+
+
+async def shutdown():
+    for worker in _workers:
+        worker.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Dùng cho FastAPI(lifespan=...): khởi động worker khi service chạy, dừng khi tắt"""
+    await startup()
+    yield
+    await shutdown()
+
+
+async def _worker(worker_id: int) -> None:
+    """Lấy job từ hàng đợi và chạy graph bằng ainvoke"""
+    while True:
+        job_id, initial_state = await _queue.get()
+        job = _jobs.get(job_id)
+        try:
+            if job is None:
+                continue
+            job.started_at = time.time()
+            if job.started_at - job.created_at > JOB_MAX_WAIT_SECONDS:
+                job.status = "expired"
+                job.error = f"Job chờ quá {JOB_MAX_WAIT_SECONDS:.0f} giây trong hàng đợi"
+                continue
+
+            job.status = "running"
+            with span("graph.request", job_id=job_id):
+                result = await asyncio.wait_for(_graph.ainvoke(initial_state), timeout=JOB_TIMEOUT_SECONDS)
+            job.response = result.get("response")
+            if result.get("docx_bytes"):
+                _results[job_id] = result["docx_bytes"]
+                job.result_url = f"/jobs/{job_id}/result"
+            job.status = "failed" if result.get("should_process_invoice") and not job.result_url else "done"
+            if job.status == "failed":
+                # Bước đọc / trích xuất / tạo DOCX lỗi: nguyên nhân nằm trong response
+                job.error = result.get("response")
+        except asyncio.TimeoutError:
+            job.status = "failed"
+            job.error = f"Quá thời gian xử lý {JOB_TIMEOUT_SECONDS:.0f} giây"
+        except Exception as e:
+            log(f"❌ Worker {worker_id} lỗi ở job {job_id}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            if job is not None:
+                job.finished_at = time.time()
+            _queue.task_done()
+
+
+def _forget_old_jobs() -> None:
+    """Giữ tối đa JOB_HISTORY job, bỏ các job đã kết thúc cũ nhất (kèm nội dung file kết quả)"""
+    for job_id in list(_jobs):
+        if len(_jobs) <= JOB_HISTORY:
+            break
+        if _jobs[job_id].finished_at is None:
+            continue
+        del _jobs[job_id]
+        _results.pop(job_id, None)
+
+
+def _busy(detail: str) -> JSONResponse:
+    """Từ chối request khi service đang quá tải: 429 kèm Retry-After"""
+    return JSONResponse(status_code=429, content={"detail": detail}, headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def _input_path(file_name: str) -> str:
+    """Đường dẫn thật của file Excel, chỉ chấp nhận file nằm trong INPUT_DIR (403) và đã tồn tại (404)"""
+    path = os.path.realpath(os.path.join(INPUT_DIR, file_name))
+    if os.path.commonpath([path, INPUT_DIR]) != INPUT_DIR:
+        raise HTTPException(status_code=403, detail="File Excel phải nằm trong thư mục dữ liệu của service")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Không tìm thấy file Excel")
+    return path
+
+
+def _initial_state(user_request: str, file_name: Optional[str]) -> Dict[str, Any]:
+    """State đầu vào của graph, file Excel (tham số file_name hoặc tên file trong câu) đã kiểm tra bằng _input_path
+
+    Graph không lấy lại tên file trong câu khi state đã có file_name, nên mọi file graph mở đều đã qua kiểm tra.
+    """
+    from intent_router import find_file_name
+
+    state: Dict[str, Any] = {"user_request": user_request, "output_in_memory": True}
+    file_name = file_name or find_file_name(user_request)
+    if file_name:
+        state["file_name"] = _input_path(file_name)
+    return state
+
+
+def _submit(user_request: str, file_name: Optional[str]) -> JSONResponse:
+    """Đưa job vào hàng đợi, trả về 202 kèm job_id hoặc 429 khi hàng đợi đầy"""
+    if _queue is None:
+        raise HTTPException(status_code=503, detail="Service chưa khởi động xong")
+
+    initial_state = _initial_state(user_request, file_name)
+    job_id = uuid4().hex
+    job = JobStatus(job_id=job_id, status="queued", created_at=time.time())
+    try:
+        _queue.put_nowait((job_id, initial_state))
+    except asyncio.QueueFull:
+        return _busy(f"Hàng đợi đã đầy ({JOB_QUEUE_SIZE} job), hãy thử lại sau")
+    _jobs[job_id] = job
+    _forget_old_jobs()
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status_url": f"/jobs/{job_id}"},
+        headers={"Location": f"/jobs/{job_id}"},
+    )
+
+
+@router.post("/chat", status_code=202)
+async def chat(message: Message):
+    """Gửi một câu cho Workflow (chat hoặc tạo hoá đơn), kết quả lấy qua GET /jobs/{job_id}"""
+    return _submit(message.text_input, message.file_name)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class _StreamSlot:
+    """Một chỗ trong STREAM_MAX_SESSIONS, nhận ngay khi chấp nhận request và chỉ trả lại một lần"""
+
+    def __init__(self):
+        global _active_streams
+        _active_streams += 1
+        self._released = False
+
+    def release(self) -> None:
+        global _active_streams
+        if not self._released:
+            self._released = True
+            _active_streams -= 1
+
+
+async def _stream_events(state: Dict[str, Any], slot: _StreamSlot) -> AsyncIterator[str]:
+    """Các sự kiện SSE của một lượt graph: token, node và done (kèm result_url nếu đã tạo hoá đơn)"""
+    try:
+        import Workflow
+
+        async for event in Workflow.astream_request(surface="api", **state):
+            if event["event"] == "done":
+                # Service không ghi file ra đĩa (output_in_memory), file tải qua result_url
+                event = dict(event)
+                event.pop("final_docx", None)
+                docx_bytes = event.pop("docx_bytes", None)
+                if docx_bytes:
+                    # Lưu như một job đã xong để tải file qua GET /jobs/{job_id}/result
+                    job_id = uuid4().hex
+                    now = time.time()
+                    _jobs[job_id] = JobStatus(job_id=job_id, status="done", response=event["response"], created_at=now, finished_at=now,
+                                              result_url=f"/jobs/{job_id}/result")
+                    _results[job_id] = docx_bytes
+                    _forget_old_jobs()
+                    event["result_url"] = _jobs[job_id].result_url
+            yield _sse(event.pop("event"), event)
+    except Exception as e:
+        log(f"❌ Lỗi stream /chat/stream: {e}")
+        yield _sse("error", {"detail": str(e)})
+    finally:
+        slot.release()
+
+
+@router.post("/chat/stream")
+async def chat_stream(message: Message):
+    """Như POST /chat nhưng trả lời ngay dạng Server-Sent Events thay vì qua hàng đợi job
+
+    - event: token, data: {"text"}: từng đoạn câu trả lời của LLM
+    - event: node, data: {"node"}: một bước của graph vừa chạy xong
+    - event: done, data: {"response", "should_process_invoice", "ttft_ms", "total_ms", "result_url"}
+    """
+    state = _initial_state(message.text_input, message.file_name)
+    if _active_streams >= STREAM_MAX_SESSIONS:
+        return _busy(f"Đang có {STREAM_MAX_SESSIONS} kết nối stream, hãy thử lại sau")
+    # Nhận chỗ ngay trong handler để một loạt request tới cùng lúc không cùng vượt qua phép kiểm tra trên;
+    # chỗ được trả khi generator kết thúc, hoặc ở BackgroundTask nếu generator chưa từng chạy
+    slot = _StreamSlot()
+    return StreamingResponse(
+        _stream_events(state, slot),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.release),
+    )
+
+
+@router.post("/invoices", status_code=202)
+async def create_invoice(request: InvoiceRequest):
+    """Tạo hoá đơn từ file Excel trên server, kết quả tải qua GET /jobs/{job_id}/result"""
+    return _submit(request.text_input or f"Tạo hoá đơn từ file {request.file_name}", request.file_name)
+
+
+@router.post("/invoices/batch")
+async def export_batch(request: BatchRequest):
+    """Tạo hàng loạt hoá đơn từ một file Excel, trả về file ZIP (các DOCX + manifest.json)
+
+    Hoá đơn nào xong được ghi vào ZIP ngay nên việc tải về bắt đầu trước khi cả batch chạy xong,
+    bộ nhớ chỉ giữ vài khúc dữ liệu chờ gửi (QueueStream) dù batch có bao nhiêu hoá đơn.
+    """
+    file_path = _input_path(request.file_name)
+    # Mỗi lượt xuất chạy một ProcessPoolExecutor riêng: giới hạn số lượt cùng lúc và số process mỗi lượt
+    if not _batch_slots.acquire(blocking=False):
+        return _busy(f"Đang có {BATCH_MAX_EXPORTS} lượt xuất hoá đơn hàng loạt, hãy thử lại sau")
+    from batch_invoice import write_batch_zip
+
+    stream = QueueStream()
+    workers = min(request.workers or BATCH_MAX_WORKERS, BATCH_MAX_WORKERS)
+
+    def produce() -> None:
+        try:
+            write_batch_zip(
+                file_path,
+                stream,
+                sheet_names=request.sheets,
+                all_sheets=request.all_sheets,
+                workers=workers,
+                use_llm=request.use_llm,
+            )
+        except BaseException as e:
+            log(f"❌ Lỗi xuất ZIP {file_path}: {e}")
+            stream.finish(e)
+        else:
+            stream.finish()
+        finally:
+            _batch_slots.release()
+
+    threading.Thread(target=produce, name="batch-zip", daemon=True).start()
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    return StreamingResponse(
+        iter(stream),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{name}_invoices.zip"'},
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    if job.status in ("queued", "running"):
+        raise HTTPException(status_code=409, detail=f"Job đang ở trạng thái {job.status}")
+    content = _results.get(job_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Job không có file hoá đơn")
+    return Response(
+        content,
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers={"Content-Disposition": f'attachment; filename="invoice_{job_id[:8]}.docx"'},
+    )
+
+
+@router.get("/health")
+async def health():
+    """Độ sâu hàng đợi và số job theo trạng thái"""
+    counts: Dict[str, int] = {}
+    for job in _jobs.values():
+        counts[job.status] = counts.get(job.status, 0) + 1
+    return {
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "queue_size": JOB_QUEUE_SIZE,
+        "workers": len(_workers),
+        "streams": _active_streams,
+        "jobs": counts,
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Metrics dạng text của Prometheus: thời gian từng node/tool, LLM, token, cache và hàng đợi"""
+    depth = _queue.qsize() if _queue is not None else 0
+    lines = [
+        "# HELP invoice_job_queue_depth Số job đang chờ trong hàng đợi",
+        "# TYPE invoice_job_queue_depth gauge",
+        f"invoice_job_queue_depth {depth}",
+    ]
+    return PlainTextResponse("\n".join(lines) + "\n" + METRICS.render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,21 @@
+import os
+import sys
+
+# Chạy được cả bằng `python app/main.py` lẫn `uvicorn main:app --app-dir app`:
+# thư mục app/ cho các import api/schema, thư mục gốc cho Workflow và tools
+_APP_DIR = os.path.dirname(os.path.abspath(__file__))
+for path in (_APP_DIR, os.path.dirname(_APP_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from fastapi import FastAPI
+
+from api.chatbot_api import lifespan, router
+
+app = FastAPI(title="Agent invoice", lifespan=lifespan)
+app.include_router(router)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv("HOST", "0.0.0.0"), port=int(os.getenv("PORT", "8000")))
@@ -0,0 +1,29 @@
+import os
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+class InvoiceRequest(BaseModel):
+    file_name: str = Field(description='Đường dẫn file Excel, tính từ thư mục dữ liệu của service (INPUT_DIR)')
+    text_input: Optional[str] = Field(default=None, description='Yêu cầu kèm theo, mặc định là tạo hoá đơn từ file_name')
+
+
+class BatchRequest(BaseModel):
+    file_name: str = Field(description='Đường dẫn file Excel chứa nhiều hoá đơn, tính từ thư mục dữ liệu của service (INPUT_DIR)')
+    sheets: Optional[List[str]] = Field(default=None, description='Các sheet cần xử lý, mặc định là sheet đầu tiên')
+    all_sheets: bool = Field(default=False, description='Xử lý toàn bộ các sheet')
+    use_llm: bool = Field(default=False, description='Gọi LLM cho các trường luật không tìm được')
+    workers: Optional[int] = Field(default=None, ge=1, le=os.cpu_count() or 1,
+                                   description='Số process, mặc định (và tối đa) là BATCH_MAX_WORKERS của service')
+
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str = Field(description='queued, running, done, failed hoặc expired')
+    response: Optional[str] = None
+    result_url: Optional[str] = Field(default=None, description='Đường dẫn tải file hoá đơn khi status là done')
+    error: Optional[str] = None
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
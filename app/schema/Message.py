@@ -1,4 +1,8 @@
-import pydantic
+from typing import Optional
 
-class Message(pydantic):
-    text_input: str
\ No newline at end of file
+from pydantic import BaseModel, Field
+
+
+class Message(BaseModel):
+    text_input: str
+    file_name: Optional[str] = Field(default=None, description='File Excel cần tạo hoá đơn (nếu không có trong text_input), tính từ thư mục dữ liệu của service (INPUT_DIR)')
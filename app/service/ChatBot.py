@@ -1,26 +1,35 @@
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import AIMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.messages import AIMessage, message_chunk_to_message
 from langchain_google_genai import ChatGoogleGenerativeAI
 import ast
+import time
+from typing import Iterator
 from tools import make_file_txt, make_file_docx, make_invoice
+from conversation_memory import SummaryBufferMemory, count_prompt_tokens
+from llm_cache import cached_invoke, cached_stream
+from llm_limiter import limited
+from tracing import log, record_ttft
 
 class ChatBot:
     def __init__(self):
-        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
+        # Dùng chung bộ giới hạn (tốc độ, số lần gọi cùng lúc, gọi lại) với các client cùng model
+        llm = limited(ChatGoogleGenerativeAI(model="gemini-2.5-flash", max_retries=1))
         self.llm_with_tools = llm.bind_tools([make_file_txt, make_file_docx, make_invoice])
 
-        self.memory = ConversationBufferMemory(memory_key= "history", return_messages=True)
+        # Giữ nguyên văn vài lượt gần nhất, các lượt cũ hơn được tóm tắt để prompt không lớn dần
+        self.memory = SummaryBufferMemory(llm= llm)
+        self.prompt_tokens = []
 
-        prompt = ChatPromptTemplate([
-            ('system', "Bạn là một trợ lý ảo, bạn có thể tạo file txt và docx với nội dung được cung cấp."),
+        self.prompt = prompt = ChatPromptTemplate([
+            ('system', "Bạn là một trợ lý ảo, bạn có thể tạo file txt và docx với nội dung được cung cấp.\n"
+                       "Tóm tắt phần hội thoại trước: {summary}"),
             MessagesPlaceholder(variable_name= 'history'),
             ("human", '{input}')
         ])
         # Kết hợp prompt với LLM và tools   
         self.chain = prompt | self.llm_with_tools
 
-    def process_tool_calls(self, ai_msg: AIMessage, memory: ConversationBufferMemory) -> None:
+    def process_tool_calls(self, ai_msg: AIMessage, memory: SummaryBufferMemory) -> None:
         # Mapping tên function -> tool object
         tool_map = {
             "make_file_txt": make_file_txt,
@@ -33,7 +42,7 @@ class ChatBot:
                 tool_name = call["name"]
                 tool_args = call["args"]
 
-                print(f"🔧 Tool call: {tool_name} với args: {tool_args}")
+                log(f"🔧 Tool call: {tool_name} với args: {tool_args}")
 
                 # Biến đổi kiểu dữ liệu của data_input nếu cần thiết
                 # Đây là chuỗi dạng dict, không phải dict thật Dùng json.loads() lại bị lỗi vì:
@@ -46,40 +55,67 @@ class ChatBot:
                     try:
                         tool_args["data_input"] = ast.literal_eval(tool_args["data_input"])
                     except Exception as e:
-                        print(f"❌ Lỗi parse tool_args['data_input']: {e}")
+                        log(f"❌ Lỗi parse tool_args['data_input']: {e}")
                         continue
                     
                 # Gọi tool nếu hợp lệ
                 if tool_name in tool_map:
                     try:
-                        tool_map[tool_name].invoke(tool_args)
+                        result = tool_map[tool_name].invoke(tool_args)
                         
-                        # Lưu lại vào memory sau khi gọi tool đánh dấu cho llm biết đã thực hiện tool call
-                        memory.save_context(
-                            {"input": "Yêu cầu"},
-                            {"output": f"Đã chạy tool {tool_name} với args: {tool_args}, thoát khỏi chế độ tool call"}
-                        )
+                        # Ghi chú ngắn vào lượt hiện tại để llm biết đã thực hiện tool call (không chép lại args)
+                        memory.add_note(f"Đã chạy tool {tool_name}: {result}")
                     except Exception as e:
-                        print(f"Lỗi khi invoke tool {tool_name}: {e}")
+                        log(f"Lỗi khi invoke tool {tool_name}: {e}")
                 else:
-                    print(f"Tool chưa định nghĩa: {tool_name}")
+                    log(f"Tool chưa định nghĩa: {tool_name}")
 
-    def chat(self, message: str):
+    def _prompt_value(self, message: str):
         # Tạo input context
         inputs = {
             "input": message,
-            "history": self.memory.load_memory_variables({})["history"]
+            **self.memory.load_memory_variables({})
         }
+        prompt_value = self.prompt.invoke(inputs)
+        self.prompt_tokens.append(count_prompt_tokens(prompt_value))
+        log(f"📏 Prompt lượt {len(self.prompt_tokens)}: {self.prompt_tokens[-1]} token")
+        return prompt_value
 
-        response = self.chain.invoke(inputs)
-
+    def _finish(self, message: str, response: AIMessage) -> None:
         # Lưu vào memory
         self.memory.save_context(
             {"input": message},
             {"output": response.content}
         )
+        self.process_tool_calls(response, self.memory)
+
+    def chat(self, message: str):
+        prompt_value = self._prompt_value(message)
+
+        # Tương đương self.chain.invoke(inputs) nhưng câu trả lời của model được cache
+        response = cached_invoke(self.llm_with_tools, prompt_value, node="chatbot")
+
         print("Câu hỏi: ", message)
         
         print("Trả lời: ", response.content)
         print("--" * 50)
-        self.process_tool_calls(response, self.memory)
+        self._finish(message, response)
+
+    def stream_chat(self, message: str) -> Iterator[str]:
+        """Như chat nhưng trả về dần từng đoạn câu trả lời ngay khi model sinh ra
+
+        Tool call chỉ được chạy sau khi model trả lời xong (cần đủ tham số của tool).
+        """
+        prompt_value = self._prompt_value(message)
+        start = time.perf_counter()
+        response = None
+        first_token = True
+        for chunk in cached_stream(self.llm_with_tools, prompt_value, node="chatbot"):
+            response = chunk if response is None else response + chunk
+            if isinstance(chunk.content, str) and chunk.content:
+                if first_token:
+                    record_ttft("chatbot", time.perf_counter() - start)
+                    first_token = False
+                yield chunk.content
+        if response is not None:
+            self._finish(message, message_chunk_to_message(response))
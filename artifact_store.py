@@ -0,0 +1,155 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+# Thư mục lưu artifact (dữ liệu lớn như nội dung sheet), đổi bằng biến môi trường ARTIFACT_DIR
+ARTIFACT_DIR = os.getenv(
+    "ARTIFACT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "artifacts"),
+)
+ARTIFACT_MAX_BYTES = int(os.getenv("ARTIFACT_MAX_BYTES", str(500 * 1024 * 1024)))
+# Khi vượt max_bytes thì xoá bớt tới còn tỉ lệ này của max_bytes
+EVICT_TARGET = 0.8
+HANDLE_PREFIX = "artifact:"
+# Phần sau tiền tố của handle là sha256 dạng hex, handle lấy từ tham số tool của LLM nên phải kiểm tra
+# trước khi ghép thành đường dẫn (tránh pickle.load một file .pkl bất kỳ trên đĩa)
+_DIGEST_RE = re.compile(r'[0-9a-f]{64}')
+
+
+def parse_handle(value: str) -> str:
+    """Handle trong chuỗi read_excel_data trả về ('artifact:<sha256> (N hàng ...)' -> 'artifact:<sha256>'),
+    chuỗi không phải handle thì trả về nguyên văn"""
+    text = value.strip()
+    return text.split()[0] if text.startswith(HANDLE_PREFIX) else value
+
+
+def is_handle(value: Any) -> bool:
+    """value có phải handle của artifact ('artifact:<sha256>') hay không"""
+    return isinstance(value, str) and value.startswith(HANDLE_PREFIX)
+
+
+class ArtifactStore:
+    """Kho artifact theo nội dung: dữ liệu lớn được lưu ra đĩa, state và message chỉ giữ handle ngắn
+
+    Cùng một nội dung luôn cho cùng một handle nên lưu lại nhiều lần không tốn thêm chỗ.
+    """
+
+    def __init__(self, root: str = ARTIFACT_DIR, max_bytes: int = ARTIFACT_MAX_BYTES, memory_entries: int = 32):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Dung lượng ước tính của kho: đo bằng os.walk một lần, sau đó cộng dần theo các file put() ghi ra.
+        # Chỉ khi ước tính vượt max_bytes mới quét lại cả thư mục (số đúng, kể cả file của process khác) để dọn
+        self._size: Optional[int] = None
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.pkl")
+
+    def put(self, value: Any) -> str:
+        """Lưu value và trả về handle"""
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Ghi ra file tạm rồi đổi tên để process khác không đọc phải file ghi dở
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            self._grow(len(data))
+        self._remember(digest, value)
+        return HANDLE_PREFIX + digest
+
+    def get(self, handle: str) -> Any:
+        """Nội dung của handle, ném KeyError nếu handle sai định dạng hoặc artifact không tồn tại (đã bị xoá)"""
+        if not is_handle(handle):
+            raise KeyError(f"Không phải handle artifact: {handle!r}")
+        digest = handle[len(HANDLE_PREFIX):]
+        if not _DIGEST_RE.fullmatch(digest):
+            raise KeyError(f"Handle artifact không hợp lệ: {handle!r}")
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return self._memory[digest]
+        path = self._path(digest)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            # Cập nhật mtime để việc dọn dẹp bỏ các artifact ít dùng nhất trước
+            os.utime(path)
+        except FileNotFoundError:
+            raise KeyError(f"Không tìm thấy artifact {handle}") from None
+        self._remember(digest, value)
+        return value
+
+    def resolve(self, value: Any) -> Any:
+        """Trả về nội dung nếu value là handle, ngược lại trả về nguyên value"""
+        return self.get(value) if is_handle(value) else value
+
+    def _remember(self, digest: str, value: Any) -> None:
+        with self._lock:
+            self._memory[digest] = value
+            self._memory.move_to_end(digest)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _grow(self, size: int) -> None:
+        """Cộng dung lượng file vừa ghi vào ước tính, chỉ dọn kho khi ước tính vượt max_bytes"""
+        with self._lock:
+            if self._size is not None:
+                self._size += size
+            over = self._size is None or self._size > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self) -> None:
+        """Xoá các artifact dùng lâu nhất khi tổng dung lượng vượt max_bytes, cập nhật lại dung lượng ước tính"""
+        files = []
+        for folder, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".pkl"):
+                    path = os.path.join(folder, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        # Dọn xuống dưới max_bytes một khoảng (EVICT_TARGET) để các lần put() sau không phải quét lại ngay
+        target = self.max_bytes * EVICT_TARGET if total > self.max_bytes else total
+        for _, size, path in sorted(files):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        with self._lock:
+            self._size = total
+
+
+_default_store: Optional[ArtifactStore] = None
+
+
+def get_artifact_store() -> ArtifactStore:
+    """Kho artifact dùng chung trong process"""
+    global _default_store
+    if _default_store is None:
+        _default_store = ArtifactStore()
+    return _default_store
+
+
+def describe_rows(rows: List[List[Any]], preview_rows: int = 3) -> str:
+    """Mô tả ngắn dữ liệu sheet (kích thước và vài hàng đầu) để đưa vào message thay cho toàn bộ dữ liệu"""
+    width = max((len(row) for row in rows), default=0)
+    preview = []
+    for row in rows[:preview_rows]:
+        values = [" ".join(str(value).split()) for value in row if value not in (None, "")]
+        text = " | ".join(values)
+        preview.append(text if len(text) <= 120 else text[:117] + "...")
+    return f"{len(rows)} hàng x {width} cột; hàng đầu: " + " / ".join(preview)
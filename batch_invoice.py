@@ -0,0 +1,298 @@
+import argparse
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from openpyxl import load_workbook
+
+from workbook_cache import cached_read_excel_rows
+from rule_extractor import CORE_FIELDS, fold_text, extract_invoice_by_rules
+from invoice_totals import apply_totals
+from tracing import log
+from zip_export import ZipStream
+
+# Dòng tiêu đề mở đầu một hoá đơn / báo giá trong file xuất gộp
+_TITLE_PREFIXES = ('hoa don', 'bang bao gia', 'phieu xuat', 'phieu thu')
+
+# Cột dùng để nhóm các dòng của cùng một hoá đơn trong file xuất dạng bảng phẳng
+_GROUP_COLUMNS = ('ky hieu', 'ki hieu', 'so hoa don', 'ma hoa don')
+
+
+def _first_text(row: List[Any]) -> str:
+    """Giá trị chuỗi của ô có dữ liệu đầu tiên trong hàng"""
+    return next((str(value).strip() for value in row if value not in (None, '')), '')
+
+
+def _find_group_column(rows: List[List[Any]]) -> Optional[Tuple[int, int]]:
+    """Tìm (hàng tiêu đề, cột) của cột ký hiệu/số hoá đơn trong file xuất dạng bảng phẳng"""
+    for row_index, row in enumerate(rows):
+        # Hàng tiêu đề của bảng phẳng có nhiều cột, nhãn kiểu 'Ký hiệu:' thì không phải cột
+        if sum(1 for value in row if isinstance(value, str) and value.strip()) < 3:
+            continue
+        for col, value in enumerate(row):
+            if isinstance(value, str) and fold_text(value) in _GROUP_COLUMNS:
+                # Cột ký hiệu phải có dữ liệu ở các hàng ngay bên dưới
+                below = rows[row_index + 1:row_index + 3]
+                if len(below) == 2 and all(col < len(item) and item[col] not in (None, '') for item in below):
+                    return row_index, col
+    return None
+
+
+def split_by_column(rows: List[List[Any]], header_index: int, col: int) -> List[List[List[Any]]]:
+    """Nhóm các dòng theo giá trị cột ký hiệu, mỗi nhóm được chuyển thành dạng 'nhãn: giá trị' + bảng hàng
+
+    Args:
+        rows (List[List[Any]]): Dữ liệu sheet
+        header_index (int): Vị trí hàng tiêu đề
+        col (int): Vị trí cột ký hiệu
+
+    Returns:
+        List[List[List[Any]]]: Dữ liệu từng hoá đơn theo thứ tự xuất hiện
+    """
+    header = rows[header_index]
+    groups: Dict[str, List[List[Any]]] = {}
+    for row in rows[header_index + 1:]:
+        key = row[col] if col < len(row) else None
+        if key in (None, ''):
+            continue
+        groups.setdefault(str(key), []).append(row)
+
+    invoices = []
+    for items in groups.values():
+        first = items[0]
+        # Các cột thông tin chung (người bán, người mua, ...) lấy từ dòng đầu tiên của nhóm
+        labelled = [
+            [f'{name}: {first[i] if first[i] is not None else ""}']
+            for i, name in enumerate(header)
+            if isinstance(name, str) and name.strip() and i < len(first)
+        ]
+        invoices.append(labelled + [header] + items)
+    return invoices
+
+
+def split_by_header_blocks(rows: List[List[Any]]) -> List[List[List[Any]]]:
+    """Tách sheet thành các khối hoá đơn, mỗi khối bắt đầu từ dòng tiêu đề 'HÓA ĐƠN' / 'BẢNG BÁO GIÁ'
+
+    Args:
+        rows (List[List[Any]]): Dữ liệu sheet
+
+    Returns:
+        List[List[List[Any]]]: Dữ liệu từng hoá đơn, sheet không có tiêu đề nào được coi là một hoá đơn
+    """
+    starts = [i for i, row in enumerate(rows) if fold_text(_first_text(row)).startswith(_TITLE_PREFIXES)]
+    if len(starts) < 2:
+        return [rows] if rows else []
+    # Các dòng trước tiêu đề đầu tiên gộp vào hoá đơn đầu tiên
+    starts[0] = 0
+    return [rows[start:end] for start, end in zip(starts, starts[1:] + [len(rows)])]
+
+
+def detect_invoices(rows: List[List[Any]]) -> List[List[List[Any]]]:
+    """Tách một sheet thành nhiều hoá đơn: nhóm theo cột ký hiệu nếu có, không thì theo khối tiêu đề"""
+    group = _find_group_column(rows)
+    if group:
+        return split_by_column(rows, *group)
+    return split_by_header_blocks(rows)
+
+
+def _safe_name(text: str) -> str:
+    """Tên file an toàn từ ký hiệu hoá đơn / tên sheet"""
+    return re.sub(r'[^0-9A-Za-z_-]+', '_', fold_text(text)).strip('_')[:40] or 'invoice'
+
+
+def _process_invoice(task: Dict[str, Any]) -> Dict[str, Any]:
+    """Chạy trong process con: trích xuất và tạo DOCX cho một hoá đơn, lỗi được ghi vào kết quả
+
+    output_dir là None thì không ghi file, nội dung DOCX trả về trong entry['docx'] để ghi vào ZIP
+    """
+    from tools import InvoiceDetails, render_invoice_bytes, render_invoice_docx
+
+    start = time.perf_counter()
+    entry = {'index': task['index'], 'sheet': task['sheet'], 'rows': len(task['rows'])}
+    try:
+        if task['use_llm']:
+            from Workflow import extract_invoice
+            invoice, field_sources = extract_invoice(task['rows'])
+        else:
+            fields = extract_invoice_by_rules(task['rows'])
+            invoice, field_sources = InvoiceDetails(**fields), {field: 'rule' for field in fields}
+        # Thành tiền và các số tổng tính lại từ bảng hàng, ghi lại chỗ lệch so với file gốc
+        invoice, entry['totals_mismatches'] = apply_totals(invoice, task['rows'])
+
+        name = f"{task['index']:04d}_{_safe_name(invoice.ki_hieu or task['sheet'])}"
+        entry['ki_hieu'] = invoice.ki_hieu
+        entry['tong_thanh_toan'] = invoice.tong_thanh_toan
+        if task['output_dir'] is None:
+            entry['output'] = f'{name}.docx'
+            entry['docx'] = render_invoice_bytes(invoice)
+        else:
+            entry['output'] = render_invoice_docx(invoice, os.path.join(task['output_dir'], name))
+        entry['field_sources'] = field_sources
+        entry['missing_fields'] = [field for field in CORE_FIELDS if field not in field_sources]
+        entry['status'] = 'ok'
+    except Exception as e:
+        entry['status'] = 'error'
+        entry['error'] = f'{type(e).__name__}: {e}'
+    entry['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return entry
+
+
+def plan_batch(
+    file_path: str,
+    output_dir: Optional[str],
+    sheet_names: Optional[List[str]] = None,
+    all_sheets: bool = False,
+    use_llm: bool = False,
+) -> List[Dict[str, Any]]:
+    """Tách workbook thành các task, mỗi task là một hoá đơn (xem run_batch về các tham số)"""
+    if all_sheets:
+        workbook = load_workbook(file_path, read_only=True)
+        sheet_names = workbook.sheetnames
+        workbook.close()
+    sheets = sheet_names or [0]
+
+    tasks = []
+    for sheet in sheets:
+        for rows in detect_invoices(cached_read_excel_rows(file_path, sheet_name=sheet)):
+            tasks.append({
+                'index': len(tasks) + 1,
+                'sheet': str(sheet),
+                'rows': rows,
+                'output_dir': output_dir,
+                'use_llm': use_llm,
+            })
+    log(f"📦 Tìm thấy {len(tasks)} hoá đơn trong {file_path}")
+    return tasks
+
+
+def iter_batch(tasks: List[Dict[str, Any]], workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Chạy các task bằng process pool, trả về kết quả theo thứ tự hoàn thành
+
+    Chỉ giữ tối đa 2 x workers task đang chạy, kết quả (kể cả nội dung DOCX) được trả cho
+    người gọi ngay nên bộ nhớ không tăng theo số hoá đơn.
+    """
+    workers = workers or os.cpu_count() or 1
+    pending = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        for task in pending:
+            running[executor.submit(_process_invoice, task)] = task
+            if len(running) >= 2 * workers:
+                break
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                task = running.pop(future)
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    # Process con bị chết (hết bộ nhớ, ...) cũng chỉ làm hỏng hoá đơn đó
+                    entry = {'index': task['index'], 'sheet': task['sheet'], 'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+                log(f"{'✅' if entry['status'] == 'ok' else '❌'} Hoá đơn {entry['index']}: {entry.get('output', entry.get('error'))}")
+                yield entry
+                next_task = next(pending, None)
+                if next_task is not None:
+                    running[executor.submit(_process_invoice, next_task)] = next_task
+
+
+def _manifest(file_path: str, workers: Optional[int], results: List[Dict[str, Any]], start: float) -> Dict[str, Any]:
+    results.sort(key=lambda entry: entry['index'])
+    return {
+        'source': file_path,
+        'workers': workers or os.cpu_count(),
+        'total': len(results),
+        'succeeded': sum(1 for entry in results if entry['status'] == 'ok'),
+        'failed': sum(1 for entry in results if entry['status'] != 'ok'),
+        'elapsed_s': round(time.perf_counter() - start, 3),
+        'invoices': results,
+    }
+
+
+def run_batch(
+    file_path: str,
+    output_dir: str,
+    sheet_names: Optional[List[str]] = None,
+    all_sheets: bool = False,
+    workers: Optional[int] = None,
+    use_llm: bool = False,
+) -> Dict[str, Any]:
+    """Tách workbook thành nhiều hoá đơn và tạo DOCX song song bằng process pool, ghi manifest.json
+
+    Args:
+        file_path (str): File Excel cần xử lý
+        output_dir (str): Thư mục chứa các file DOCX và manifest.json
+        sheet_names (List[str], optional): Các sheet cần xử lý, mặc định là sheet đầu tiên
+        all_sheets (bool): Xử lý toàn bộ các sheet trong workbook
+        workers (int, optional): Số process, mặc định bằng số CPU
+        use_llm (bool): Gọi LLM cho các trường mà luật không tìm được
+
+    Returns:
+        Dict[str, Any]: Nội dung manifest (kết quả và lỗi của từng hoá đơn)
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = plan_batch(file_path, output_dir, sheet_names, all_sheets, use_llm)
+    manifest = _manifest(file_path, workers, list(iter_batch(tasks, workers)), start)
+    with open(os.path.join(output_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def write_batch_zip(
+    file_path: str,
+    stream: BinaryIO,
+    sheet_names: Optional[List[str]] = None,
+    all_sheets: bool = False,
+    workers: Optional[int] = None,
+    use_llm: bool = False,
+) -> Dict[str, Any]:
+    """Như run_batch nhưng ghi các hoá đơn vào một file ZIP (kèm manifest.json) thay vì thư mục
+
+    Mỗi hoá đơn được ghi vào ZIP ngay khi xong, không tạo file DOCX rời trên đĩa. stream có thể là
+    file đã mở hoặc zip_export.QueueStream để tải về qua HTTP trong lúc batch vẫn đang chạy.
+
+    Args:
+        file_path (str): File Excel cần xử lý
+        stream (BinaryIO): Nơi ghi file ZIP
+        sheet_names, all_sheets, workers, use_llm: Xem run_batch
+
+    Returns:
+        Dict[str, Any]: Nội dung manifest (cũng được ghi vào manifest.json trong ZIP)
+    """
+    start = time.perf_counter()
+    tasks = plan_batch(file_path, None, sheet_names, all_sheets, use_llm)
+    results = []
+    with ZipStream(stream) as archive:
+        for entry in iter_batch(tasks, workers):
+            data = entry.pop('docx', None)
+            if data is not None:
+                entry['output'] = f"invoices/{entry['output']}"
+                # .docx đã là file nén, lưu nguyên để không tốn CPU nén lại
+                archive.add(entry['output'], data, compress=False)
+            results.append(entry)
+        manifest = _manifest(file_path, workers, results, start)
+        archive.add_json('manifest.json', manifest)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Tạo hàng loạt hoá đơn DOCX từ một file Excel')
+    parser.add_argument('file_path', help='File Excel chứa nhiều hoá đơn')
+    parser.add_argument('--out', default='invoices_out', help='Thư mục đầu ra')
+    parser.add_argument('--zip', dest='zip_path', help='Ghi các hoá đơn và manifest vào file ZIP này thay vì thư mục --out')
+    parser.add_argument('--sheet', action='append', dest='sheets', help='Tên sheet cần xử lý (có thể lặp lại)')
+    parser.add_argument('--all-sheets', action='store_true', help='Xử lý toàn bộ các sheet')
+    parser.add_argument('--workers', type=int, default=None, help='Số process, mặc định bằng số CPU')
+    parser.add_argument('--use-llm', action='store_true', help='Gọi LLM cho các trường luật không tìm được')
+    args = parser.parse_args()
+
+    options = dict(sheet_names=args.sheets, all_sheets=args.all_sheets, workers=args.workers, use_llm=args.use_llm)
+    if args.zip_path:
+        with open(args.zip_path, 'wb') as f:
+            manifest = write_batch_zip(args.file_path, f, **options)
+    else:
+        manifest = run_batch(args.file_path, args.out, **options)
+    print(f"🎉 Xong {manifest['succeeded']}/{manifest['total']} hoá đơn trong {manifest['elapsed_s']}s, lỗi: {manifest['failed']}")
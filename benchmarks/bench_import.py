@@ -0,0 +1,70 @@
+"""Đo thời gian import (cold start) của các module chính, thoát với mã 1 khi vượt ngân sách
+
+Mỗi module được import trong một process Python mới nên đo đúng thời gian khởi động của CLI/worker.
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --budget 1.0 --repeat 5 --top 10
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ['tools', 'Workflow', 'batch_invoice', 'invoice_extractor', 'rule_extractor', 'excel_reader']
+# Ngân sách mặc định (giây) cho mỗi module, đổi bằng --budget hoặc biến môi trường IMPORT_BUDGET_SECONDS
+DEFAULT_BUDGET = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+
+_SNIPPET = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def measure(module: str, repeat: int) -> float:
+    """Thời gian import nhỏ nhất (giây) qua repeat lần, mỗi lần một process mới"""
+    timings = []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", _SNIPPET.format(module=module)],
+            cwd=ROOT, capture_output=True, text=True, check=True,
+        )
+        timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(timings)
+
+
+def slowest_imports(module: str, top: int):
+    """Các import con tốn thời gian nhất theo python -X importtime (cumulative, micro giây)"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[1:top + 1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--modules', nargs='+', default=MODULES)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='Thời gian import tối đa (giây) cho mỗi module')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=0, help='In thêm N import con chậm nhất của module vượt ngân sách')
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f"{'Module':<20} | {'Import (s)':>10} | Ngân sách {args.budget:.2f}s")
+    for module in args.modules:
+        elapsed = measure(module, args.repeat)
+        status = "✅" if elapsed <= args.budget else "❌"
+        print(f"{module:<20} | {elapsed:>10.3f} | {status}")
+        if elapsed > args.budget:
+            over_budget.append(module)
+            for cumulative, name in slowest_imports(module, args.top):
+                print(f"{'':<20}   {cumulative / 1e6:>8.3f}s  {name}")
+
+    if over_budget:
+        print(f"❌ Vượt ngân sách import: {', '.join(over_budget)}")
+        sys.exit(1)
+    print("✅ Tất cả module nằm trong ngân sách import")
@@ -0,0 +1,96 @@
+"""Thử tải bộ giới hạn LLM (llm_limiter) với server giả tương thích OpenAI
+
+Gửi cùng lúc nhiều request qua ChatOpenAI tới server giả có sức chứa nhỏ, so sánh client không giới hạn
+với client bọc LimitedChatModel: số request lỗi, số lần server trả 429 và tổng thời gian.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_limiter.py
+    python benchmarks/bench_limiter.py --requests 100 --capacity 4 --latency 0.1 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import urllib.request
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.environ.setdefault("LLM_CACHE", "0")
+
+from fake_openai_server import FakeOpenAIServer, serve
+
+
+def _server_stats(server: FakeOpenAIServer) -> Dict[str, int]:
+    with urllib.request.urlopen(server.base_url.rsplit("/v1", 1)[0] + "/stats") as response:
+        return json.loads(response.read())
+
+
+async def _fire(llm: Any, requests: int) -> Dict[str, Any]:
+    async def one(index: int) -> bool:
+        try:
+            await llm.ainvoke(f"Câu hỏi số {index}")
+            return True
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(one(index) for index in range(requests)))
+    return {"ok": sum(results), "failed": len(results) - sum(results), "seconds": round(time.perf_counter() - start, 3)}
+
+
+def run(requests: int, capacity: int, latency: float, rate: float, error_rate: float) -> List[Dict[str, Any]]:
+    from langchain_openai import ChatOpenAI
+
+    from llm_limiter import LimitedChatModel, ModelLimiter
+    from tracing import METRICS
+
+    results = []
+    for mode in ("raw", "limited"):
+        server = serve(latency=latency, capacity=capacity, rate=rate, error_rate=error_rate)
+        # Tắt cơ chế gọi lại của client OpenAI để so sánh đúng: mọi lần gọi lại đều do bộ giới hạn quyết định
+        client = ChatOpenAI(model=f"fake-{mode}", api_key="fake", base_url=server.base_url, max_retries=0)
+        llm: Any = client
+        limiter = None
+        if mode == "limited":
+            limiter = ModelLimiter(f"fake-{mode}", rate=0, initial_concurrency=2, max_concurrency=32,
+                                   backoff_base=0.05, backoff_max=1.0, max_retries=8)
+            llm = LimitedChatModel(inner=client, limiter=limiter)
+        result = {"mode": mode, "requests": requests, "capacity": capacity, **asyncio.run(_fire(llm, requests))}
+        stats = _server_stats(server)
+        result.update(server_429=stats["rate_limited"], server_503=stats["unavailable"], server_max_active=stats["max_active"])
+        if limiter is not None:
+            retries = {key: value for key, value in METRICS.snapshot()["counters"].items() if key.startswith("invoice_llm_retries_total")}
+            result.update(final_limit=limiter.stats()["limit"], retries=int(sum(retries.values())))
+        server.shutdown()
+        print(json.dumps(result, ensure_ascii=False))
+        results.append(result)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Thử tải bộ giới hạn LLM với server giả tương thích OpenAI")
+    parser.add_argument("--requests", type=int, default=60, help="Số request gửi cùng lúc")
+    parser.add_argument("--capacity", type=int, default=4, help="Sức chứa của server giả (request cùng lúc)")
+    parser.add_argument("--latency", type=float, default=0.1, help="Độ trễ (giây) mỗi câu trả lời")
+    parser.add_argument("--rate", type=float, default=0.0, help="Giới hạn request mỗi giây của server giả, 0 là không giới hạn")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ server trả 503 ngẫu nhiên")
+    parser.add_argument("--out", help="File JSON ghi kết quả")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.capacity, args.latency, args.rate, args.error_rate)
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã ghi kết quả vào {args.out}")
+    limited = results[-1]
+    if limited["failed"]:
+        print(f"❌ Còn {limited['failed']} request lỗi khi có bộ giới hạn")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
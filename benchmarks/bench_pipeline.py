@@ -0,0 +1,175 @@
+"""Đo các bước chính của quy trình tạo hoá đơn với file Excel giả và model giả, ghi kết quả ra JSON
+
+Các bước được đo: read_excel_data (đọc thật và trúng cache), get_prompt_for_data_excel,
+create_invoice_docx, cả graph (build_graph) chạy invoke, và nhiều yêu cầu chạy đồng thời bằng ainvoke.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --items 10 100 1000 --latency 0.05 --repeat 5 --out results.json
+    python benchmarks/bench_pipeline.py --baseline benchmarks/results/baseline.json --max-regression 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+# Nhật ký và cache của lần đo ghi vào thư mục tạm, không lẫn với dữ liệu thật
+_WORK_DIR = tempfile.mkdtemp(prefix="bench_pipeline_")
+for name, value in {
+    "ROUTING_LOG_PATH": os.path.join(_WORK_DIR, "routing.jsonl"),
+    "PROMPT_LOG_PATH": os.path.join(_WORK_DIR, "prompt_size.jsonl"),
+    "WORKBOOK_CACHE_DIR": os.path.join(_WORK_DIR, "workbooks"),
+    "ARTIFACT_DIR": os.path.join(_WORK_DIR, "artifacts"),
+    "LLM_CACHE": "0",
+}.items():
+    os.environ.setdefault(name, value)
+
+from fake_llm import FakeChatModel
+from synthetic_workbook import write_workbook
+
+DEFAULT_OUT = os.path.join(ROOT, "benchmarks", "results", "pipeline.json")
+
+
+def _quiet(func: Callable[[], Any]) -> Any:
+    """Chạy func mà không in các dòng log (print) của pipeline"""
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            return func()
+        finally:
+            sys.stdout = stdout
+
+
+def measure(name: str, func: Callable[[], Any], repeat: int, **params: Any) -> Dict[str, Any]:
+    """Chạy func repeat lần, trả về thống kê thời gian (ms)"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        _quiet(func)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    result = {
+        "name": name,
+        **params,
+        "repeat": repeat,
+        "min_ms": round(timings[0], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))], 3),
+    }
+    print(f"{name:<28} {str(params):<44} p50 {result['p50_ms']:>10.2f} ms   min {result['min_ms']:>10.2f} ms")
+    return result
+
+
+def run_benchmarks(items_list: List[int], latency: float, repeat: int, concurrency: int) -> List[Dict[str, Any]]:
+    import tools
+    import workbook_cache
+    import Workflow
+    from rule_extractor import extract_invoice_by_rules
+
+    llm = FakeChatModel(latency=latency)
+    Workflow.set_llm(llm)
+    results = []
+    for items in items_list:
+        file_path = write_workbook(os.path.join(_WORK_DIR, f"invoice_{items}.xlsx"), items=items)
+        llm_file_path = write_workbook(
+            os.path.join(_WORK_DIR, f"invoice_{items}_llm.xlsx"), items=items, standard_labels=False
+        )
+
+        workbook_cache.WORKBOOK_CACHE_ENABLED = False
+        results.append(measure("read_excel_data", lambda: tools.read_excel_data(file_path), repeat, items=items, cache=False))
+        workbook_cache.WORKBOOK_CACHE_ENABLED = True
+        _quiet(lambda: tools.read_excel_data(file_path))
+        results.append(measure("read_excel_data", lambda: tools.read_excel_data(file_path), repeat, items=items, cache=True))
+
+        rows = _quiet(lambda: tools.read_excel_data(file_path))
+        results.append(measure("get_prompt_for_data_excel", lambda: tools.get_prompt_for_data_excel(rows), repeat, items=items))
+
+        invoice = tools.InvoiceDetails(**extract_invoice_by_rules(rows))
+        output_path = os.path.join(_WORK_DIR, f"out_{items}")
+        results.append(measure("create_invoice_docx", lambda: tools.create_invoice_docx(invoice, output_path), repeat, items=items))
+
+        app = Workflow.build_graph()
+        for label, path in (("rules", file_path), ("llm", llm_file_path)):
+            state = {"user_request": f"Tạo hoá đơn từ file {path}", "final_docx": os.path.join(_WORK_DIR, f"graph_{items}.docx")}
+            results.append(measure("graph_invoke", lambda: app.invoke(dict(state)), repeat, items=items, extraction=label, latency=latency))
+
+    # Nhiều câu chat (mỗi câu một lần gọi LLM) chạy đồng thời trên một event loop
+    requests = [f"Hôm nay bạn thế nào? ({i})" for i in range(concurrency)]
+    results.append(measure(
+        "graph_ainvoke_concurrent",
+        lambda: asyncio.run(Workflow.arun_requests(requests, max_concurrency=concurrency)),
+        repeat, requests=concurrency, latency=latency,
+    ))
+    return results
+
+
+def _result_key(result: Dict[str, Any]) -> str:
+    params = {k: v for k, v in result.items() if not k.endswith("_ms") and k != "repeat"}
+    return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, max_regression: float) -> List[str]:
+    """Các phép đo chậm hơn baseline quá max_regression (tính theo p50)"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {_result_key(result): result for result in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get(_result_key(result))
+        if old and result["p50_ms"] > old["p50_ms"] * (1 + max_regression):
+            regressions.append(f"{_result_key(result)}: {old['p50_ms']:.2f} -> {result['p50_ms']:.2f} ms")
+    return regressions
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 1000], help='Số dòng hàng hoá của file Excel giả')
+    parser.add_argument('--latency', type=float, default=0.05, help='Độ trễ (giây) mỗi lần gọi model giả')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=32, help='Số yêu cầu chạy đồng thời khi đo ainvoke')
+    parser.add_argument('--out', default=DEFAULT_OUT, help='File JSON ghi kết quả')
+    parser.add_argument('--baseline', help='File JSON kết quả cũ để so sánh')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='Tỉ lệ chậm hơn baseline tối đa cho phép')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.items, args.latency, args.repeat, args.concurrency)
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "latency": args.latency,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã ghi kết quả vào {args.out}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression)
+        if regressions:
+            print("❌ Chậm hơn baseline:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print("✅ Không có bước nào chậm hơn baseline")
@@ -0,0 +1,65 @@
+"""Đo thời gian ghi bảng hàng hoá vào DOCX theo số dòng (10 -> 10.000 dòng)
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_table_writer.py
+    python benchmarks/bench_table_writer.py --sizes 10 100 1000 10000 --legacy-max 100
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docx import Document
+
+from docx_table import add_table_rows
+
+HEADER = ['STT', 'Tên hàng hóa, dịch vụ', 'Đơn vị tính', 'Số lượng', 'Đơn giá', 'Thành tiền']
+
+
+def make_rows(count: int):
+    """Tạo bảng hàng hoá giả có count dòng hàng"""
+    return [HEADER] + [[str(i), f'Sản phẩm {i}', 'Cái', '2', '150000', '300000'] for i in range(1, count + 1)]
+
+
+def legacy_table(doc, rows):
+    """Cách ghi bảng cũ: table.cell(i, j) cho từng ô và in đậm từng run của dòng tiêu đề"""
+    table = doc.add_table(rows=len(rows), cols=len(rows[0]))
+    table.style = 'Table Grid'
+    for i, row in enumerate(rows):
+        for j, value in enumerate(row):
+            cell = table.cell(i, j)
+            cell.text = str(value) if value is not None else ""
+            if i == 0:
+                for paragraph in cell.paragraphs:
+                    for run in paragraph.runs:
+                        run.bold = True
+                        run.font.name = 'Times New Roman'
+
+
+def measure(writer, count: int) -> float:
+    """Thời gian (giây) tạo tài liệu và ghi bảng count dòng"""
+    rows = make_rows(count)
+    doc = Document()
+    start = time.perf_counter()
+    writer(doc, rows)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--legacy-max', type=int, default=100, help='Bỏ qua cách cũ khi số dòng lớn hơn giá trị này')
+    args = parser.parse_args()
+
+    print(f"{'Số dòng':>8} | {'add_table_rows (s)':>18} | {'µs/dòng':>8} | {'cách cũ (s)':>12} | {'µs/dòng':>8}")
+    for size in args.sizes:
+        new = measure(add_table_rows, size)
+        line = f"{size:>8} | {new:>18.4f} | {new / size * 1e6:>8.1f}"
+        if size <= args.legacy_max:
+            old = measure(legacy_table, size)
+            line += f" | {old:>12.4f} | {old / size * 1e6:>8.1f}"
+        else:
+            line += f" | {'-':>12} | {'-':>8}"
+        print(line)
@@ -0,0 +1,76 @@
+"""Kiểm tra nhanh intent_router: luật định tuyến (_rule_route) và nhật ký định tuyến (log_decision)
+
+Chạy từ thư mục gốc của repo (lỗi thì dừng ở assert đầu tiên sai):
+    python benchmarks/check_intent_router.py
+"""
+import json
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+os.environ.setdefault("QUIET_LOGS", "1")
+
+import intent_router
+from intent_router import CONFIDENCE_THRESHOLD, _rule_route
+
+# Câu chắc chắn là yêu cầu tạo hoá đơn: không cần gọi LLM
+INVOICE = [
+    "Tạo hóa đơn từ file test1.xlsx",
+    "lập hóa đơn cho tôi",
+    "xuất hóa đơn từ excel",
+    "làm hóa đơn giúp mình",
+    "in giúp tôi hóa đơn",
+    "test1.xlsx",
+]
+# Câu hỏi, hoặc câu nhắc tới hoá đơn mà không nhờ tạo: độ tin cậy dưới ngưỡng để LLM quyết định
+UNSURE = [
+    "tôi nhận ra hóa đơn bị sai",
+    "chuyển khoản theo hóa đơn nào",
+    "Làm sao để lập hóa đơn điện tử?",
+    "Cách xuất hóa đơn đỏ cho công ty như thế nào?",
+    "In ra giúp tôi danh sách hóa đơn tháng trước được không?",
+    "report.XLSX có lỗi gì vậy?",
+    "Hóa đơn là gì?",
+    "ra hóa đơn",
+]
+CHAT = ["Xin chào", "cảm ơn bạn"]
+
+
+def check_rules() -> None:
+    for text in INVOICE:
+        decision = _rule_route(text)
+        assert decision["route"] == "invoice" and decision["confidence"] >= CONFIDENCE_THRESHOLD, (text, decision)
+    for text in UNSURE:
+        decision = _rule_route(text)
+        assert decision["confidence"] < CONFIDENCE_THRESHOLD, (text, decision)
+    for text in CHAT:
+        decision = _rule_route(text)
+        assert decision["route"] == "chat" and decision["confidence"] >= CONFIDENCE_THRESHOLD, (text, decision)
+    assert _rule_route("Tạo hóa đơn từ file data/test1.xlsx")["file_name"] == "data/test1.xlsx"
+
+
+def check_log() -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "routing.jsonl")
+        intent_router.ROUTING_LOG_PATH, intent_router.ROUTING_LOG_MAX_BYTES = path, 400
+        decision = _rule_route("Tạo hóa đơn từ file bi_mat.xlsx")
+        for _ in range(5):
+            intent_router.log_decision("Tạo hóa đơn từ file bi_mat.xlsx", decision)
+        with open(path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        # Mặc định không ghi nội dung câu (kể cả tên file), chỉ ghi hash
+        assert records and all("text" not in record and "file_name" not in record and record["text_sha256"] for record in records)
+        # File vượt giới hạn được đổi tên thành .1
+        assert os.path.exists(path + ".1") and os.path.getsize(path) < 400
+
+
+def main() -> None:
+    for check in (check_rules, check_log):
+        check()
+        print(f"✅ {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Kiểm tra nhanh invoice_totals: đọc số kiểu Việt Nam, đọc số tiền bằng chữ, bảng thiếu cột và ô thuế suất dạng %
+
+Chạy từ thư mục gốc của repo (lỗi thì dừng ở assert đầu tiên sai):
+    python benchmarks/check_invoice_totals.py
+"""
+import math
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from invoice_totals import compute_totals, find_source_totals, parse_vn_number, read_amount
+from rule_extractor import TABLE_HEADER
+
+
+def check_parse_vn_number() -> None:
+    cases = {
+        '1.234.567': 1234567, '1.234,5': 1234.5, '1,234.5': 1234.5, '150,000': 150000, '12,5': 12.5,
+        '10%': 10, '(2.000)': -2000, '-3.500': -3500, '1.5': 1.5, '1 200 000 đ': 1200000, 'Giá: 45.000đ': 45000,
+        '\xa0900': 900, 7: 7, 0.1: 0.1,
+    }
+    for value, expected in cases.items():
+        assert parse_vn_number(value) == expected, (value, parse_vn_number(value), expected)
+    for value in ('', 'không có', None, True):
+        assert math.isnan(parse_vn_number(value)), value
+
+
+def check_read_amount() -> None:
+    cases = {
+        0: 'Không đồng',
+        15: 'Mười lăm đồng',
+        21: 'Hai mươi mốt đồng',
+        105: 'Một trăm linh năm đồng',
+        1205000: 'Một triệu hai trăm linh năm nghìn đồng',
+        1000005: 'Một triệu không trăm linh năm đồng',
+        2000000000: 'Hai tỷ đồng',
+    }
+    for amount, expected in cases.items():
+        assert read_amount(amount) == expected, (amount, read_amount(amount), expected)
+
+
+def check_tables() -> None:
+    # Bảng đủ cột theo TABLE_HEADER: thành tiền thiếu được tính lại, thành tiền sai được sửa và báo lệch
+    full = compute_totals([TABLE_HEADER, ['1', 'A', 'Cái', '2', '100.000', ''], ['2', 'B', 'Cái', '3', '50.000', '100.000']])
+    assert full['du_lieu_bang'][1][5] == '200000' and full['du_lieu_bang'][2][5] == '150000', full['du_lieu_bang']
+    assert full['tong_tien_hang'] == 350000 and len(full['mismatches']) == 1, full
+
+    # Bảng 5 cột do LLM trả về (không có Đơn vị tính): tìm cột theo tiêu đề thay vì vị trí
+    short = compute_totals([['STT', 'Tên', 'SL', 'Đơn giá', 'Thành tiền'], ['1', 'A', '2', '100', '']])
+    assert short['du_lieu_bang'][1] == ['1', 'A', '2', '100', '200'], short['du_lieu_bang']
+
+    # Tiêu đề mặc định của InvoiceDetails
+    default = compute_totals([['SP', 'SL', 'Đơn giá', 'TT'], ['A', '4', '25', '100']])
+    assert default['tong_tien_hang'] == 100 and not default['mismatches'], default
+
+    # "TT" ở cột đầu là số thứ tự, không phải thành tiền: cột Số tiền được dùng và STT không bị ghi đè
+    ordinal = compute_totals([['TT', 'Tên', 'SL', 'Đơn giá', 'Số tiền'], ['1', 'A', '2', '100', ''], ['2', 'B', '1', '50', '50']])
+    assert [row[0] for row in ordinal['du_lieu_bang'][1:]] == ['1', '2'], ordinal['du_lieu_bang']
+    assert ordinal['du_lieu_bang'][1][4] == '200' and ordinal['tong_tien_hang'] == 250, ordinal
+    no_amount = compute_totals([['TT', 'Tên', 'SL', 'Đơn giá'], ['1', 'A', '2', '100']])
+    assert no_amount['du_lieu_bang'][1] == ['1', 'A', '2', '100'] and no_amount['tong_tien_hang'] == 0, no_amount
+
+    # Không tìm được cột số lượng / đơn giá: giữ nguyên bảng, chỉ cộng cột thành tiền
+    unknown = compute_totals([['Tên', 'Thành tiền'], ['A', '300'], ['B']])
+    assert unknown['du_lieu_bang'] == [['Tên', 'Thành tiền'], ['A', '300'], ['B', '']], unknown['du_lieu_bang']
+    assert unknown['tong_tien_hang'] == 300, unknown
+    assert compute_totals([['A', 'B'], ['x', 'y']])['tong_tien_hang'] == 0
+    assert compute_totals(None)['du_lieu_bang'] == []
+
+
+def check_vat_rate() -> None:
+    table = [TABLE_HEADER, ['1', 'A', 'Cái', '2', '100.000', '200.000']]
+    # Ô Excel định dạng phần trăm được đọc là 0.1
+    assert find_source_totals([['Thuế suất GTGT', 0.1]])['thue_suat_gtgt'] == 10
+    assert compute_totals(table, [['Thuế suất GTGT', 0.1]])['tien_thue_gtgt'] == 20000
+    assert compute_totals(table, [['Thuế suất GTGT:', '8%']])['tien_thue_gtgt'] == 16000
+    assert compute_totals(table, [['Thuế suất GTGT', 10]])['tien_thue_gtgt'] == 20000
+    assert compute_totals(table, [['Thuế suất GTGT', '0,5%']])['tien_thue_gtgt'] == 1000
+    totals = compute_totals(table, [['Thuế suất GTGT', 0.1], ['Tổng cộng tiền thanh toán', '220.000']])
+    assert totals['tong_thanh_toan'] == 220000 and not totals['mismatches'], totals
+
+
+def main() -> None:
+    for check in (check_parse_vn_number, check_read_amount, check_tables, check_vat_rate):
+        check()
+        print(f"✅ {check.__name__}")
+
+
+if __name__ == "__main__":
+    main()
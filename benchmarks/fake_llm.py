@@ -0,0 +1,101 @@
+"""Chat model giả, kết quả xác định và độ trễ tuỳ chọn, dùng thay Gemini/LM Studio khi đo benchmark"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Type
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+from pydantic import BaseModel
+
+TABLE_HEADER = ['STT', 'Tên hàng hóa, dịch vụ', 'Đơn vị tính', 'Số lượng', 'Đơn giá', 'Thành tiền']
+
+
+class FakeChatModel(BaseChatModel):
+    """Model giả: mỗi lần gọi chờ latency giây rồi trả về câu trả lời cố định
+
+    - invoke/ainvoke: prompt định tuyến (có PROCESS_INVOICE) thì trả về PROCESS_INVOICE khi câu hỏi
+      nhắc tới hoá đơn, còn lại trả về reply
+    - stream/astream: chờ latency giây rồi trả về câu trả lời đó từng từ một, mỗi từ cách nhau token_latency giây
+    - with_structured_output: trả về đối tượng schema với giá trị giả cho mọi trường
+    - bind_tools: trả về chính model (không gọi tool)
+    """
+
+    model: str = "fake-benchmark"
+    latency: float = 0.0
+    token_latency: float = 0.0
+    reply: str = "Xin chào, tôi có thể giúp gì cho bạn về hoá đơn?"
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        self.calls += 1
+        text = str(messages[-1].content) if messages else ""
+        if "PROCESS_INVOICE" in text:
+            question = text.split('Người dùng hỏi: "', 1)[-1].split('"', 1)[0].lower()
+            if "hóa đơn" in question or "hoá đơn" in question:
+                return AIMessage(content="PROCESS_INVOICE: Tôi sẽ giúp bạn tạo hóa đơn từ file Excel.")
+        return AIMessage(content=self.reply)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    def _chunks(self, messages: List[BaseMessage]) -> List[ChatGenerationChunk]:
+        words = str(self._reply(messages).content).split(" ")
+        return [ChatGenerationChunk(message=AIMessageChunk(content=word if index == 0 else " " + word)) for index, word in enumerate(words)]
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        if self.latency:
+            time.sleep(self.latency)
+        for index, chunk in enumerate(self._chunks(messages)):
+            if index and self.token_latency:
+                time.sleep(self.token_latency)
+            yield chunk
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        for index, chunk in enumerate(self._chunks(messages)):
+            if index and self.token_latency:
+                await asyncio.sleep(self.token_latency)
+            yield chunk
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "FakeChatModel":
+        return self
+
+    def with_structured_output(self, schema: Type[BaseModel], include_raw: bool = False, **kwargs: Any) -> RunnableLambda:
+        def fill() -> Dict[str, Any]:
+            self.calls += 1
+            values = {}
+            for name in schema.model_fields:
+                if name == 'du_lieu_bang':
+                    values[name] = [TABLE_HEADER, ['1', 'Hàng hoá mẫu', 'Cái', '1', '100000', '100000']]
+                else:
+                    values[name] = f"Giá trị {name}"
+            parsed = schema(**values)
+            if include_raw:
+                return {"raw": AIMessage(content=""), "parsed": parsed, "parsing_error": None}
+            return parsed
+
+        def run(prompt: Any) -> Any:
+            if self.latency:
+                time.sleep(self.latency)
+            return fill()
+
+        async def arun(prompt: Any) -> Any:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            return fill()
+
+        return RunnableLambda(run, afunc=arun)
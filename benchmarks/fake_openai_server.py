@@ -0,0 +1,184 @@
+"""Server giả tương thích OpenAI (POST /v1/chat/completions), dùng để thử bộ giới hạn LLM khi quá tải
+
+Server mô phỏng một model có sức chứa giới hạn: quá capacity lần gọi cùng lúc hoặc quá rate lần gọi
+mỗi giây thì trả 429 kèm Retry-After, ngoài ra có thể trả 503 ngẫu nhiên với tỉ lệ error_rate.
+Khi request có tools thì trả về tool call cho tool đầu tiên (đủ cho with_structured_output).
+Request có "stream": true thì trả về câu trả lời dạng SSE từng từ một, mỗi từ cách nhau token_latency giây.
+
+Chạy riêng (trỏ ChatOpenAI base_url tới http://127.0.0.1:1234/v1):
+    python benchmarks/fake_openai_server.py --port 1234 --capacity 4 --latency 0.2
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], latency: float = 0.1, capacity: int = 4, rate: float = 0.0,
+                 error_rate: float = 0.0, reply: str = "Xin chào, tôi có thể giúp gì cho bạn?", seed: int = 0,
+                 token_latency: float = 0.0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.capacity = capacity
+        self.rate = rate
+        self.error_rate = error_rate
+        self.reply = reply
+        self.token_latency = token_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.stats: Dict[str, int] = {"requests": 0, "ok": 0, "rate_limited": 0, "unavailable": 0, "max_active": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def admit(self) -> int:
+        """Mã HTTP cho request mới: 200 nếu còn sức chứa, 429 nếu quá tải, 503 ngẫu nhiên theo error_rate"""
+        with self.lock:
+            self.stats["requests"] += 1
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_count = now, 0
+            if self.active >= self.capacity or (self.rate > 0 and self.window_count >= self.rate):
+                self.stats["rate_limited"] += 1
+                return 429
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.stats["unavailable"] += 1
+                return 503
+            self.active += 1
+            self.window_count += 1
+            self.stats["max_active"] = max(self.stats["max_active"], self.active)
+            return 200
+
+    def done(self) -> None:
+        with self.lock:
+            self.active -= 1
+            self.stats["ok"] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def _send(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, request: Dict[str, Any]) -> None:
+        """Câu trả lời dạng SSE như OpenAI: mỗi từ một khúc chat.completion.chunk, kết thúc bằng [DONE]"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        words = self.server.reply.split(" ")
+        for index, word in enumerate(words):
+            if index and self.server.token_latency:
+                time.sleep(self.server.token_latency)
+            delta = {"role": "assistant", "content": word} if index == 0 else {"content": " " + word}
+            self._write_event({
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "delta": delta, "finish_reason": "stop" if index == len(words) - 1 else None}],
+            })
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _write_event(self, body: Dict[str, Any]) -> None:
+        self.wfile.write(b"data: " + json.dumps(body, ensure_ascii=False).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/stats":
+            with self.server.lock:
+                self._send(200, dict(self.server.stats, active=self.server.active))
+        else:
+            self._send(404, {"error": {"message": "not found"}})
+
+    def do_POST(self) -> None:
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": "not found"}})
+            return
+        status = self.server.admit()
+        if status == 429:
+            self._send(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}}, {"Retry-After": "0.2"})
+            return
+        if status == 503:
+            self._send(503, {"error": {"message": "Model overloaded", "type": "server_error"}})
+            return
+        try:
+            time.sleep(self.server.latency)
+            if request.get("stream") and not request.get("tools"):
+                self._send_stream(request)
+                return
+            message: Dict[str, Any] = {"role": "assistant", "content": self.server.reply}
+            tools = request.get("tools") or []
+            if tools:
+                message = {"role": "assistant", "content": None, "tool_calls": [{
+                    "id": f"call_{uuid.uuid4().hex[:8]}",
+                    "type": "function",
+                    "function": {"name": tools[0]["function"]["name"], "arguments": "{}"},
+                }]}
+            self._send(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "fake"),
+                "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tools else "stop"}],
+                "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+            })
+        finally:
+            self.server.done()
+
+
+def serve(port: int = 0, **config: Any) -> FakeOpenAIServer:
+    """Chạy server giả ở thread nền (port=0 là chọn cổng trống), trả về server để đọc base_url, stats và shutdown()"""
+    server = FakeOpenAIServer(("127.0.0.1", port), **config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Server giả tương thích OpenAI để thử tải")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--latency", type=float, default=0.1, help="Độ trễ (giây) mỗi câu trả lời")
+    parser.add_argument("--capacity", type=int, default=4, help="Số request xử lý cùng lúc tối đa, vượt quá trả 429")
+    parser.add_argument("--rate", type=float, default=0.0, help="Số request mỗi giây tối đa, 0 là không giới hạn")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ trả 503 ngẫu nhiên")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Độ trễ (giây) giữa các từ khi stream")
+    args = parser.parse_args()
+    server = FakeOpenAIServer(("127.0.0.1", args.port), latency=args.latency, capacity=args.capacity,
+                              rate=args.rate, error_rate=args.error_rate, token_latency=args.token_latency)
+    print(f"🚀 Server giả OpenAI tại {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
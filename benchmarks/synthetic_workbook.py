@@ -0,0 +1,102 @@
+"""Tạo file Excel hoá đơn giả với số dòng hàng và số hoá đơn tuỳ chọn để đo benchmark
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/synthetic_workbook.py out.xlsx --items 500 --invoices 3 --layout blocks
+"""
+import argparse
+import random
+from datetime import date
+from typing import Any, List
+
+HEADER = ['STT', 'Tên hàng hóa, dịch vụ', 'Đơn vị tính', 'Số lượng', 'Đơn giá', 'Thành tiền']
+UNITS = ['Cái', 'Bộ', 'Hộp', 'Chiếc', 'Kg', 'Thùng']
+PRODUCTS = ['Máy tính xách tay', 'Màn hình 24 inch', 'Bàn phím cơ', 'Chuột không dây', 'Ổ cứng SSD 1TB',
+            'Giấy in A4', 'Mực in laser', 'Bộ phát Wi-Fi', 'Tai nghe', 'Loa vi tính']
+
+
+def make_invoice_rows(items: int, index: int = 1, seed: int = 0, standard_labels: bool = True) -> List[List[Any]]:
+    """Các hàng của một hoá đơn: thông tin người bán/mua, bảng hàng hoá items dòng và dòng tổng cộng
+
+    Args:
+        items (int): Số dòng hàng hoá
+        index (int): Số thứ tự hoá đơn (dùng trong tên, ký hiệu)
+        seed (int): Hạt giống ngẫu nhiên, cùng seed luôn cho cùng dữ liệu
+        standard_labels (bool): False thì đổi nhãn người mua thành nhãn lạ để bộ luật
+            không nhận ra và phải gọi LLM (đo đường đi có LLM)
+    """
+    rng = random.Random(seed * 100003 + index)
+    day = date(2025, rng.randint(1, 12), rng.randint(1, 28))
+    buyer_label = 'Người mua hàng' if standard_labels else 'Bên nhận'
+    rows: List[List[Any]] = [
+        ['HÓA ĐƠN BÁN HÀNG'],
+        [f'Ngày {day.day} tháng {day.month} năm {day.year}'],
+        [f'Ký hiệu: HD{index:04d}'],
+        [f'Đơn vị bán hàng: Công ty TNHH Bán Hàng Số {index}'],
+        [f'Mã số thuế: {rng.randint(10 ** 9, 10 ** 10 - 1)}'],
+        [f'Địa chỉ: Số {rng.randint(1, 500)} Đường Láng, Hà Nội'],
+        [f'Điện thoại: 09{rng.randint(10 ** 7, 10 ** 8 - 1)}'],
+        [f'{buyer_label}: Công ty Cổ phần Mua Hàng Số {index}'],
+        [f'Mã số thuế: {rng.randint(10 ** 9, 10 ** 10 - 1)}'],
+        [f'Địa chỉ: Số {rng.randint(1, 500)} Nguyễn Huệ, TP.HCM'],
+        ['Hình thức thanh toán: Chuyển khoản'],
+        [],
+        list(HEADER),
+    ]
+    total = 0
+    for stt in range(1, items + 1):
+        quantity = rng.randint(1, 20)
+        price = rng.randint(1, 500) * 1000
+        total += quantity * price
+        rows.append([stt, f'{rng.choice(PRODUCTS)} loại {rng.randint(1, 99)}', rng.choice(UNITS), quantity, price, quantity * price])
+    rows.append(['Cộng tiền hàng:', None, None, None, None, total])
+    rows.append([])
+    return rows
+
+
+def write_workbook(
+    file_path: str,
+    items: int,
+    invoices: int = 1,
+    layout: str = 'sheets',
+    seed: int = 0,
+    standard_labels: bool = True,
+) -> str:
+    """Ghi file Excel giả
+
+    Args:
+        file_path (str): Đường dẫn file .xlsx cần tạo
+        items (int): Số dòng hàng hoá mỗi hoá đơn
+        invoices (int): Số hoá đơn trong file
+        layout (str): 'sheets' là mỗi hoá đơn một sheet, 'blocks' là các hoá đơn xếp liền nhau trong một sheet
+        seed (int): Hạt giống ngẫu nhiên
+        standard_labels (bool): Xem make_invoice_rows
+
+    Returns:
+        str: file_path
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = None
+    for index in range(1, invoices + 1):
+        if sheet is None or layout == 'sheets':
+            sheet = workbook.create_sheet(f'HD{index}' if layout == 'sheets' else 'Hoa don')
+            # Cột rộng giống file thật để openpyxl ghi đủ thông tin định dạng
+            sheet.column_dimensions['B'].width = 40
+        for row in make_invoice_rows(items, index=index, seed=seed, standard_labels=standard_labels):
+            sheet.append(row)
+    workbook.save(file_path)
+    return file_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file_path')
+    parser.add_argument('--items', type=int, default=20)
+    parser.add_argument('--invoices', type=int, default=1)
+    parser.add_argument('--layout', choices=['sheets', 'blocks'], default='sheets')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--nonstandard-labels', action='store_true', help='Dùng nhãn lạ để buộc gọi LLM')
+    args = parser.parse_args()
+    write_workbook(args.file_path, args.items, args.invoices, args.layout, args.seed, not args.nonstandard_labels)
+    print(f"✅ Đã tạo {args.file_path}: {args.invoices} hoá đơn x {args.items} dòng hàng")
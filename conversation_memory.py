@@ -0,0 +1,113 @@
+import os
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+from langchain_core.messages.utils import count_tokens_approximately, get_buffer_string
+
+from llm_cache import cached_invoke
+from tracing import log
+
+# Số lượt hội thoại gần nhất giữ nguyên văn, các lượt cũ hơn được gộp vào bản tóm tắt
+MEMORY_MAX_TURNS = int(os.getenv("MEMORY_MAX_TURNS", "4"))
+# Giới hạn token cho các lượt giữ nguyên văn và cho bản tóm tắt
+MEMORY_MAX_TOKENS = int(os.getenv("MEMORY_MAX_TOKENS", "1500"))
+MEMORY_SUMMARY_TOKENS = int(os.getenv("MEMORY_SUMMARY_TOKENS", "300"))
+
+_SUMMARY_PROMPT = """Tóm tắt ngắn gọn cuộc hội thoại giữa người dùng và trợ lý dưới đây bằng tiếng Việt,
+tối đa khoảng {max_words} từ. Giữ lại tên file, số liệu, thông tin hoá đơn và các việc đã làm/chưa làm.
+
+Tóm tắt trước đó:
+{summary}
+
+Các lượt hội thoại mới cần gộp vào:
+{turns}
+
+Tóm tắt mới:"""
+
+
+class SummaryBufferMemory:
+    """Bộ nhớ hội thoại có giới hạn: giữ nguyên văn max_turns lượt gần nhất (trong max_tokens),
+    các lượt cũ hơn được LLM gộp dần vào một bản tóm tắt ngắn
+
+    Dùng thay ConversationBufferMemory: load_memory_variables trả về history (các lượt gần nhất)
+    và summary, nên prompt không lớn dần theo độ dài hội thoại.
+    """
+
+    def __init__(
+        self,
+        llm: Any = None,
+        max_turns: int = MEMORY_MAX_TURNS,
+        max_tokens: int = MEMORY_MAX_TOKENS,
+        summary_tokens: int = MEMORY_SUMMARY_TOKENS,
+    ):
+        self.llm = llm
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.summary = ""
+        self.turns: List[List[BaseMessage]] = []
+
+    def load_memory_variables(self, inputs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Biến cho prompt: history (list message của các lượt gần nhất) và summary"""
+        return {
+            "history": [message for turn in self.turns for message in turn],
+            "summary": self.summary or "(chưa có)",
+        }
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, Any]) -> None:
+        """Lưu một lượt hội thoại (câu hỏi và câu trả lời), gộp các lượt cũ nếu vượt giới hạn"""
+        self.turns.append([HumanMessage(content=str(inputs["input"])), AIMessage(content=str(outputs["output"]))])
+        self._fold_old_turns()
+
+    def add_note(self, note: str) -> None:
+        """Ghi chú ngắn (vd kết quả chạy tool) vào lượt hiện tại thay vì tạo thêm một lượt giả"""
+        if not self.turns:
+            self.turns.append([AIMessage(content=note)])
+        else:
+            last = self.turns[-1][-1]
+            content = f"{last.content}\n{note}" if last.content else note
+            self.turns[-1][-1] = AIMessage(content=content)
+        self._fold_old_turns()
+
+    def token_count(self) -> int:
+        """Số token (ước lượng) của bộ nhớ đưa vào prompt"""
+        history = self.load_memory_variables()["history"]
+        return count_tokens_approximately(history) + count_tokens_approximately([AIMessage(content=self.summary)])
+
+    def _fold_old_turns(self) -> None:
+        old_turns = []
+        while len(self.turns) > 1 and (
+            len(self.turns) > self.max_turns
+            or count_tokens_approximately([m for turn in self.turns for m in turn]) > self.max_tokens
+        ):
+            old_turns.append(self.turns.pop(0))
+        if old_turns:
+            self.summary = self._summarize([m for turn in old_turns for m in turn])
+
+    def _summarize(self, messages: List[BaseMessage]) -> str:
+        """Gộp các message cũ vào bản tóm tắt, không có LLM (hoặc LLM lỗi) thì giữ phần cuối văn bản"""
+        turns_text = get_buffer_string(messages, human_prefix="Người dùng", ai_prefix="Trợ lý")
+        if self.llm is not None:
+            prompt = _SUMMARY_PROMPT.format(
+                max_words=self.summary_tokens // 2, summary=self.summary or "(chưa có)", turns=turns_text
+            )
+            try:
+                response = cached_invoke(self.llm, prompt, node="memory_summary")
+                summary = response.content if hasattr(response, 'content') else str(response)
+                if isinstance(summary, str) and summary.strip():
+                    return self._clip(summary.strip())
+            except Exception as e:
+                log(f"❌ Lỗi tóm tắt hội thoại: {e}")
+        return self._clip(f"{self.summary}\n{turns_text}".strip())
+
+    def _clip(self, text: str) -> str:
+        """Cắt văn bản (giữ phần cuối, mới nhất) về trong giới hạn summary_tokens"""
+        # count_tokens_approximately tính khoảng 4 ký tự một token
+        max_chars = self.summary_tokens * 4
+        return text if len(text) <= max_chars else "…" + text[-max_chars:]
+
+
+def count_prompt_tokens(prompt_value: Any) -> int:
+    """Số token (ước lượng) của prompt đã dựng (PromptValue hoặc list message)"""
+    messages = prompt_value.to_messages() if hasattr(prompt_value, "to_messages") else prompt_value
+    return count_tokens_approximately(messages)
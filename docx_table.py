@@ -0,0 +1,75 @@
+from typing import TYPE_CHECKING, Any, List
+from xml.sax.saxutils import escape
+
+# python-docx được import trong hàm để import module này không kéo theo lxml/docx
+if TYPE_CHECKING:
+    from docx.document import Document as DocumentObject
+    from docx.table import Table
+
+_W_NS = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+# Định dạng dòng tiêu đề đặt một lần trong table style (tblStylePr firstRow) thay vì từng run
+_HEADER_STYLE_XML = (
+    f'<w:tblStylePr {_W_NS} w:type="firstRow">'
+    '<w:rPr><w:rFonts w:ascii="Times New Roman" w:hAnsi="Times New Roman" w:cs="Times New Roman"/><w:b/><w:bCs/></w:rPr>'
+    '</w:tblStylePr>'
+)
+
+
+def _ensure_header_style(doc: "DocumentObject", style_name: str) -> None:
+    """Thêm định dạng in đậm + Times New Roman cho dòng đầu vào table style nếu chưa có"""
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import qn
+
+    style = doc.styles[style_name].element
+    for item in style.findall(qn('w:tblStylePr')):
+        if item.get(qn('w:type')) == 'firstRow':
+            return
+    style.append(parse_xml(_HEADER_STYLE_XML))
+
+
+def _cell_xml(value: Any, width: str) -> str:
+    """XML một ô bảng chứa một đoạn văn bản"""
+    text = escape(str(value)) if value is not None else ''
+    run = f'<w:r><w:t xml:space="preserve">{text}</w:t></w:r>' if text else ''
+    return f'<w:tc><w:tcPr><w:tcW w:w="{width}" w:type="dxa"/></w:tcPr><w:p>{run}</w:p></w:tc>'
+
+
+def add_table_rows(doc: "DocumentObject", rows: List[List[Any]], style_name: str = 'Table Grid') -> "Table":
+    """Thêm bảng vào tài liệu, dòng đầu là tiêu đề, thời gian tuyến tính theo số dòng
+
+    Khác với table.cell(i, j) (mỗi lần gọi dựng lại toàn bộ lưới ô), hàm này tạo XML cho tất cả
+    các dòng trong một lượt rồi gắn thẳng vào bảng.
+
+    Args:
+        doc (Document): Tài liệu python-docx
+        rows (List[List[Any]]): Dữ liệu bảng, list con đầu tiên là tiêu đề
+        style_name (str): Table style dùng cho bảng
+
+    Returns:
+        Table: Bảng đã tạo
+    """
+    from docx.oxml import parse_xml
+    from docx.oxml.ns import qn
+
+    cols = max(len(row) for row in rows)
+    table = doc.add_table(rows=0, cols=cols)
+    _ensure_header_style(doc, style_name)
+    table.style = style_name
+
+    tbl = table._tbl
+    # Bật định dạng dòng đầu của table style
+    look = tbl.tblPr.find(qn('w:tblLook'))
+    if look is not None:
+        look.set(qn('w:firstRow'), '1')
+    widths = [col.get(qn('w:w')) for col in tbl.tblGrid.findall(qn('w:gridCol'))]
+
+    body = ''.join(
+        '<w:tr>' + ''.join(_cell_xml(row[j] if j < len(row) else None, widths[j]) for j in range(cols)) + '</w:tr>'
+        for row in rows
+    )
+    # Đánh dấu dòng đầu là dòng tiêu đề (lặp lại khi bảng sang trang)
+    body = body.replace('<w:tr>', '<w:tr><w:trPr><w:tblHeader/></w:trPr>', 1)
+    for tr in list(parse_xml(f'<w:tbl {_W_NS}>{body}</w:tbl>')):
+        tbl.append(tr)
+    return table
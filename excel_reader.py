@@ -0,0 +1,86 @@
+from typing import Any, Iterator, List, Optional, Union
+
+
+def iter_excel_rows(
+    file_path: str,
+    sheet_name: Optional[Union[str, int]] = None,
+    cell_range: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> Iterator[List[Any]]:
+    """Đọc lần lượt từng hàng của sheet Excel ở chế độ read-only, không nạp cả file vào bộ nhớ
+
+    Args:
+        file_path (str): Đường dẫn file Excel
+        sheet_name (str | int, optional): Tên hoặc vị trí sheet, mặc định là sheet đầu tiên
+        cell_range (str, optional): Vùng ô cần đọc, ví dụ 'A1:F200'
+        max_rows (int, optional): Số hàng tối đa trả về
+
+    Yields:
+        list: Giá trị các ô của một hàng (đã bỏ các ô trống ở cuối hàng)
+    """
+    # openpyxl chỉ nạp khi thực sự đọc file để import module nhanh
+    from openpyxl import load_workbook
+    from openpyxl.utils.cell import range_boundaries
+
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        if sheet_name is None:
+            sheet = workbook.worksheets[0]
+        elif isinstance(sheet_name, int):
+            sheet = workbook.worksheets[sheet_name]
+        else:
+            sheet = workbook[sheet_name]
+
+        bounds = {}
+        if cell_range:
+            min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+            bounds = dict(min_col=min_col, min_row=min_row, max_col=max_col, max_row=max_row)
+
+        emitted = 0
+        # Chỉ đếm các hàng trống liên tiếp, khi gặp hàng có dữ liệu mới trả ra
+        # để bỏ các hàng trống ở đầu và cuối sheet (chỉ có định dạng) giống pd.read_excel
+        pending_empty = 0
+        for values in sheet.iter_rows(values_only=True, **bounds):
+            row = list(values)
+            while row and row[-1] is None:
+                row.pop()
+            if not row:
+                if emitted:
+                    pending_empty += 1
+                continue
+            for _ in range(pending_empty):
+                if max_rows is not None and emitted >= max_rows:
+                    return
+                yield []
+                emitted += 1
+            pending_empty = 0
+            if max_rows is not None and emitted >= max_rows:
+                return
+            yield row
+            emitted += 1
+    finally:
+        workbook.close()
+
+
+def read_excel_rows(
+    file_path: str,
+    sheet_name: Optional[Union[str, int]] = None,
+    cell_range: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> List[List[Any]]:
+    """Đọc sheet Excel thành list of lists với số cột bằng nhau (ô trống là None)
+
+    Args:
+        file_path (str): Đường dẫn file Excel
+        sheet_name (str | int, optional): Tên hoặc vị trí sheet, mặc định là sheet đầu tiên
+        cell_range (str, optional): Vùng ô cần đọc, ví dụ 'A1:F200'
+        max_rows (int, optional): Số hàng tối đa trả về
+
+    Returns:
+        list[list]: Mỗi list con là một hàng trong file Excel
+    """
+    rows = list(iter_excel_rows(file_path, sheet_name=sheet_name, cell_range=cell_range, max_rows=max_rows))
+    width = max((len(row) for row in rows), default=0)
+    for row in rows:
+        row.extend([None] * (width - len(row)))
+    return rows
@@ -0,0 +1,208 @@
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, TypedDict
+
+from rule_extractor import fold_text
+from tracing import log
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+# Nhật ký định tuyến (mỗi dòng một JSON), cũng là dữ liệu để huấn luyện bộ phân loại
+ROUTING_LOG_PATH = os.getenv("ROUTING_LOG_PATH", os.path.join(_ROOT, "logs", "routing.jsonl"))
+# Mặc định nhật ký chỉ ghi hash của câu (không lưu nội dung người dùng), ROUTING_LOG_TEXT=1 để ghi cả câu
+# làm dữ liệu huấn luyện; file vượt ROUTING_LOG_MAX_BYTES thì đổi tên thành .1 (chỉ giữ một bản cũ)
+ROUTING_LOG_TEXT = os.getenv("ROUTING_LOG_TEXT", "0") == "1"
+ROUTING_LOG_MAX_BYTES = int(os.getenv("ROUTING_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+ROUTER_MODEL_PATH = os.getenv("ROUTER_MODEL_PATH", os.path.join(_ROOT, ".cache", "intent_router.json"))
+# Dưới ngưỡng này thì để LLM quyết định
+CONFIDENCE_THRESHOLD = float(os.getenv("ROUTER_CONFIDENCE_THRESHOLD", "0.8"))
+
+_FILE_RE = re.compile(r'[\w\-./\\]+\.xlsx?\b', re.IGNORECASE)
+# Động từ phải đứng ngay trước "hoá đơn" (cho phép "giúp tôi", "một"): "tạo hoá đơn", "in giúp tôi hoá đơn",
+# còn "tôi nhận ra hoá đơn bị sai", "chuyển khoản theo hoá đơn" không phải yêu cầu tạo
+_INVOICE_ACTION_RE = re.compile(
+    r'\b(tao|lap|xuat|lam|in|viet)( giup( toi| minh| em)?)?( (mot|1|cai|cac))? (hoa don|invoice)\b'
+    r'|\bhoa don\b.*\btu\b.*\b(excel|file)\b'
+)
+_INVOICE_WORD_RE = re.compile(r'\b(hoa don|invoice|excel|xlsx)\b')
+_QUESTION_RE = re.compile(
+    r'\b(la gi|the nao|lam sao|nao|gi|tai sao|vi sao|bao nhieu|co phai|nghia la|duoc khong)\b|^cach\b|\?\s*$'
+)
+_GREETING_RE = re.compile(r'^(xin chao|chao|hello|hi|hey|cam on|thanks|tam biet)\b')
+
+
+class RouteDecision(TypedDict):
+    route: str  # "invoice", "chat" hoặc "llm" (chưa chắc chắn, để LLM quyết định)
+    confidence: float
+    source: str  # "rule", "classifier" hoặc "llm"
+    file_name: Optional[str]
+
+
+def find_file_name(text: str) -> Optional[str]:
+    """Lấy tên file Excel trong câu của người dùng (vd 'test1.xlsx'), None nếu không có"""
+    match = _FILE_RE.search(text)
+    return match.group(0) if match else None
+
+
+def _rule_route(text: str) -> RouteDecision:
+    """Định tuyến bằng từ khoá / regex"""
+    folded = fold_text(text)
+    file_name = find_file_name(text)
+
+    if _QUESTION_RE.search(folded) and (file_name or _INVOICE_WORD_RE.search(folded)):
+        # Câu hỏi có nhắc tới hoá đơn / file ("Làm sao để lập hoá đơn?", "report.xlsx có lỗi gì vậy?"):
+        # có thể là hỏi cách làm chứ không phải nhờ tạo, độ tin cậy dưới ngưỡng để LLM quyết định
+        return RouteDecision(route="chat", confidence=0.5, source="rule", file_name=file_name)
+    if _INVOICE_ACTION_RE.search(folded) or (file_name and _INVOICE_WORD_RE.search(folded)):
+        confidence = 0.95 if file_name else 0.85
+        return RouteDecision(route="invoice", confidence=confidence, source="rule", file_name=file_name)
+    if file_name:
+        # Chỉ gửi tên file, coi như muốn tạo hoá đơn từ file đó
+        return RouteDecision(route="invoice", confidence=0.8, source="rule", file_name=file_name)
+    if _GREETING_RE.search(folded):
+        return RouteDecision(route="chat", confidence=0.9, source="rule", file_name=None)
+    if _INVOICE_WORD_RE.search(folded):
+        # Nhắc tới hoá đơn nhưng không rõ có muốn tạo không
+        return RouteDecision(route="invoice", confidence=0.5, source="rule", file_name=None)
+    return RouteDecision(route="chat", confidence=0.6, source="rule", file_name=None)
+
+
+def _tokenize(text: str) -> List[str]:
+    words = fold_text(text).split()
+    # Dùng cả từ đơn và cặp từ vì tiếng Việt nhiều từ ghép ("hoa don", "tao file")
+    return words + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+
+class IntentClassifier:
+    """Bộ phân loại Naive Bayes nhỏ chạy offline, huấn luyện từ nhật ký định tuyến"""
+
+    def __init__(self, class_counts: Dict[str, int], token_counts: Dict[str, Dict[str, int]]):
+        self.class_counts = class_counts
+        self.token_counts = token_counts
+        self.vocabulary = {token for counts in token_counts.values() for token in counts}
+        self.totals = {label: sum(counts.values()) for label, counts in token_counts.items()}
+
+    @classmethod
+    def train(cls, samples: List[Dict[str, str]]) -> "IntentClassifier":
+        """Huấn luyện từ các mẫu {"text": ..., "route": ...}"""
+        class_counts: Counter = Counter()
+        token_counts: Dict[str, Counter] = {}
+        for sample in samples:
+            label = sample["route"]
+            class_counts[label] += 1
+            token_counts.setdefault(label, Counter()).update(_tokenize(sample["text"]))
+        return cls(dict(class_counts), {label: dict(counts) for label, counts in token_counts.items()})
+
+    def predict(self, text: str) -> Dict[str, float]:
+        """Xác suất của từng nhãn"""
+        tokens = _tokenize(text)
+        total_samples = sum(self.class_counts.values())
+        vocabulary_size = len(self.vocabulary) + 1
+        scores = {}
+        for label, count in self.class_counts.items():
+            counts = self.token_counts.get(label, {})
+            score = math.log(count / total_samples)
+            for token in tokens:
+                score += math.log((counts.get(token, 0) + 1) / (self.totals.get(label, 0) + vocabulary_size))
+            scores[label] = score
+        best = max(scores.values())
+        exp_scores = {label: math.exp(score - best) for label, score in scores.items()}
+        norm = sum(exp_scores.values())
+        return {label: value / norm for label, value in exp_scores.items()}
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"class_counts": self.class_counts, "token_counts": self.token_counts}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "IntentClassifier":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["class_counts"], data["token_counts"])
+
+
+_classifier: Optional[IntentClassifier] = None
+_classifier_loaded = False
+
+
+def _get_classifier() -> Optional[IntentClassifier]:
+    """Bộ phân loại đã huấn luyện (nếu có file model), chỉ đọc một lần"""
+    global _classifier, _classifier_loaded
+    if not _classifier_loaded:
+        _classifier_loaded = True
+        if os.path.exists(ROUTER_MODEL_PATH):
+            _classifier = IntentClassifier.load(ROUTER_MODEL_PATH)
+    return _classifier
+
+
+def log_decision(text: str, decision: RouteDecision) -> None:
+    """Ghi quyết định định tuyến và độ tin cậy vào ROUTING_LOG_PATH (câu của người dùng chỉ ghi khi ROUTING_LOG_TEXT=1)"""
+    log(f"🧭 Router: {decision['route']} ({decision['source']}, độ tin cậy {decision['confidence']:.2f})")
+    record: Dict[str, Any] = {"ts": time.time(), "text_sha256": hashlib.sha256(text.encode("utf-8")).hexdigest()}
+    if ROUTING_LOG_TEXT:
+        record["text"] = text
+    record.update(decision)
+    if not ROUTING_LOG_TEXT:
+        record.pop("file_name", None)
+    try:
+        os.makedirs(os.path.dirname(ROUTING_LOG_PATH), exist_ok=True)
+        if os.path.exists(ROUTING_LOG_PATH) and os.path.getsize(ROUTING_LOG_PATH) >= ROUTING_LOG_MAX_BYTES:
+            os.replace(ROUTING_LOG_PATH, ROUTING_LOG_PATH + ".1")
+        with open(ROUTING_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        log(f"❌ Không ghi được nhật ký định tuyến: {e}")
+
+
+def route_intent(text: str) -> RouteDecision:
+    """Quyết định câu của người dùng là yêu cầu tạo hoá đơn hay chat thường mà không cần gọi LLM
+
+    Args:
+        text (str): Câu của người dùng
+
+    Returns:
+        RouteDecision: route là "invoice"/"chat", hoặc "llm" khi độ tin cậy thấp và cần LLM quyết định
+    """
+    decision = _rule_route(text)
+    if decision["confidence"] < CONFIDENCE_THRESHOLD:
+        classifier = _get_classifier()
+        if classifier is not None:
+            probabilities = classifier.predict(text)
+            label = max(probabilities, key=probabilities.get)
+            if probabilities[label] > decision["confidence"]:
+                decision = RouteDecision(
+                    route=label, confidence=probabilities[label], source="classifier", file_name=decision["file_name"]
+                )
+    if decision["confidence"] < CONFIDENCE_THRESHOLD:
+        decision = RouteDecision(route="llm", confidence=decision["confidence"], source=decision["source"], file_name=decision["file_name"])
+    log_decision(text, decision)
+    return decision
+
+
+def train_from_log(log_path: str = ROUTING_LOG_PATH, model_path: str = ROUTER_MODEL_PATH) -> IntentClassifier:
+    """Huấn luyện bộ phân loại từ nhật ký định tuyến (ghi với ROUTING_LOG_TEXT=1): dùng các quyết định của LLM
+    và của luật có độ tin cậy cao làm nhãn"""
+    samples = []
+    with open(log_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            # Bản ghi không có câu (ROUTING_LOG_TEXT tắt) không dùng để huấn luyện được
+            if record.get("route") not in ("invoice", "chat") or "text" not in record:
+                continue
+            if record.get("source") == "llm" or record.get("confidence", 0) >= CONFIDENCE_THRESHOLD:
+                samples.append(record)
+    classifier = IntentClassifier.train(samples)
+    classifier.save(model_path)
+    print(f"✅ Đã huấn luyện bộ phân loại từ {len(samples)} câu, lưu tại {model_path}")
+    return classifier
+
+
+if __name__ == "__main__":
+    # python intent_router.py [logs/routing.jsonl]
+    train_from_log(*sys.argv[1:2])
@@ -0,0 +1,424 @@
+import asyncio
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, create_model
+
+from llm_cache import LLMCache, _model_name, cache_enabled, get_llm_cache
+from rule_extractor import CORE_FIELDS, TABLE_HEADER, cell_text, extract_invoice_by_rules, find_table_header
+from sheet_serializer import estimate_tokens
+from tools import InvoiceDetails, get_prompt_for_data_excel
+from invoice_totals import COMPUTED_FIELDS, apply_totals
+from model_cascade import CascadeTier, ModelCascade, validate_fields
+from tracing import current_span, log, mark_error, record_cache, record_llm_call, span
+
+# Số lần gọi lại để sửa khi kết quả không đúng schema
+MAX_REPAIRS = 1
+# Bảng hàng hoá dài hơn số token này thì được chia khúc và trích xuất song song (map-reduce)
+CHUNK_TOKENS = int(os.getenv("EXTRACT_CHUNK_TOKENS", "2000"))
+# Số lần gọi LLM chạy cùng lúc khi trích xuất theo khúc
+CHUNK_CONCURRENCY = int(os.getenv("EXTRACT_CHUNK_CONCURRENCY", "4"))
+# Số hàng đầu sheet dùng để trích xuất thông tin chung khi không tìm thấy dòng tiêu đề bảng
+HEAD_ROWS = 20
+
+
+@lru_cache(maxsize=64)
+def _fields_model(fields: Tuple[str, ...]) -> Type[BaseModel]:
+    """Schema con của InvoiceDetails chỉ gồm các trường cần LLM trích xuất (đều không bắt buộc)"""
+    definitions = {}
+    for name in fields:
+        field = InvoiceDetails.model_fields[name]
+        annotation = field.annotation if name == 'du_lieu_bang' else Optional[str]
+        definitions[name] = (annotation, Field(default=None, description=field.description))
+    # LLM hay trả số (2, 150000) cho các ô của bảng, chấp nhận và chuyển sang chuỗi
+    return create_model('InvoiceFields', __config__=ConfigDict(coerce_numbers_to_str=True), **definitions)
+
+
+def _parse_result(result: Dict[str, Any], schema: Type[BaseModel]) -> Tuple[Optional[BaseModel], Any]:
+    """Đối tượng schema từ kết quả include_raw=True, hoặc (None, lỗi) nếu không hợp lệ"""
+    if result.get('parsing_error') is None and result.get('parsed') is not None:
+        parsed = result['parsed']
+        try:
+            # Một số model trả về dict thay vì đối tượng schema
+            return (parsed if isinstance(parsed, schema) else schema.model_validate(parsed)), None
+        except ValidationError as e:
+            return None, e
+    return None, result.get('parsing_error') or 'Không có kết quả'
+
+
+def _repair_prompt(prompt: str, attempt: int, error: Any) -> str:
+    log(f"⚠️ Kết quả trích xuất không hợp lệ (lần {attempt + 1}): {error}")
+    return (
+        f"{prompt}\n\n    KẾT QUẢ LẦN TRƯỚC KHÔNG HỢP LỆ: {error}\n"
+        "    Hãy trả lại kết quả đúng schema, các ô trong du_lieu_bang đều là chuỗi."
+    )
+
+
+def _invoke_structured(llm: Any, schema: Type[BaseModel], prompt: str, max_repairs: int) -> BaseModel:
+    """Gọi LLM với structured output, nếu kết quả không hợp lệ thì gửi lại kèm lỗi (tối đa max_repairs lần)"""
+    structured_llm = llm.with_structured_output(schema, include_raw=True)
+    current_prompt = prompt
+    for attempt in range(max_repairs + 1):
+        start = time.perf_counter()
+        result = structured_llm.invoke(current_prompt)
+        record_llm_call("extract_info", result.get('raw'), time.perf_counter() - start)
+        parsed, error = _parse_result(result, schema)
+        if parsed is not None:
+            return parsed
+        current_prompt = _repair_prompt(prompt, attempt, error)
+    raise ValueError(f"LLM trả về dữ liệu không hợp lệ sau {max_repairs + 1} lần: {error}")
+
+
+async def _ainvoke_structured(llm: Any, schema: Type[BaseModel], prompt: str, max_repairs: int) -> BaseModel:
+    """Bản async của _invoke_structured"""
+    structured_llm = llm.with_structured_output(schema, include_raw=True)
+    current_prompt = prompt
+    for attempt in range(max_repairs + 1):
+        start = time.perf_counter()
+        result = await structured_llm.ainvoke(current_prompt)
+        record_llm_call("extract_info", result.get('raw'), time.perf_counter() - start)
+        parsed, error = _parse_result(result, schema)
+        if parsed is not None:
+            return parsed
+        current_prompt = _repair_prompt(prompt, attempt, error)
+    raise ValueError(f"LLM trả về dữ liệu không hợp lệ sau {max_repairs + 1} lần: {error}")
+
+
+def _build_request(
+    llm: Any, raw_data: List[List[Any]], fields: Optional[List[str]], note: str = ""
+) -> Tuple[Type[BaseModel], str, str]:
+    """Schema, prompt và khoá cache cho một lần trích xuất"""
+    fields = list(fields or (field for field in InvoiceDetails.model_fields if field not in COMPUTED_FIELDS))
+    schema = _fields_model(tuple(fields))
+    prompt = get_prompt_for_data_excel(data_excel_str=raw_data) + f"""
+    CHỈ CẦN TRÍCH XUẤT CÁC TRƯỜNG: {", ".join(fields)}
+    Trả kết quả trực tiếp theo schema, không gọi hàm nào khác.
+    {note}"""
+    key = LLMCache.make_key(_model_name(llm), prompt, {"schema": schema.model_json_schema()})
+    return schema, prompt, key
+
+
+def _to_fields(parsed: BaseModel) -> Dict[str, Any]:
+    return {name: value for name, value in parsed.model_dump().items() if value not in (None, "", [])}
+
+
+def extract_fields_structured(
+    llm: Any,
+    raw_data: List[List[Any]],
+    fields: Optional[List[str]] = None,
+    max_repairs: int = MAX_REPAIRS,
+    cache: Optional[LLMCache] = None,
+    note: str = "",
+) -> Dict[str, Any]:
+    """Trích xuất các trường hoá đơn bằng một lần gọi LLM có structured output
+
+    Args:
+        llm: Chat model hỗ trợ with_structured_output (Gemini, ChatOpenAI, ...)
+        raw_data (List[List[Any]]): Dữ liệu Excel dưới dạng list of lists
+        fields (List[str], optional): Các trường cần trích xuất, mặc định là toàn bộ InvoiceDetails
+        max_repairs (int): Số lần gọi lại để sửa khi kết quả không đúng schema
+        cache (LLMCache, optional): Cache kết quả, mặc định là cache dùng chung (node "extract_info")
+        note (str): Hướng dẫn thêm ở cuối prompt (vd khúc thứ mấy của bảng hàng hoá)
+
+    Returns:
+        Dict[str, Any]: Các trường LLM tìm được (bỏ các trường rỗng)
+    """
+    schema, prompt, key = _build_request(llm, raw_data, fields, note)
+    cache = (cache or get_llm_cache()) if cache_enabled("extract_info") else None
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache("extract_info", cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+
+    result = _to_fields(_invoke_structured(llm, schema, prompt, max_repairs))
+    if cache is not None:
+        cache.set(key, json.dumps(result, ensure_ascii=False))
+    return result
+
+
+async def aextract_fields_structured(
+    llm: Any,
+    raw_data: List[List[Any]],
+    fields: Optional[List[str]] = None,
+    max_repairs: int = MAX_REPAIRS,
+    cache: Optional[LLMCache] = None,
+    note: str = "",
+) -> Dict[str, Any]:
+    """Bản async của extract_fields_structured, dùng llm.ainvoke"""
+    schema, prompt, key = _build_request(llm, raw_data, fields, note)
+    cache = (cache or get_llm_cache()) if cache_enabled("extract_info") else None
+    if cache is not None:
+        cached = cache.get(key)
+        record_cache("extract_info", cached is not None)
+        if cached is not None:
+            return json.loads(cached)
+
+    result = _to_fields(await _ainvoke_structured(llm, schema, prompt, max_repairs))
+    if cache is not None:
+        cache.set(key, json.dumps(result, ensure_ascii=False))
+    return result
+
+
+# Một lần gọi LLM khi trích xuất theo khúc: (dữ liệu gửi đi, các trường cần trích xuất, hướng dẫn thêm)
+ChunkJob = Tuple[List[List[Any]], List[str], str]
+
+
+def _row_tokens(row: List[Any]) -> int:
+    return estimate_tokens("\t".join(cell_text(value) for value in row)) + 1
+
+
+def _chunk_note(index: int, total: int) -> str:
+    return (
+        f"DỮ LIỆU TRÊN LÀ KHÚC {index}/{total} CỦA BẢNG HÀNG HOÁ (dòng đầu là tiêu đề cột nếu có).\n"
+        "    Chỉ liệt kê các dòng hàng hoá có trong khúc này theo đúng thứ tự, giữ nguyên STT trong file,"
+        " bỏ qua thông tin người bán, người mua và các dòng tổng cộng.\n"
+    )
+
+
+def plan_chunks(raw_data: List[List[Any]], fields: List[str], chunk_tokens: int = CHUNK_TOKENS) -> List[ChunkJob]:
+    """Chia việc trích xuất sheet có bảng hàng hoá dài thành nhiều lần gọi LLM độc lập (map-reduce)
+
+    Thông tin chung (người bán, người mua, ngày, ...) được lấy một lần từ phần đầu sheet, các dòng
+    hàng hoá được chia thành các khúc khoảng chunk_tokens token, mỗi khúc kèm dòng tiêu đề bảng.
+
+    Args:
+        raw_data (List[List[Any]]): Dữ liệu Excel dưới dạng list of lists
+        fields (List[str]): Các trường cần LLM trích xuất
+        chunk_tokens (int): Số token tối đa của các dòng hàng hoá trong một khúc
+
+    Returns:
+        List[ChunkJob]: Các lần gọi theo thứ tự, rỗng nếu không cần chia (không cần du_lieu_bang hoặc bảng ngắn)
+    """
+    if 'du_lieu_bang' not in fields:
+        return []
+    rows = [row for row in raw_data if any(cell_text(value) for value in row)]
+    header_index = find_table_header(rows)
+    if header_index is None:
+        # Không nhận ra dòng tiêu đề: chia cả sheet, phần đầu vẫn dùng để lấy thông tin chung
+        head, header, body = rows[:HEAD_ROWS], [], rows
+    else:
+        head, header, body = rows[:header_index], [rows[header_index]], rows[header_index + 1:]
+    costs = [_row_tokens(row) for row in body]
+    if sum(costs) <= chunk_tokens:
+        return []
+
+    chunks: List[List[List[Any]]] = [[]]
+    used = 0
+    for row, cost in zip(body, costs):
+        if chunks[-1] and used + cost > chunk_tokens:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(row)
+        used += cost
+
+    jobs: List[ChunkJob] = []
+    other_fields = [field for field in fields if field != 'du_lieu_bang']
+    if other_fields:
+        jobs.append((head, other_fields, ""))
+    jobs += [(header + chunk, ['du_lieu_bang'], _chunk_note(index, len(chunks))) for index, chunk in enumerate(chunks, 1)]
+    log(f"🧩 Bảng hàng hoá dài ({sum(costs)} token): chia thành {len(chunks)} khúc, tối đa {CHUNK_CONCURRENCY} lần gọi LLM cùng lúc")
+    return jobs
+
+
+def _merge_chunks(jobs: List[ChunkJob], results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Gộp kết quả các khúc: thông tin chung giữ nguyên, các dòng hàng hoá nối theo thứ tự khúc dưới một dòng tiêu đề"""
+    fields: Dict[str, Any] = {}
+    items: List[List[str]] = []
+    for (_, job_fields, _), result in zip(jobs, results):
+        if job_fields == ['du_lieu_bang']:
+            # Mỗi khúc trả về kèm dòng tiêu đề riêng, chỉ giữ một dòng tiêu đề chung
+            items += [row for row in result.get('du_lieu_bang', []) if row and find_table_header([row]) is None]
+        else:
+            fields.update(result)
+
+    numbers = [str(row[0]) for row in items]
+    # Sheet không có cột STT thì mỗi khúc tự đánh số từ 1, đánh số lại cho cả bảng
+    if all(number.isdigit() for number in numbers) and any(int(a) >= int(b) for a, b in zip(numbers, numbers[1:])):
+        for index, row in enumerate(items, 1):
+            row[0] = str(index)
+    if items:
+        fields['du_lieu_bang'] = [list(TABLE_HEADER)] + items
+    return fields
+
+
+def extract_fields_chunked(llm: Any, jobs: List[ChunkJob], max_concurrency: int = CHUNK_CONCURRENCY) -> Dict[str, Any]:
+    """Chạy các lần gọi của plan_chunks song song (tối đa max_concurrency luồng) và gộp kết quả theo thứ tự
+
+    Thời gian trích xuất khi đó phụ thuộc vào kích thước khúc thay vì độ dài bảng hàng hoá.
+    """
+    def run(index: int, job: ChunkJob) -> Dict[str, Any]:
+        data, fields, note = job
+        with span("extract.chunk", index=index, rows=len(data), fields=",".join(fields)):
+            return extract_fields_structured(llm, data, fields, note=note)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(jobs)))) as executor:
+        # Mỗi luồng chạy trong bản sao context hiện tại để span của các khúc nằm dưới span của node
+        futures = [executor.submit(contextvars.copy_context().run, run, index, job) for index, job in enumerate(jobs)]
+        results = [future.result() for future in futures]
+    return _merge_chunks(jobs, results)
+
+
+async def aextract_fields_chunked(llm: Any, jobs: List[ChunkJob], max_concurrency: int = CHUNK_CONCURRENCY) -> Dict[str, Any]:
+    """Bản async của extract_fields_chunked, giới hạn số lần gọi cùng lúc bằng asyncio.Semaphore"""
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(index: int, job: ChunkJob) -> Dict[str, Any]:
+        data, fields, note = job
+        async with semaphore:
+            with span("extract.chunk", index=index, rows=len(data), fields=",".join(fields)):
+                return await aextract_fields_structured(llm, data, fields, note=note)
+
+    results = await asyncio.gather(*(run(index, job) for index, job in enumerate(jobs)))
+    return _merge_chunks(jobs, list(results))
+
+
+def _extract_by_rules(raw_data: List[List[Any]]) -> Tuple[Dict[str, Any], Dict[str, str], List[str]]:
+    """Các trường tìm được bằng luật, nguồn của chúng và các trường cần LLM (rỗng nếu đủ trường chính)"""
+    start = time.perf_counter()
+    fields = extract_invoice_by_rules(raw_data)
+    field_sources = {field: "rule" for field in fields}
+    log(f"⚡ Luật tìm được {len(fields)} trường trong {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # Sheet chuẩn đủ các trường chính thì bỏ qua LLM
+    missing = []
+    if any(field not in fields for field in CORE_FIELDS):
+        missing = [field for field in InvoiceDetails.model_fields if field not in fields and field not in COMPUTED_FIELDS]
+        log(f"🤖 Gọi LLM cho các trường còn thiếu: {missing}")
+    return fields, field_sources, missing
+
+
+def _extract_missing(llm: Any, raw_data: List[List[Any]], missing: List[str]) -> Dict[str, Any]:
+    """Các trường còn thiếu bằng một model: một lần gọi, hoặc chia khúc song song khi bảng hàng hoá dài"""
+    jobs = plan_chunks(raw_data, missing)
+    return extract_fields_chunked(llm, jobs) if jobs else extract_fields_structured(llm, raw_data, missing)
+
+
+async def _aextract_missing(llm: Any, raw_data: List[List[Any]], missing: List[str]) -> Dict[str, Any]:
+    jobs = plan_chunks(raw_data, missing)
+    if jobs:
+        return await aextract_fields_chunked(llm, jobs)
+    return await aextract_fields_structured(llm, raw_data, missing)
+
+
+def _tier_failed(cascade: ModelCascade, tier: CascadeTier, error: Exception, last: bool, latency: float) -> None:
+    """Tầng gọi model lỗi: tầng cuối thì ném lỗi ra ngoài, ngược lại chuyển lên tầng sau"""
+    cascade.record(tier.name, "error", latency)
+    if last:
+        raise error
+    # Lỗi đã được xử lý (chuyển tầng) nên span không tự ghi nhận, đánh dấu lỗi cho span của tầng này
+    mark_error(error)
+    log(f"⤴️ Tầng {tier.name} lỗi ({error}), chuyển lên tầng sau")
+
+
+def _judge_tier(
+    cascade: ModelCascade,
+    tier: CascadeTier,
+    fields: Dict[str, Any],
+    llm_fields: Dict[str, Any],
+    raw_data: List[List[Any]],
+    last: bool,
+    latency: float,
+) -> bool:
+    """Kiểm tra kết quả một tầng, True nếu dùng kết quả này (hợp lệ hoặc là tầng cuối)"""
+    problems = validate_fields({**fields, **llm_fields}, raw_data, llm_fields)
+    accepted = not problems or last
+    cascade.record(tier.name, "accepted" if accepted else "escalated", latency)
+    tier_span = current_span()
+    if tier_span is not None:
+        tier_span.set(accepted=accepted, problems=problems[:5])
+    if not problems:
+        log(f"✅ Tầng {tier.name} cho kết quả hợp lệ")
+    elif accepted:
+        log(f"⚠️ Tầng cuối {tier.name} vẫn còn lỗi, dùng kết quả này: {problems[:3]}")
+    else:
+        log(f"⤴️ Tầng {tier.name} không đạt ({problems[:3]}), chuyển lên tầng sau")
+    return accepted
+
+
+def _cascade_missing(
+    cascade: ModelCascade, fields: Dict[str, Any], raw_data: List[List[Any]], missing: List[str]
+) -> Dict[str, Any]:
+    """Trích xuất các trường còn thiếu lần lượt qua các tầng của cascade, dừng ở tầng đầu tiên cho kết quả hợp lệ"""
+    for index, tier in enumerate(cascade.tiers):
+        last = index == len(cascade.tiers) - 1
+        with span(f"extract.tier.{tier.name}", model=_model_name(tier.llm)):
+            start = time.perf_counter()
+            try:
+                llm_fields = _extract_missing(tier.llm, raw_data, missing)
+            except Exception as e:
+                _tier_failed(cascade, tier, e, last, time.perf_counter() - start)
+                continue
+            if _judge_tier(cascade, tier, fields, llm_fields, raw_data, last, time.perf_counter() - start):
+                return llm_fields
+    return {}
+
+
+async def _acascade_missing(
+    cascade: ModelCascade, fields: Dict[str, Any], raw_data: List[List[Any]], missing: List[str]
+) -> Dict[str, Any]:
+    """Bản async của _cascade_missing"""
+    for index, tier in enumerate(cascade.tiers):
+        last = index == len(cascade.tiers) - 1
+        with span(f"extract.tier.{tier.name}", model=_model_name(tier.llm)):
+            start = time.perf_counter()
+            try:
+                llm_fields = await _aextract_missing(tier.llm, raw_data, missing)
+            except Exception as e:
+                _tier_failed(cascade, tier, e, last, time.perf_counter() - start)
+                continue
+            if _judge_tier(cascade, tier, fields, llm_fields, raw_data, last, time.perf_counter() - start):
+                return llm_fields
+    return {}
+
+
+def _with_totals(fields: Dict[str, Any], field_sources: Dict[str, str], raw_data: List[List[Any]]) -> InvoiceDetails:
+    """Tạo InvoiceDetails, tính lại thành tiền và các số tổng (invoice_totals), ghi lại chỗ lệch so với file gốc"""
+    invoice, mismatches = apply_totals(InvoiceDetails(**fields), raw_data)
+    field_sources.update({field: "computed" for field in COMPUTED_FIELDS if getattr(invoice, field) is not None})
+    if mismatches:
+        log(f"⚠️ Số tiền trong file lệch với số tính lại: {mismatches}")
+        span = current_span()
+        if span is not None:
+            span.set(totals_mismatches=mismatches)
+    return invoice
+
+
+def extract_invoice(llm: Any, raw_data: List[List[Any]]) -> Tuple[InvoiceDetails, Dict[str, str]]:
+    """Trích xuất InvoiceDetails: dùng luật trước, các trường còn thiếu lấy bằng một lần gọi LLM
+    (hoặc nhiều lần gọi song song theo khúc khi bảng hàng hoá dài, xem plan_chunks)
+
+    Args:
+        llm: Chat model hỗ trợ with_structured_output, hoặc ModelCascade (model nhỏ trước, model lớn khi kết quả không hợp lệ)
+        raw_data (List[List[Any]]): Dữ liệu Excel dưới dạng list of lists
+
+    Returns:
+        Tuple[InvoiceDetails, Dict[str, str]]: Hoá đơn và nguồn của từng trường ("rule", "llm" hoặc "computed")
+    """
+    fields, field_sources, missing = _extract_by_rules(raw_data)
+    if missing:
+        if isinstance(llm, ModelCascade):
+            llm_fields = _cascade_missing(llm, fields, raw_data, missing)
+        else:
+            llm_fields = _extract_missing(llm, raw_data, missing)
+        fields.update(llm_fields)
+        field_sources.update({field: "llm" for field in llm_fields})
+    return _with_totals(fields, field_sources, raw_data), field_sources
+
+
+async def aextract_invoice(llm: Any, raw_data: List[List[Any]]) -> Tuple[InvoiceDetails, Dict[str, str]]:
+    """Bản async của extract_invoice, dùng llm.ainvoke"""
+    fields, field_sources, missing = _extract_by_rules(raw_data)
+    if missing:
+        if isinstance(llm, ModelCascade):
+            llm_fields = await _acascade_missing(llm, fields, raw_data, missing)
+        else:
+            llm_fields = await _aextract_missing(llm, raw_data, missing)
+        fields.update(llm_fields)
+        field_sources.update({field: "llm" for field in llm_fields})
+    return _with_totals(fields, field_sources, raw_data), field_sources
@@ -0,0 +1,120 @@
+import io
+import os
+import re
+import zipfile
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, List
+from xml.sax.saxutils import escape
+
+# File mẫu hoá đơn đi kèm repo, sửa bố cục hoá đơn thì sửa file này
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.docx')
+
+_DOCUMENT_PART = 'word/document.xml'
+_PLACEHOLDER_RE = re.compile(r'\{\{(\w+)\}\}')
+# Ô của dòng hàng hoá mẫu đặt tên cot_1, cot_2, ... theo thứ tự cột
+_ROW_MARKER = '{{cot_1}}'
+_PARA_ID_RE = re.compile(r' w14:(?:paraId|textId)="[^"]*"')
+
+
+def _compile(xml: str) -> List[str]:
+    """Tách chuỗi XML thành [chữ cố định, tên trường, chữ cố định, tên trường, ...]"""
+    return _PLACEHOLDER_RE.split(xml)
+
+
+def _fill(segments: List[str], values: Dict[str, Any], out: List[str]) -> None:
+    """Ghép các đoạn đã biên dịch với giá trị (đã escape XML) vào out"""
+    for i, segment in enumerate(segments):
+        if i % 2:
+            value = values.get(segment)
+            out.append(escape(str(value)) if value is not None else '')
+        else:
+            out.append(segment)
+
+
+class InvoiceTemplate:
+    """Mẫu hoá đơn DOCX được đọc và biên dịch một lần, mỗi hoá đơn chỉ điền giá trị vào chỗ {{ten_truong}}"""
+
+    def __init__(self, template_path: str = TEMPLATE_PATH):
+        with zipfile.ZipFile(template_path) as source:
+            document = source.read(_DOCUMENT_PART).decode('utf-8')
+            # Gói sẵn các phần tĩnh (styles, theme, ...) vào một file zip trong bộ nhớ,
+            # mỗi lần render chỉ cần thêm document.xml mà không phải nén lại các phần này
+            base = io.BytesIO()
+            with zipfile.ZipFile(base, 'w', zipfile.ZIP_DEFLATED) as target:
+                for info in source.infolist():
+                    if info.filename != _DOCUMENT_PART:
+                        target.writestr(info, source.read(info.filename), compress_type=zipfile.ZIP_DEFLATED)
+        self._base = base.getvalue()
+
+        # Tách document.xml thành phần trước bảng hàng, dòng hàng mẫu và phần sau
+        marker = document.find(_ROW_MARKER)
+        if marker == -1:
+            self._head, self._row, self._tail = _compile(document), [], []
+            self.columns = 0
+        else:
+            row_start = document.rfind('<w:tr ', 0, marker)
+            row_end = document.find('</w:tr>', marker) + len('</w:tr>')
+            self._head = _compile(document[:row_start])
+            # Dòng mẫu được lặp lại nhiều lần nên bỏ w14:paraId/textId để không bị trùng id
+            self._row = _compile(_PARA_ID_RE.sub('', document[row_start:row_end]))
+            self._tail = _compile(document[row_end:])
+            self.columns = sum(1 for name in self._row[1::2] if name.startswith('cot_'))
+
+    def render_document_xml(self, invoice_data: Any) -> bytes:
+        """Điền dữ liệu hoá đơn vào document.xml của mẫu
+
+        Args:
+            invoice_data (InvoiceDetails): Dữ liệu hoá đơn
+
+        Returns:
+            bytes: Nội dung word/document.xml
+        """
+        values = invoice_data.model_dump()
+        out: List[str] = []
+        _fill(self._head, values, out)
+
+        if self._row:
+            # Dòng đầu của du_lieu_bang là tiêu đề, mẫu đã có sẵn tiêu đề nên bỏ qua
+            items = (values.get('du_lieu_bang') or [])[1:] or [[]]
+            for item in items:
+                cells = {f'cot_{i + 1}': item[i] if i < len(item) else '' for i in range(self.columns)}
+                _fill(self._row, cells, out)
+            _fill(self._tail, values, out)
+
+        return ''.join(out).encode('utf-8')
+
+    def render(self, invoice_data: Any) -> bytes:
+        """Tạo nội dung file DOCX hoá đơn
+
+        Args:
+            invoice_data (InvoiceDetails): Dữ liệu hoá đơn
+
+        Returns:
+            bytes: Nội dung file .docx
+        """
+        buffer = io.BytesIO(self._base)
+        with zipfile.ZipFile(buffer, 'a', zipfile.ZIP_DEFLATED) as docx:
+            docx.writestr(_DOCUMENT_PART, self.render_document_xml(invoice_data))
+        return buffer.getvalue()
+
+    def write_to(self, invoice_data: Any, stream: BinaryIO) -> int:
+        """Ghi nội dung DOCX hoá đơn vào stream (file đã mở, BytesIO, response body, ...)
+
+        Returns:
+            int: Số byte đã ghi
+        """
+        data = self.render(invoice_data)
+        stream.write(data)
+        return len(data)
+
+    def save(self, invoice_data: Any, file_path: str) -> str:
+        """Tạo file DOCX hoá đơn tại file_path (đường dẫn đầy đủ, có phần mở rộng)"""
+        with open(file_path, 'wb') as f:
+            self.write_to(invoice_data, f)
+        return file_path
+
+
+@lru_cache(maxsize=None)
+def get_invoice_template(template_path: str = TEMPLATE_PATH) -> InvoiceTemplate:
+    """Mẫu hoá đơn đã biên dịch, mỗi process chỉ đọc file mẫu một lần"""
+    return InvoiceTemplate(template_path)
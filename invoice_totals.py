@@ -0,0 +1,295 @@
+import math
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict
+
+from rule_extractor import cell_text, fold_text
+
+# Các trường được tính lại từ bảng hàng hoá, LLM không cần trích xuất
+COMPUTED_FIELDS = ('tong_tien_hang', 'thue_suat_gtgt', 'tien_thue_gtgt', 'tong_thanh_toan', 'so_tien_bang_chu')
+
+# Tiêu đề (đã bỏ dấu) của các cột Số lượng, Đơn giá, Thành tiền; bảng do LLM trả về có thể khác TABLE_HEADER
+_QTY_LABELS = ('so luong', 'sl', 'khoi luong')
+_PRICE_LABELS = ('don gia', 'dg', 'gia ban')
+_AMOUNT_LABELS = ('thanh tien', 'so tien', 'tien', 'gia tri')
+# Cột thứ tự ở đầu bảng (STT hoặc TT)
+_ORDINAL_LABELS = ('stt', 'tt')
+# Chênh lệch tối đa (đồng) giữa số tính lại và số trong file mà vẫn coi là khớp (làm tròn)
+TOLERANCE = 1.0
+
+# Nhãn các dòng tổng trong file Excel, nhãn dài xếp trước để 'tong cong tien thanh toan' không khớp nhầm 'tong cong'
+_SOURCE_LABELS = [
+    ('tong cong tien thanh toan', 'tong_thanh_toan'),
+    ('tong tien thanh toan', 'tong_thanh_toan'),
+    ('tong thanh toan', 'tong_thanh_toan'),
+    ('cong tien hang', 'tong_tien_hang'),
+    ('tien thue gtgt', 'tien_thue_gtgt'),
+    ('tien thue', 'tien_thue_gtgt'),
+    ('thue suat gtgt', 'thue_suat_gtgt'),
+    ('thue suat', 'thue_suat_gtgt'),
+    ('tong cong', 'tong_thanh_toan'),
+]
+
+_NUMBER_RE = re.compile(r'-?\(?\d[\d.,\s]*\)?')
+_THOUSANDS_DOT_RE = re.compile(r'^\d{1,3}(\.\d{3})+$')
+_THOUSANDS_COMMA_RE = re.compile(r'^\d{1,3}(,\d{3})+$')
+
+
+class Totals(TypedDict):
+    du_lieu_bang: List[List[str]]
+    tong_tien_hang: float
+    thue_suat_gtgt: Optional[float]
+    tien_thue_gtgt: float
+    tong_thanh_toan: float
+    mismatches: List[str]
+
+
+def parse_vn_number(value: Any) -> float:
+    """Đọc số theo cách viết của Việt Nam: '1.234.567', '1.234,5', '150,000', '10%', '(2.000)' -> số
+
+    Dấu chấm đứng trước đúng 3 chữ số được hiểu là phân cách hàng nghìn ('1.500' là 1500).
+    Không đọc được thì trả về nan.
+    """
+    if isinstance(value, bool) or value is None:
+        return math.nan
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str) and value.isdigit():
+        return float(value)
+    match = _NUMBER_RE.search(str(value).replace('\xa0', ' '))
+    if not match:
+        return math.nan
+    text = match.group(0).replace(' ', '').rstrip('.,')
+    negative = text.startswith('-') or (text.startswith('(') and text.endswith(')'))
+    text = text.strip('-()')
+    if '.' in text and ',' in text:
+        # Dấu xuất hiện sau cùng là dấu thập phân
+        if text.rfind(',') > text.rfind('.'):
+            text = text.replace('.', '').replace(',', '.')
+        else:
+            text = text.replace(',', '')
+    elif '.' in text:
+        if _THOUSANDS_DOT_RE.match(text):
+            text = text.replace('.', '')
+    elif ',' in text:
+        text = text.replace(',', '') if _THOUSANDS_COMMA_RE.match(text) else text.replace(',', '.')
+    try:
+        number = float(text)
+    except ValueError:
+        return math.nan
+    return -number if negative else number
+
+
+def format_vnd(amount: float) -> str:
+    """1234567.0 -> '1.234.567' (làm tròn tới đồng)"""
+    return f"{int(math.floor(amount + 0.5)):,}".replace(',', '.')
+
+
+def _plain(amount: float) -> str:
+    """Số dạng giống các ô khác của bảng (cell_text): 200000, 12.5"""
+    rounded = math.floor(amount * 100 + 0.5) / 100
+    return cell_text(float(rounded))
+
+
+_DIGITS = ['không', 'một', 'hai', 'ba', 'bốn', 'năm', 'sáu', 'bảy', 'tám', 'chín']
+_GROUP_UNITS = ['', 'nghìn', 'triệu', 'tỷ', 'nghìn tỷ', 'triệu tỷ', 'tỷ tỷ']
+
+
+def _read_group(number: int, full: bool) -> List[str]:
+    """Đọc một nhóm 3 chữ số; full=True thì đọc cả 'không trăm', 'linh' (nhóm không đứng đầu)"""
+    hundreds, tens, units = number // 100, number // 10 % 10, number % 10
+    words: List[str] = []
+    if hundreds or full:
+        words += [_DIGITS[hundreds], 'trăm']
+    if tens == 0:
+        if units and words:
+            words.append('linh')
+    elif tens == 1:
+        words.append('mười')
+    else:
+        words += [_DIGITS[tens], 'mươi']
+    if units:
+        if units == 1 and tens >= 2:
+            words.append('mốt')
+        elif units == 5 and tens >= 1:
+            words.append('lăm')
+        else:
+            words.append(_DIGITS[units])
+    return words
+
+
+def read_amount(amount: float) -> str:
+    """Số tiền bằng chữ: 1205000 -> 'Một triệu hai trăm linh năm nghìn đồng'"""
+    number = int(math.floor(abs(amount) + 0.5))
+    if number == 0:
+        return 'Không đồng'
+    # Tách thành các nhóm 3 chữ số từ hàng đơn vị
+    groups = []
+    while number:
+        groups.append(number % 1000)
+        number //= 1000
+    if len(groups) > len(_GROUP_UNITS):
+        return f"{format_vnd(amount)} đồng"
+    words: List[str] = []
+    for index in range(len(groups) - 1, -1, -1):
+        if groups[index]:
+            words += _read_group(groups[index], full=bool(words))
+            if _GROUP_UNITS[index]:
+                words.append(_GROUP_UNITS[index])
+    text = ' '.join(words)
+    if amount < 0:
+        text = 'âm ' + text
+    return text[0].upper() + text[1:] + ' đồng'
+
+
+def find_source_totals(raw_data: Sequence[Sequence[Any]]) -> Dict[str, float]:
+    """Các số tổng có sẵn trong file Excel: tong_tien_hang, thue_suat_gtgt, tien_thue_gtgt, tong_thanh_toan
+
+    Mỗi dòng tổng có dạng 'Nhãn: số' trong một ô hoặc nhãn ở một ô và số ở ô có giá trị cuối cùng.
+    """
+    found: Dict[str, float] = {}
+    for row in raw_data:
+        texts = [cell_text(value) for value in row]
+        label_col = next((col for col, text in enumerate(texts) if text), None)
+        if label_col is None:
+            continue
+        folded = fold_text(texts[label_col]).rstrip(' :')
+        field = next((field for label, field in _SOURCE_LABELS if folded.startswith(label)), None)
+        if field is None or field in found:
+            continue
+        candidates = [texts[label_col].split(':', 1)[1]] if ':' in texts[label_col] else []
+        candidates += [text for text in reversed(texts[label_col + 1:]) if text]
+        for text in candidates:
+            number = parse_vn_number(text)
+            if not math.isnan(number):
+                found[field] = _vat_percent(number, text) if field == 'thue_suat_gtgt' else number
+                break
+    return found
+
+
+def _find_column(header: Sequence[Any], labels: Sequence[str]) -> Optional[int]:
+    """Vị trí cột đầu tiên có tiêu đề khớp một nhãn (theo thứ tự ưu tiên của labels), không có thì None"""
+    folded = [fold_text(cell_text(value)).rstrip(' :') for value in header]
+    for label in labels:
+        for col, text in enumerate(folded):
+            if text == label or text.startswith(label + ' ') or text.startswith(label + ' ('):
+                return col
+    return None
+
+
+def _find_amount_column(header: Sequence[Any]) -> Optional[int]:
+    """Vị trí cột Thành tiền; tiêu đề "TT" thường là cột thứ tự nên chỉ được coi là Thành tiền
+    (như tiêu đề mặc định của InvoiceDetails) khi không có cột nào khớp hơn và cột đầu không phải cột thứ tự"""
+    col = _find_column(header, _AMOUNT_LABELS)
+    if col is not None or not header or fold_text(cell_text(header[0])).strip(' .:') in _ORDINAL_LABELS:
+        return col
+    return next((col for col, value in enumerate(header) if col > 0 and fold_text(cell_text(value)).strip(' .:') == 'tt'), None)
+
+
+def _vat_percent(rate: float, text: str) -> float:
+    """Thuế suất theo %: ô Excel định dạng phần trăm được đọc là 0.1 chứ không phải 10"""
+    if 0 < rate <= 1 and '%' not in text:
+        return rate * 100
+    return rate
+
+
+def _differs(computed: float, source: Optional[float]) -> bool:
+    return source is not None and abs(computed - source) > TOLERANCE
+
+
+def compute_totals(
+    table: Optional[List[List[Any]]],
+    raw_data: Optional[Sequence[Sequence[Any]]] = None,
+    vat_rate: Optional[float] = None,
+) -> Totals:
+    """Tính lại thành tiền của mọi dòng (số lượng x đơn giá) bằng NumPy, tổng tiền hàng, thuế GTGT và tổng thanh toán
+
+    Args:
+        table (List[List[Any]]): du_lieu_bang, dòng đầu là tiêu đề; các cột Số lượng, Đơn giá, Thành tiền
+            được tìm theo tiêu đề, thiếu cột nào thì không tính lại thành tiền và giữ nguyên bảng
+        raw_data (List[List[Any]], optional): Dữ liệu Excel gốc để đối chiếu các số tổng và lấy thuế suất
+        vat_rate (float, optional): Thuế suất GTGT (%), mặc định lấy trong file, không có thì không tính thuế
+
+    Returns:
+        Totals: Bảng đã tính lại thành tiền, các số tổng và danh sách chỗ lệch so với file gốc
+    """
+    import numpy as np
+
+    header, items = (table[0], table[1:]) if table else ([], [])
+    rows = [list(item) + [''] * (len(header) - len(item)) for item in items]
+
+    def column(col: Optional[int]) -> "np.ndarray":
+        if col is None:
+            return np.full(len(rows), math.nan)
+        return np.fromiter((parse_vn_number(row[col]) if col < len(row) else math.nan for row in rows), float, len(rows))
+
+    qty_col, price_col, amount_col = _find_column(header, _QTY_LABELS), _find_column(header, _PRICE_LABELS), _find_amount_column(header)
+    if len({qty_col, price_col, amount_col} - {None}) < 3:
+        # Không đủ ba cột (hoặc hai nhãn trùng một cột): chỉ cộng cột thành tiền nếu có
+        qty_col = price_col = None
+    quantity, price, source_amount = column(qty_col), column(price_col), column(amount_col)
+    product = quantity * price
+    has_product = ~np.isnan(product)
+    # Dòng thiếu số lượng hoặc đơn giá thì giữ thành tiền trong file
+    amount = np.where(has_product, np.floor(product * 100 + 0.5) / 100, source_amount)
+    mismatched = has_product & ~np.isnan(source_amount) & (np.abs(amount - source_amount) > TOLERANCE)
+    changed = has_product & (np.isnan(source_amount) | mismatched)
+
+    mismatches = []
+    for index in np.flatnonzero(mismatched):
+        row = rows[index]
+        stt = cell_text(row[0]) or str(index + 1)
+        mismatches.append(
+            f"Dòng {stt}: thành tiền {row[amount_col]} khác {row[qty_col]} x {row[price_col]} = {format_vnd(amount[index])}"
+        )
+    for index in np.flatnonzero(changed):
+        rows[index][amount_col] = _plain(float(amount[index]))
+
+    source = find_source_totals(raw_data) if raw_data else {}
+    # Bảng không có cột thành tiền thì lấy cộng tiền hàng trong file
+    subtotal = float(np.nansum(amount)) if not np.isnan(amount).all() else source.get('tong_tien_hang', 0.0)
+    rate = vat_rate if vat_rate is not None else source.get('thue_suat_gtgt')
+    if rate is not None:
+        tax = float(math.floor(subtotal * rate / 100 + 0.5))
+    else:
+        tax = source.get('tien_thue_gtgt', 0.0)
+    total = subtotal + tax
+
+    for field, label, computed in (
+        ('tong_tien_hang', 'Cộng tiền hàng', subtotal),
+        ('tien_thue_gtgt', 'Tiền thuế GTGT', tax),
+        ('tong_thanh_toan', 'Tổng tiền thanh toán', total),
+    ):
+        if _differs(computed, source.get(field)):
+            mismatches.append(f"{label}: trong file {format_vnd(source[field])}, tính lại {format_vnd(computed)}")
+
+    return Totals(
+        du_lieu_bang=[list(header)] + rows if table else [],
+        tong_tien_hang=subtotal,
+        thue_suat_gtgt=rate,
+        tien_thue_gtgt=tax,
+        tong_thanh_toan=total,
+        mismatches=mismatches,
+    )
+
+
+def apply_totals(invoice: Any, raw_data: Optional[Sequence[Sequence[Any]]] = None) -> Tuple[Any, List[str]]:
+    """Ghi thành tiền đã tính lại và các số tổng vào InvoiceDetails
+
+    Args:
+        invoice (InvoiceDetails): Hoá đơn đã trích xuất (bằng luật hoặc LLM)
+        raw_data (List[List[Any]], optional): Dữ liệu Excel gốc để đối chiếu
+
+    Returns:
+        Tuple[InvoiceDetails, List[str]]: Hoá đơn mới có số tổng và danh sách chỗ lệch so với file gốc
+    """
+    totals = compute_totals(invoice.du_lieu_bang, raw_data)
+    update: Dict[str, Any] = {
+        'tong_tien_hang': format_vnd(totals['tong_tien_hang']),
+        'thue_suat_gtgt': None if totals['thue_suat_gtgt'] is None else f"{cell_text(float(totals['thue_suat_gtgt']))}%",
+        'tien_thue_gtgt': format_vnd(totals['tien_thue_gtgt']),
+        'tong_thanh_toan': format_vnd(totals['tong_thanh_toan']),
+        'so_tien_bang_chu': read_amount(totals['tong_thanh_toan']),
+    }
+    if invoice.du_lieu_bang:
+        update['du_lieu_bang'] = totals['du_lieu_bang']
+    return invoice.model_copy(update=update), totals['mismatches']
@@ -0,0 +1,309 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from langchain_core.messages import BaseMessage, message_chunk_to_message, messages_from_dict, messages_to_dict
+
+from tracing import record_cache, record_llm_call
+
+# Thư mục cache mặc định nằm cạnh code, có thể đổi bằng biến môi trường LLM_CACHE_PATH
+DEFAULT_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "llm_cache.sqlite"),
+)
+
+# Bật/tắt cache cho từng node, ví dụ LLM_CACHE_DISABLED_NODES="llm_chat,chatbot"
+CACHE_NODES: Dict[str, bool] = {
+    node.strip(): False for node in os.getenv("LLM_CACHE_DISABLED_NODES", "").split(",") if node.strip()
+}
+CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"
+
+
+class LLMCache:
+    """Cache câu trả lời LLM theo nội dung (model + prompt + tham số), lưu trên đĩa bằng SQLite
+
+    Có thêm một lớp LRU nhỏ trong bộ nhớ để các lần trúng cache liên tiếp không phải đọc đĩa.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 5000,
+        max_bytes: int = 200 * 1024 * 1024,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+        memory_entries: int = 256,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """Khoá cache: sha256 của tên model, nội dung prompt và các tham số gọi model"""
+        payload = json.dumps([model, prompt, params or {}], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        """Lấy giá trị đã cache, None nếu không có hoặc đã hết hạn"""
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None and not self._expired(cached[1], now):
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return cached[0]
+
+            row = self._conn.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or self._expired(row[1], now):
+                if row is not None:
+                    self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self._conn.commit()
+                self._memory.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Lưu giá trị và loại bỏ các mục ít dùng nhất khi vượt giới hạn số mục / dung lượng"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+            self._remember(key, value, now)
+
+    def _remember(self, key: str, value: str, created: float) -> None:
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self) -> None:
+        if self.ttl_seconds is not None:
+            self._conn.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.ttl_seconds,))
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        while count > self.max_entries or total > self.max_bytes:
+            # Xoá dần 10% số mục truy cập lâu nhất cho tới khi về dưới giới hạn
+            batch = max(1, count // 10, count - self.max_entries)
+            evicted = self._conn.execute(
+                "SELECT key FROM entries ORDER BY accessed ASC LIMIT ?", (batch,)
+            ).fetchall()
+            self._conn.executemany("DELETE FROM entries WHERE key = ?", evicted)
+            for (key,) in evicted:
+                self._memory.pop(key, None)
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+    def clear(self) -> None:
+        """Xoá toàn bộ cache"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Số lần trúng/trượt cache, số mục và dung lượng hiện tại"""
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": count,
+            "bytes": total,
+        }
+
+
+_default_cache: Optional[LLMCache] = None
+
+
+def get_llm_cache() -> LLMCache:
+    """Cache dùng chung trong process, tạo khi dùng lần đầu"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = LLMCache()
+    return _default_cache
+
+
+def _model_name(llm: Any) -> str:
+    """Tên model của client LLM (kể cả khi đã bind_tools)"""
+    model = getattr(llm, "bound", llm)
+    return str(getattr(model, "model", None) or getattr(model, "model_name", None) or type(model).__name__)
+
+
+def _model_params(llm: Any) -> Dict[str, Any]:
+    """Các tham số ảnh hưởng tới câu trả lời: temperature, ... và tools đã bind"""
+    model = getattr(llm, "bound", llm)
+    params = dict(getattr(model, "_identifying_params", {}) or {})
+    params.update(getattr(llm, "kwargs", {}) or {})
+    return params
+
+
+def _prompt_text(prompt: Any) -> str:
+    """Chuỗi đại diện cho prompt: str, PromptValue hoặc list message"""
+    if isinstance(prompt, str):
+        return prompt
+    if hasattr(prompt, "to_messages"):
+        prompt = prompt.to_messages()
+    if isinstance(prompt, list) and all(isinstance(message, BaseMessage) for message in prompt):
+        return json.dumps(messages_to_dict(prompt), sort_keys=True, ensure_ascii=False, default=str)
+    return str(prompt)
+
+
+def cache_enabled(node: Optional[str]) -> bool:
+    """Node có được dùng cache hay không"""
+    return CACHE_ENABLED and CACHE_NODES.get(node, True)
+
+
+def _timed_invoke(llm: Any, prompt: Any, node: Optional[str]) -> BaseMessage:
+    """llm.invoke(prompt), ghi độ trễ và số token vào tracing"""
+    start = time.perf_counter()
+    response = llm.invoke(prompt)
+    record_llm_call(node, response, time.perf_counter() - start)
+    return response
+
+
+async def _atimed_invoke(llm: Any, prompt: Any, node: Optional[str]) -> BaseMessage:
+    start = time.perf_counter()
+    response = await llm.ainvoke(prompt)
+    record_llm_call(node, response, time.perf_counter() - start)
+    return response
+
+
+def cached_invoke(llm: Any, prompt: Any, node: Optional[str] = None, cache: Optional[LLMCache] = None) -> BaseMessage:
+    """Gọi llm.invoke(prompt) có cache, trúng cache thì trả về message đã lưu mà không gọi model
+
+    Args:
+        llm: Client LLM (ChatGoogleGenerativeAI, ChatOpenAI, model đã bind_tools, ...)
+        prompt: Prompt dạng str, PromptValue hoặc list message
+        node (str, optional): Tên node gọi LLM, dùng để bật/tắt cache theo node (CACHE_NODES)
+        cache (LLMCache, optional): Cache cần dùng, mặc định là cache dùng chung
+
+    Returns:
+        BaseMessage: Câu trả lời của LLM
+    """
+    if not cache_enabled(node):
+        return _timed_invoke(llm, prompt, node)
+
+    cache = cache or get_llm_cache()
+    key = LLMCache.make_key(_model_name(llm), _prompt_text(prompt), _model_params(llm))
+    cached = cache.get(key)
+    record_cache("llm", cached is not None)
+    if cached is not None:
+        return messages_from_dict(json.loads(cached))[0]
+
+    response = _timed_invoke(llm, prompt, node)
+    if isinstance(response, BaseMessage):
+        cache.set(key, json.dumps(messages_to_dict([response]), ensure_ascii=False, default=str))
+    return response
+
+
+async def acached_invoke(llm: Any, prompt: Any, node: Optional[str] = None, cache: Optional[LLMCache] = None) -> BaseMessage:
+    """Bản async của cached_invoke: gọi await llm.ainvoke(prompt) khi trượt cache"""
+    if not cache_enabled(node):
+        return await _atimed_invoke(llm, prompt, node)
+
+    cache = cache or get_llm_cache()
+    key = LLMCache.make_key(_model_name(llm), _prompt_text(prompt), _model_params(llm))
+    cached = cache.get(key)
+    record_cache("llm", cached is not None)
+    if cached is not None:
+        return messages_from_dict(json.loads(cached))[0]
+
+    response = await _atimed_invoke(llm, prompt, node)
+    if isinstance(response, BaseMessage):
+        cache.set(key, json.dumps(messages_to_dict([response]), ensure_ascii=False, default=str))
+    return response
+
+
+def _stream_lookup(
+    llm: Any, prompt: Any, node: Optional[str], cache: Optional[LLMCache]
+) -> Tuple[Optional[LLMCache], Optional[str], Optional[BaseMessage]]:
+    """(cache, khoá, câu trả lời đã cache) cho cached_stream, cache là None nếu node không dùng cache"""
+    if not cache_enabled(node):
+        return None, None, None
+    cache = cache or get_llm_cache()
+    key = LLMCache.make_key(_model_name(llm), _prompt_text(prompt), _model_params(llm))
+    cached = cache.get(key)
+    record_cache("llm", cached is not None)
+    return cache, key, messages_from_dict(json.loads(cached))[0] if cached is not None else None
+
+
+def _stream_done(
+    merged: Optional[BaseMessage], start: float, node: Optional[str], cache: Optional[LLMCache], key: Optional[str]
+) -> None:
+    """Ghép xong các khúc: ghi độ trễ, số token vào tracing và lưu câu trả lời đầy đủ vào cache"""
+    if merged is None:
+        return
+    response = message_chunk_to_message(merged)
+    record_llm_call(node, response, time.perf_counter() - start)
+    if cache is not None and key is not None:
+        cache.set(key, json.dumps(messages_to_dict([response]), ensure_ascii=False, default=str))
+
+
+def cached_stream(llm: Any, prompt: Any, node: Optional[str] = None, cache: Optional[LLMCache] = None) -> Iterator[BaseMessage]:
+    """Như cached_invoke nhưng trả về dần từng khúc câu trả lời (llm.stream) để hiển thị token ngay khi có
+
+    Trúng cache thì trả về cả câu trả lời trong một khúc. Các khúc cộng lại (chunk + chunk) thành câu trả lời
+    đầy đủ, câu trả lời này được lưu vào cache khi stream xong.
+    """
+    cache, key, cached = _stream_lookup(llm, prompt, node, cache)
+    if cached is not None:
+        yield cached
+        return
+    start = time.perf_counter()
+    merged = None
+    for chunk in llm.stream(prompt):
+        merged = chunk if merged is None else merged + chunk
+        yield chunk
+    _stream_done(merged, start, node, cache, key)
+
+
+async def acached_stream(
+    llm: Any, prompt: Any, node: Optional[str] = None, cache: Optional[LLMCache] = None
+) -> AsyncIterator[BaseMessage]:
+    """Bản async của cached_stream, dùng llm.astream"""
+    cache, key, cached = _stream_lookup(llm, prompt, node, cache)
+    if cached is not None:
+        yield cached
+        return
+    start = time.perf_counter()
+    merged = None
+    async for chunk in llm.astream(prompt):
+        merged = chunk if merged is None else merged + chunk
+        yield chunk
+    _stream_done(merged, start, node, cache, key)
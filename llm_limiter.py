@@ -0,0 +1,440 @@
+import asyncio
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+
+from llm_cache import _model_name
+from tracing import METRICS, log
+
+T = TypeVar("T")
+
+# Bật/tắt bộ giới hạn chung cho mọi client LLM (LLM_LIMITER=0 để tắt)
+LIMITER_ENABLED = os.getenv("LLM_LIMITER", "1") != "0"
+# Token bucket: số lần gọi mỗi giây và số lần gọi dồn tối đa cho mỗi model, <= 0 là không giới hạn tốc độ
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "5"))
+LLM_BURST = int(os.getenv("LLM_BURST", "10"))
+# Số lần gọi cùng lúc: bắt đầu từ LLM_INITIAL_CONCURRENCY, tăng dần khi ổn định, giảm một nửa khi quá tải (AIMD)
+LLM_INITIAL_CONCURRENCY = int(os.getenv("LLM_INITIAL_CONCURRENCY", "4"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MIN_CONCURRENCY = 1
+# Lần gọi chậm hơn số giây này cũng được coi là dấu hiệu quá tải
+LLM_LATENCY_TARGET = float(os.getenv("LLM_LATENCY_TARGET", "30"))
+# Gọi lại tối đa LLM_MAX_RETRIES lần với backoff lũy thừa có jitter, chờ tối đa LLM_BACKOFF_MAX giây mỗi lần
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "0.5"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "20"))
+
+# Mã HTTP nên gọi lại, trong đó 429/503 nghĩa là model đang quá tải (giảm số lần gọi cùng lúc)
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_OVERLOAD_TEXT_RE = re.compile(r"\b(429|503|RESOURCE_EXHAUSTED|UNAVAILABLE|rate limit|quota)\b", re.IGNORECASE)
+
+
+def _status(error: BaseException) -> Optional[int]:
+    """Mã HTTP của lỗi từ client OpenAI (status_code), google-genai (code) hoặc httpx (response.status_code)"""
+    for source in (error, getattr(error, "response", None)):
+        for attr in ("status_code", "code"):
+            value = getattr(source, attr, None)
+            if isinstance(value, int) and 100 <= value < 600:
+                return value
+    return None
+
+
+def error_reason(error: BaseException) -> Optional[str]:
+    """Lý do nên gọi lại: 'rate_limit', 'overloaded', 'server', 'timeout', 'connection', None nếu lỗi không nên gọi lại"""
+    status = _status(error)
+    name = type(error).__name__
+    if status == 429 or "RateLimit" in name or "ResourceExhausted" in name:
+        return "rate_limit"
+    if status == 503 or "ServiceUnavailable" in name:
+        return "overloaded"
+    if status in _RETRY_STATUS:
+        return "server"
+    if isinstance(error, TimeoutError) or "Timeout" in name:
+        return "timeout"
+    if isinstance(error, ConnectionError) or "Connection" in name:
+        return "connection"
+    # Một số client bọc lỗi gốc lại, chỉ còn mã lỗi trong nội dung
+    if status is None and _OVERLOAD_TEXT_RE.search(str(error)):
+        return "rate_limit"
+    return None
+
+
+def is_overloaded(error: BaseException) -> bool:
+    """Lỗi do model quá tải / hết hạn mức (429, 503)"""
+    return error_reason(error) in ("rate_limit", "overloaded")
+
+
+def _retry_after(error: BaseException) -> float:
+    """Số giây server yêu cầu chờ (header Retry-After), 0 nếu không có"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class ModelLimiter:
+    """Bộ giới hạn dùng chung cho mọi client gọi cùng một model
+
+    - Token bucket giới hạn số lần gọi mỗi giây (rate) cho phép dồn tối đa burst lần
+    - Số lần gọi cùng lúc thích ứng kiểu AIMD: mỗi lần gọi thành công tăng 1/limit (khoảng +1 sau
+      mỗi lượt đủ limit lần gọi), lỗi quá tải hoặc độ trễ vượt latency_target thì nhân 0.5
+    - Lỗi tạm thời (429, 5xx, timeout, mất kết nối) được gọi lại với backoff lũy thừa có jitter
+
+    Dùng được cả từ thread (call) lẫn event loop (acall), các lần gọi chờ theo thứ tự đến trước.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: float = LLM_RATE_PER_SEC,
+        burst: int = LLM_BURST,
+        initial_concurrency: int = LLM_INITIAL_CONCURRENCY,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        min_concurrency: int = LLM_MIN_CONCURRENCY,
+        latency_target: float = LLM_LATENCY_TARGET,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.latency_target = latency_target
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.active = 0
+        self.waiting = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        # Chỉ giảm giới hạn một lần cho các lần gọi bắt đầu trước lần giảm gần nhất
+        self._decreased_at = 0.0
+        self._waiters: Deque[Tuple[Any, ...]] = deque()
+        self._lock = threading.Lock()
+        self._publish()
+
+    # ----- số lần gọi cùng lúc -----
+
+    def _capacity(self) -> int:
+        return max(self.min_concurrency, int(self.limit))
+
+    def _wake(self) -> None:
+        """Cấp slot cho các lần gọi đang chờ khi còn chỗ (gọi khi đang giữ _lock)"""
+        while self._waiters and self.active < self._capacity():
+            waiter = self._waiters.popleft()
+            self.waiting -= 1
+            self.active += 1
+            if waiter[0] == "thread":
+                waiter[1].set()
+            else:
+                _, loop, future = waiter
+                loop.call_soon_threadsafe(self._grant, future)
+
+    def _grant(self, future: "asyncio.Future[None]") -> None:
+        # Lần gọi async đã bị huỷ trong lúc slot đang được chuyển tới thì trả slot lại
+        if future.done():
+            self._release_slot()
+        else:
+            future.set_result(None)
+
+    def _acquire_slot(self) -> None:
+        with self._lock:
+            if self.active < self._capacity() and not self._waiters:
+                self.active += 1
+                self._publish()
+                return
+            event = threading.Event()
+            self._waiters.append(("thread", event))
+            self.waiting += 1
+            self._publish()
+        event.wait()
+
+    async def _aacquire_slot(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.active < self._capacity() and not self._waiters:
+                self.active += 1
+                self._publish()
+                return
+            future: "asyncio.Future[None]" = loop.create_future()
+            waiter = ("async", loop, future)
+            self._waiters.append(waiter)
+            self.waiting += 1
+            self._publish()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    self.waiting -= 1
+                    self._publish()
+            if future.done() and not future.cancelled():
+                self._release_slot()
+            raise
+
+    def _release_slot(self) -> None:
+        with self._lock:
+            self.active -= 1
+            self._wake()
+            self._publish()
+
+    # ----- token bucket -----
+
+    def _reserve_token(self) -> float:
+        """Lấy một token, trả về số giây phải chờ trước khi gọi
+
+        Token được phép âm: mỗi lần gọi đặt chỗ trước rồi chờ đúng phần của mình, không cần thăm dò lại.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    # ----- AIMD -----
+
+    def _on_result(self, started: float, latency: float, error: Optional[BaseException]) -> None:
+        """Điều chỉnh giới hạn theo kết quả một lần gọi (slot được trả riêng trong finally bằng _release_slot)"""
+        with self._lock:
+            congested = (error is not None and is_overloaded(error)) or latency > self.latency_target
+            if congested:
+                if started >= self._decreased_at:
+                    self.limit = max(float(self.min_concurrency), self.limit * 0.5)
+                    self._decreased_at = time.monotonic()
+                    log(f"🐢 {self.name}: quá tải, giảm số lần gọi cùng lúc còn {self._capacity()}")
+            elif error is None:
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+
+    def _publish(self) -> None:
+        METRICS.set("invoice_llm_limiter_queue_depth", self.waiting, model=self.name)
+        METRICS.set("invoice_llm_limiter_inflight", self.active, model=self.name)
+        METRICS.set("invoice_llm_limiter_concurrency_limit", self._capacity(), model=self.name)
+
+    def _backoff(self, attempt: int, error: BaseException) -> float:
+        """Full jitter: ngẫu nhiên trong [0, base * 2^attempt], không ít hơn Retry-After của server"""
+        cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        return min(self.backoff_max, max(_retry_after(error), random.uniform(0, cap)))
+
+    def _should_retry(self, attempt: int, error: BaseException) -> Optional[float]:
+        """Số giây chờ trước khi gọi lại, None nếu không gọi lại nữa"""
+        reason = error_reason(error)
+        if reason is None or attempt >= self.max_retries:
+            return None
+        delay = self._backoff(attempt, error)
+        METRICS.inc("invoice_llm_retries_total", model=self.name, reason=reason)
+        log(f"🔁 {self.name}: lỗi {reason}, gọi lại sau {delay:.1f}s (lần {attempt + 1}/{self.max_retries})")
+        return delay
+
+    # ----- gọi -----
+
+    def _acquire(self) -> None:
+        start = time.perf_counter()
+        self._acquire_slot()
+        try:
+            wait = self._reserve_token()
+            if wait:
+                time.sleep(wait)
+        except BaseException:
+            self._release_slot()
+            raise
+        METRICS.observe("invoice_llm_limiter_wait_seconds", time.perf_counter() - start, model=self.name)
+
+    async def _aacquire(self) -> None:
+        start = time.perf_counter()
+        await self._aacquire_slot()
+        try:
+            wait = self._reserve_token()
+            if wait:
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._release_slot()
+            raise
+        METRICS.observe("invoice_llm_limiter_wait_seconds", time.perf_counter() - start, model=self.name)
+
+    def call(self, func: Callable[[], T]) -> T:
+        """Chạy func() trong giới hạn của model, gọi lại khi gặp lỗi tạm thời"""
+        attempt = 0
+        while True:
+            self._acquire()
+            started = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                self._on_result(started, time.monotonic() - started, e)
+                delay = self._should_retry(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._on_result(started, time.monotonic() - started, None)
+                return result
+            finally:
+                self._release_slot()
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, func: Callable[[], Awaitable[T]]) -> T:
+        """Bản async của call, func() trả về awaitable"""
+        attempt = 0
+        while True:
+            await self._aacquire()
+            started = time.monotonic()
+            try:
+                result = await func()
+            except Exception as e:
+                self._on_result(started, time.monotonic() - started, e)
+                delay = self._should_retry(attempt, e)
+                if delay is None:
+                    raise
+            else:
+                self._on_result(started, time.monotonic() - started, None)
+                return result
+            finally:
+                self._release_slot()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stream(self, func: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """Như call nhưng cho kết quả dạng luồng (stream token)
+
+        Giữ slot tới khi đọc hết luồng, chỉ gọi lại khi lỗi xảy ra trước khúc đầu tiên (đã gửi token
+        cho người dùng thì không gọi lại được). AIMD dùng thời gian tới khúc đầu tiên thay cho cả luồng.
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            started = time.monotonic()
+            first: Optional[float] = None
+            try:
+                for item in func():
+                    if first is None:
+                        first = time.monotonic()
+                    yield item
+            except Exception as e:
+                self._on_result(started, (first or time.monotonic()) - started, e)
+                delay = self._should_retry(attempt, e) if first is None else None
+                if delay is None:
+                    raise
+            else:
+                self._on_result(started, (first or time.monotonic()) - started, None)
+                return
+            finally:
+                # Cả khi người đọc dừng giữa chừng (GeneratorExit, KeyboardInterrupt)
+                self._release_slot()
+            time.sleep(delay)
+            attempt += 1
+
+    async def astream(self, func: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Bản async của stream"""
+        attempt = 0
+        while True:
+            await self._aacquire()
+            started = time.monotonic()
+            first: Optional[float] = None
+            try:
+                async for item in func():
+                    if first is None:
+                        first = time.monotonic()
+                    yield item
+            except Exception as e:
+                self._on_result(started, (first or time.monotonic()) - started, e)
+                delay = self._should_retry(attempt, e) if first is None else None
+                if delay is None:
+                    raise
+            else:
+                self._on_result(started, (first or time.monotonic()) - started, None)
+                return
+            finally:
+                self._release_slot()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"model": self.name, "limit": self._capacity(), "active": self.active, "waiting": self.waiting}
+
+
+_limiters: Dict[str, ModelLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(model: str, **settings: Any) -> ModelLimiter:
+    """Bộ giới hạn dùng chung của model, mọi client cùng model trong process chia nhau một bộ
+
+    settings (rate, max_retries, ...) chỉ có tác dụng ở lần đầu tạo bộ giới hạn của model.
+    """
+    with _limiters_lock:
+        if model not in _limiters:
+            _limiters[model] = ModelLimiter(model, **settings)
+        return _limiters[model]
+
+
+class LimitedChatModel(BaseChatModel):
+    """Chat model bọc một client khác (ChatGoogleGenerativeAI, ChatOpenAI, ...) và gọi nó qua ModelLimiter
+
+    bind_tools trả về binding của chính model bọc ngoài, nên with_structured_output, agent của langgraph
+    và các chain dùng tools đều đi qua bộ giới hạn.
+    """
+
+    inner: BaseChatModel
+    limiter: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return self.inner._identifying_params
+
+    @property
+    def model(self) -> str:
+        return _model_name(self.inner)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return self.limiter.call(lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        return await self.limiter.acall(lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    def _should_stream(self, *, async_api: bool, run_manager: Any = None, **kwargs: Any) -> bool:
+        # Chỉ stream khi client bên trong có hỗ trợ, ngược lại gọi _generate như bình thường
+        return self.inner._should_stream(async_api=async_api, run_manager=run_manager, **kwargs)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        return self.limiter.stream(lambda: self.inner._stream(messages, stop=stop, run_manager=run_manager, **kwargs))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        async for chunk in self.limiter.astream(lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs)):
+            yield chunk
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> Any:
+        # Client bên trong chuyển tools sang định dạng của nó, các tham số đó được truyền lại vào _generate
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**getattr(bound, "kwargs", {}))
+
+
+def limited(llm: BaseChatModel, **settings: Any) -> BaseChatModel:
+    """Bọc client LLM bằng bộ giới hạn dùng chung theo tên model (không đổi gì nếu LLM_LIMITER=0)
+
+    Nên tắt cơ chế gọi lại riêng của client (max_retries) để lỗi 429 về tới bộ giới hạn và được tính vào AIMD.
+    """
+    if not LIMITER_ENABLED or isinstance(llm, LimitedChatModel):
+        return llm
+    return LimitedChatModel(inner=llm, limiter=get_limiter(_model_name(llm), **settings))
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+from datetime import date
+from typing import Any, Collection, Dict, List, NamedTuple, Optional, Sequence
+
+from pydantic import ValidationError
+
+from invoice_totals import compute_totals
+from rule_extractor import CORE_FIELDS, TABLE_HEADER
+from tools import InvoiceDetails
+from tracing import METRICS, TRACE_LOG_PATH, flush_traces
+
+# Bật cascade cho bước trích xuất: model nhỏ chạy local trước, chỉ gọi model lớn khi kết quả không hợp lệ
+CASCADE_ENABLED = os.getenv("EXTRACT_CASCADE", "0") == "1"
+# Model local qua server tương thích OpenAI (LM Studio)
+LOCAL_LLM_MODEL = os.getenv("LOCAL_LLM_MODEL", "gemma-3-1b-it-qat")
+LOCAL_LLM_BASE_URL = os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:1234/v1")
+REMOTE_LLM_MODEL = os.getenv("LLM_MODEL", "gemini-2.5-flash")
+
+# Mã số thuế Việt Nam: 10 chữ số, chi nhánh thêm 3 chữ số (0101234567-001)
+_TAX_CODE_RE = re.compile(r'^\d{10}(-?\d{3})?$')
+
+_local_llm = None
+
+
+class CascadeTier(NamedTuple):
+    name: str
+    llm: Any
+
+
+class ModelCascade:
+    """Các tầng model trích xuất theo thứ tự từ rẻ tới đắt
+
+    Tầng trước cho kết quả hợp lệ (validate_fields) thì dùng luôn, ngược lại chuyển lên tầng sau.
+    Kết quả của tầng cuối luôn được dùng, kể cả khi còn lỗi.
+    """
+
+    def __init__(self, tiers: Sequence[CascadeTier]):
+        if not tiers:
+            raise ValueError("Cascade cần ít nhất một tầng model")
+        self.tiers = list(tiers)
+
+    def record(self, tier: str, result: str, latency: float) -> None:
+        """Ghi kết quả một tầng: 'accepted', 'escalated' (không hợp lệ) hoặc 'error' (gọi model lỗi)"""
+        METRICS.inc("invoice_extract_tier_total", tier=tier, result=result)
+        METRICS.observe("invoice_extract_tier_latency_seconds", latency, tier=tier)
+
+
+def validate_fields(
+    fields: Dict[str, Any],
+    raw_data: Optional[Sequence[Sequence[Any]]] = None,
+    llm_fields: Optional[Collection[str]] = None,
+) -> List[str]:
+    """Kiểm tra kết quả trích xuất (luật + LLM) trước khi chấp nhận
+
+    - Đúng schema InvoiceDetails và có đủ các trường chính (CORE_FIELDS)
+    - Mã số thuế đúng định dạng, ngày/tháng/năm là một ngày có thật
+    - Bảng hàng hoá đủ cột, thành tiền khớp số lượng x đơn giá, tổng khớp các dòng tổng trong file
+
+    Args:
+        fields (Dict[str, Any]): Các trường đã trích xuất
+        raw_data (List[List[Any]], optional): Dữ liệu Excel gốc để đối chiếu các số tổng
+        llm_fields (Collection[str], optional): Chỉ kiểm tra mã số thuế, ngày, bảng hàng hoá khi các trường
+            đó do LLM trả về (trường lấy bằng luật không cần model khác làm lại), mặc định kiểm tra tất cả
+
+    Returns:
+        List[str]: Các lỗi tìm được, rỗng là hợp lệ
+    """
+    def checked(*names: str) -> bool:
+        return llm_fields is None or any(name in llm_fields for name in names)
+
+    problems: List[str] = []
+    try:
+        InvoiceDetails(**fields)
+    except ValidationError as e:
+        problems.append(f"Sai schema: {e.error_count()} lỗi")
+
+    missing = [field for field in CORE_FIELDS if not fields.get(field)]
+    if missing:
+        problems.append(f"Thiếu trường: {', '.join(missing)}")
+
+    for field in ('ma_so_thue_ban', 'ma_so_thue_mua'):
+        value = fields.get(field)
+        if value and checked(field) and not _TAX_CODE_RE.match(re.sub(r'[\s.]', '', str(value))):
+            problems.append(f"{field} không đúng định dạng mã số thuế: {value}")
+
+    if all(fields.get(field) for field in ('ngay', 'thang', 'nam')) and checked('ngay', 'thang', 'nam'):
+        try:
+            date(int(fields['nam']), int(fields['thang']), int(fields['ngay']))
+        except (TypeError, ValueError):
+            problems.append(f"Ngày không hợp lệ: {fields['ngay']}/{fields['thang']}/{fields['nam']}")
+
+    table = fields.get('du_lieu_bang')
+    if isinstance(table, list) and table and checked('du_lieu_bang'):
+        bad_rows = [index for index, row in enumerate(table[1:], 1) if not isinstance(row, list) or len(row) != len(TABLE_HEADER)]
+        if bad_rows:
+            problems.append(f"Bảng hàng hoá có {len(bad_rows)} dòng không đủ {len(TABLE_HEADER)} cột")
+        else:
+            problems += compute_totals(table, raw_data)['mismatches']
+    return problems
+
+
+def get_local_llm() -> Any:
+    """Client model local (LM Studio) dùng chung, tạo ở lần gọi đầu tiên"""
+    global _local_llm
+    if _local_llm is None:
+        from langchain_openai import ChatOpenAI
+
+        from llm_limiter import limited
+        # Tầng local lỗi thì chuyển lên tầng sau ngay thay vì chờ gọi lại nhiều lần
+        _local_llm = limited(
+            ChatOpenAI(model=LOCAL_LLM_MODEL, api_key="lm-studio", base_url=LOCAL_LLM_BASE_URL, max_retries=0),
+            max_retries=1,
+        )
+    return _local_llm
+
+
+def build_cascade(remote: Optional[Any] = None, local: Optional[Any] = None) -> ModelCascade:
+    """Cascade hai tầng: model local (mặc định LM Studio) rồi model lớn (mặc định Gemini)"""
+    if remote is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        from llm_limiter import limited
+        remote = limited(ChatGoogleGenerativeAI(model=REMOTE_LLM_MODEL, max_retries=1))
+    return ModelCascade([CascadeTier("local", local or get_local_llm()), CascadeTier("remote", remote)])
+
+
+def summarize_tiers(trace_path: str = TRACE_LOG_PATH) -> Dict[str, Dict[str, float]]:
+    """Tổng hợp các span extract.tier.* trong file trace: số lần, tỉ lệ được chấp nhận, độ trễ trung bình"""
+    summary: Dict[str, Dict[str, float]] = {}
+    flush_traces()
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if not record["name"].startswith("extract.tier."):
+                continue
+            entry = summary.setdefault(record["name"][len("extract.tier."):], {"count": 0, "accepted": 0, "total_ms": 0.0})
+            entry["count"] += 1
+            entry["accepted"] += bool(record["attributes"].get("accepted"))
+            entry["total_ms"] += record["duration_ms"]
+    for entry in summary.values():
+        entry["hit_rate"] = entry["accepted"] / entry["count"]
+        entry["mean_ms"] = entry["total_ms"] / entry["count"]
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_PATH
+    tiers = summarize_tiers(path)
+    for name, entry in tiers.items():
+        print(f"{name:<10} {int(entry['count']):>6} lần  chấp nhận {entry['hit_rate']:>6.1%}  tb {entry['mean_ms']:>10.2f} ms")
+    if "local" in tiers:
+        # Mỗi lần tầng local được chấp nhận là một lần không phải gọi model lớn
+        print(f"Tầng local xử lý được {tiers['local']['hit_rate']:.1%} số lần trích xuất bằng LLM")
@@ -0,0 +1,239 @@
+import re
+import unicodedata
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+# Các trường bắt buộc phải có để bỏ qua LLM, thiếu trường nào thì mới gọi LLM bổ sung
+CORE_FIELDS = ['ten_nguoi_ban', 'ten_nguoi_mua', 'ngay', 'thang', 'nam', 'du_lieu_bang']
+
+# Tiêu đề chuẩn của bảng hàng hoá (giống prompt trong get_prompt_for_data_excel)
+TABLE_HEADER = ['STT', 'Tên hàng hóa, dịch vụ', 'Đơn vị tính', 'Số lượng', 'Đơn giá', 'Thành tiền']
+
+# Nhãn mở đầu phần thông tin người bán / người mua
+_SECTION_LABELS = {
+    'ban': ['ten nguoi ban', 'nguoi ban hang', 'nguoi ban', 'don vi ban hang', 'don vi ban', 'nguoi bao gia'],
+    'mua': ['ten nguoi mua', 'nguoi mua hang', 'nguoi mua', 'don vi mua hang', 'don vi mua', 'khach hang', 'ten don vi'],
+}
+
+# Nhãn dùng chung cho cả người bán và người mua, hậu tố _ban/_mua lấy theo phần đang đọc
+_PARTY_LABELS = {
+    'ma so thue': 'ma_so_thue',
+    'mst': 'ma_so_thue',
+    'dia chi': 'dia_chi',
+    'dien thoai': 'dien_thoai',
+    'so dien thoai': 'dien_thoai',
+    'so tai khoan': 'so_tai_khoan',
+    'tai khoan': 'so_tai_khoan',
+    'stk': 'so_tai_khoan',
+}
+
+# Nhãn không phụ thuộc phần đang đọc
+_GLOBAL_LABELS = {
+    'ky hieu': 'ki_hieu',
+    'ki hieu': 'ki_hieu',
+    'hinh thuc thanh toan': 'hinh_thuc_thanh_toan',
+}
+
+# Tên cột trong file Excel -> vị trí cột trong TABLE_HEADER
+_COLUMN_ALIASES = [
+    (0, ['stt', 'so tt', 'tt']),
+    (1, ['ten hang hoa, dich vu', 'ten hang hoa', 'ten hang', 'ten san pham', 'ten dich vu', 'dien giai', 'mo ta']),
+    (2, ['don vi tinh', 'dvt', 'don vi']),
+    (3, ['so luong', 'sl']),
+    (4, ['don gia', 'gia ban']),
+    (5, ['thanh tien']),
+]
+
+# Dòng bắt đầu bằng các từ này là dòng tổng cộng, kết thúc bảng hàng hoá
+_TABLE_END_PREFIXES = ('tong', 'cong', 'thanh tien', 'so tien bang chu', 'bang chu')
+
+_DATE_TEXT_RE = re.compile(r'ngay\s*(\d{1,2})\s*thang\s*(\d{1,2})\s*nam\s*(\d{4})')
+_DATE_NUM_RE = re.compile(r'(\d{1,2})\s*[/.-]\s*(\d{1,2})\s*[/.-]\s*(\d{4})')
+
+
+def fold_text(text: str) -> str:
+    """Bỏ dấu tiếng Việt, chữ thường và gộp khoảng trắng để so khớp nhãn"""
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    text = text.replace('đ', 'd').replace('Đ', 'd').casefold()
+    return ' '.join(text.split())
+
+
+def cell_text(value: Any) -> str:
+    """Chuyển giá trị ô Excel sang chuỗi, bỏ nan và phần thập phân .0 thừa"""
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value != value:  # nan
+            return ''
+        if value.is_integer():
+            return str(int(value))
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%d/%m/%Y')
+    return str(value).strip()
+
+
+def _build_label_index() -> Dict[str, List[Tuple[str, str, str]]]:
+    """Tạo chỉ mục nhãn theo từ đầu tiên: tu_dau -> [(nhan, loai, gia_tri)], nhãn dài xếp trước"""
+    index: Dict[str, List[Tuple[str, str, str]]] = {}
+    entries = []
+    for section, labels in _SECTION_LABELS.items():
+        entries += [(label, 'section', section) for label in labels]
+    entries += [(label, 'party', field) for label, field in _PARTY_LABELS.items()]
+    entries += [(label, 'global', field) for label, field in _GLOBAL_LABELS.items()]
+    for label, kind, target in entries:
+        index.setdefault(label.split()[0], []).append((label, kind, target))
+    for candidates in index.values():
+        candidates.sort(key=lambda item: len(item[0]), reverse=True)
+    return index
+
+
+_LABEL_INDEX = _build_label_index()
+
+
+def _match_label(text: str) -> Optional[Tuple[str, str, str]]:
+    """Tìm nhãn mà ô bắt đầu bằng nó, trả về (nhan, loai, gia_tri) hoặc None"""
+    folded = fold_text(text)
+    if not folded:
+        return None
+    for label, kind, target in _LABEL_INDEX.get(folded.split()[0], []):
+        if folded == label or folded.startswith(label + ' ') or folded.startswith(label + ':'):
+            return label, kind, target
+    return None
+
+
+def _strip_label(text: str, label: str) -> str:
+    """Cắt phần nhãn (kể cả nhãn bị lặp như 'Địa chỉ: Địa chỉ:') và lấy phần giá trị phía sau"""
+    lines = text.strip().splitlines()
+    value = lines[0] if lines else ''
+    while value and fold_text(value).startswith(label):
+        # Tìm vị trí kết thúc nhãn trên chuỗi gốc (chuỗi gốc còn dấu nên dài khác chuỗi đã bỏ dấu)
+        end = next((i for i in range(1, len(value) + 1) if fold_text(value[:i]) == label), len(value))
+        value = value[end:].lstrip(' :.-\t').strip()
+    return value
+
+
+def _cell_value(row: List[str], col: int, label: str) -> str:
+    """Giá trị của nhãn: phần sau nhãn trong cùng ô, nếu trống thì lấy ô kế tiếp không phải nhãn"""
+    value = _strip_label(row[col], label)
+    if value:
+        # Ô dạng 'Điện thoại: ... | Email:' chỉ lấy phần trước dấu '|'
+        return value.split('|')[0].strip()
+    for text in row[col + 1:]:
+        if not text:
+            continue
+        if _match_label(text):
+            return ''
+        return text.split('|')[0].strip()
+    return ''
+
+
+def _find_date(rows: List[List[str]]) -> Optional[Tuple[str, str, str]]:
+    """Tìm ngày lập hoá đơn dạng 'Ngày .. tháng .. năm ..' hoặc dd/mm/yyyy"""
+    fallback = None
+    for row in rows:
+        for text in row:
+            if not text:
+                continue
+            match = _DATE_TEXT_RE.search(fold_text(text))
+            if match:
+                return match.group(1), match.group(2), match.group(3)
+            if fallback is None:
+                match = _DATE_NUM_RE.search(text)
+                if match:
+                    fallback = (match.group(1), match.group(2), match.group(3))
+    return fallback
+
+
+def _header_columns(row: List[str]) -> Dict[int, int]:
+    """Nếu dòng là tiêu đề bảng hàng hoá thì trả về {vị trí cột chuẩn: cột Excel}, ngược lại {}"""
+    columns: Dict[int, int] = {}
+    for col, text in enumerate(row):
+        folded = fold_text(text).rstrip(' :')
+        if not folded:
+            continue
+        for target, aliases in _COLUMN_ALIASES:
+            if target not in columns and folded in aliases:
+                columns[target] = col
+                break
+    # Cần ít nhất 3 cột và có số lượng hoặc thành tiền mới coi là bảng hàng hoá
+    if len(columns) >= 3 and (3 in columns or 5 in columns):
+        return columns
+    return {}
+
+
+def find_table_header(rows: List[List[Any]]) -> Optional[int]:
+    """Vị trí dòng tiêu đề bảng hàng hoá (STT, Tên hàng, Số lượng, ...) trong sheet, None nếu không có"""
+    for index, row in enumerate(rows):
+        if _header_columns([cell_text(value) for value in row]):
+            return index
+    return None
+
+
+def _find_table(rows: List[List[str]]) -> Optional[List[List[str]]]:
+    """Tìm bảng hàng hoá: dòng tiêu đề rồi các dòng hàng cho tới dòng trống hoặc dòng tổng"""
+    for start, row in enumerate(rows):
+        columns = _header_columns(row)
+        if not columns:
+            continue
+        table = [list(TABLE_HEADER)]
+        for item in rows[start + 1:]:
+            first = next((text for text in item if text), '')
+            if not first:
+                if len(table) > 1:
+                    break
+                continue
+            if fold_text(first).startswith(_TABLE_END_PREFIXES):
+                break
+            line = [item[columns[i]] if i in columns and columns[i] < len(item) else '' for i in range(len(TABLE_HEADER))]
+            # Bỏ qua dòng nhóm (vd 'PC VĂN PHÒNG') không có tên hàng lẫn thành tiền
+            if line[1] or line[5]:
+                table.append(line)
+        if len(table) > 1:
+            return table
+    return None
+
+
+def extract_invoice_by_rules(raw_data: List[List[Any]]) -> Dict[str, Any]:
+    """Trích xuất thông tin hoá đơn bằng luật từ dữ liệu của read_excel_data, không cần LLM
+
+    Args:
+        raw_data (List[List[Any]]): Dữ liệu Excel dưới dạng list of lists
+
+    Returns:
+        Dict[str, Any]: Các trường của InvoiceDetails tìm được bằng luật (chỉ gồm trường có giá trị)
+    """
+    rows = [[cell_text(value) for value in row] for row in raw_data]
+    fields: Dict[str, Any] = {}
+    # Phần đang đọc theo từng cột, hỗ trợ trường hợp người bán/người mua nằm cạnh nhau
+    sections: Dict[int, str] = {}
+
+    for row in rows:
+        for col, text in enumerate(row):
+            if not text:
+                continue
+            matched = _match_label(text)
+            if not matched:
+                continue
+            label, kind, target = matched
+            value = _cell_value(row, col, label)
+            if kind == 'section':
+                sections[col] = target
+                field = f'ten_nguoi_{target}'
+            elif kind == 'party':
+                owner = max((c for c in sections if c <= col), default=None)
+                field = f'{target}_{sections[owner] if owner is not None else "ban"}'
+            else:
+                field = target
+            if value and field not in fields:
+                fields[field] = value
+
+    found_date = _find_date(rows)
+    if found_date:
+        fields['ngay'], fields['thang'], fields['nam'] = found_date
+
+    table = _find_table(rows)
+    if table:
+        fields['du_lieu_bang'] = table
+
+    return fields
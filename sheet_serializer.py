@@ -0,0 +1,95 @@
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from rule_extractor import cell_text
+from tracing import log
+
+# Giới hạn token cho phần dữ liệu Excel trong prompt, đổi bằng biến môi trường PROMPT_TOKEN_BUDGET
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_LOG_PATH = os.getenv(
+    "PROMPT_LOG_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "logs", "prompt_size.jsonl"),
+)
+
+# Phần đầu (thông tin hoá đơn + các dòng hàng đầu) và phần cuối (dòng tổng cộng) được giữ lại khi vượt giới hạn
+_HEAD_SHARE = 0.75
+
+
+def estimate_tokens(text: str) -> int:
+    """Ước lượng số token (tiếng Việt có dấu trung bình khoảng 3 ký tự một token)"""
+    return (len(text) + 2) // 3
+
+
+def _compact_cell(value: Any) -> str:
+    """Giá trị ô gọn nhất: bỏ nan/None, 150000.0 -> 150000, số lẻ giữ 6 chữ số có nghĩa"""
+    if isinstance(value, float) and value == value and not value.is_integer():
+        return f"{value:.6g}"
+    # Tab và xuống dòng trong ô sẽ làm hỏng định dạng TSV
+    return " ".join(cell_text(value).split())
+
+
+def serialize_sheet(rows: List[List[Any]], token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET) -> Tuple[str, Dict[str, int]]:
+    """Chuyển dữ liệu sheet thành TSV gọn để đưa vào prompt
+
+    Bỏ các hàng/cột trống, chuẩn hoá số và khi vượt token_budget thì lược bớt phần giữa
+    (đuôi bảng hàng hoá), giữ lại phần đầu và các dòng tổng cộng ở cuối.
+
+    Args:
+        rows (List[List[Any]]): Dữ liệu Excel dưới dạng list of lists
+        token_budget (int, optional): Số token tối đa cho dữ liệu, None là không giới hạn
+
+    Returns:
+        Tuple[str, Dict[str, int]]: Chuỗi TSV và thống kê số token trước/sau
+    """
+    cells = [[_compact_cell(value) for value in row] for row in rows]
+    width = max((len(row) for row in cells), default=0)
+    used_columns = [col for col in range(width) if any(col < len(row) and row[col] for row in cells)]
+
+    lines = []
+    for row in cells:
+        values = [row[col] if col < len(row) else "" for col in used_columns]
+        while values and not values[-1]:
+            values.pop()
+        if values:
+            lines.append("\t".join(values))
+
+    omitted = 0
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    if token_budget is not None and sum(costs) > token_budget:
+        head, used = 0, 0
+        while head < len(lines) and used + costs[head] <= token_budget * _HEAD_SHARE:
+            used += costs[head]
+            head += 1
+        tail = len(lines)
+        while tail > head and used + costs[tail - 1] <= token_budget:
+            tail -= 1
+            used += costs[tail]
+        omitted = tail - head
+        lines = lines[:head] + [f"... (lược bớt {omitted} dòng) ..."] + lines[tail:]
+
+    text = "\n".join(lines)
+    raw_tokens = estimate_tokens(str(rows))
+    compact_tokens = estimate_tokens(text)
+    stats = {
+        "rows": len(rows),
+        "columns": width,
+        "kept_columns": len(used_columns),
+        "omitted_rows": omitted,
+        "raw_tokens": raw_tokens,
+        "compact_tokens": compact_tokens,
+        "saved_tokens": raw_tokens - compact_tokens,
+    }
+    return text, stats
+
+
+def log_prompt_stats(stats: Dict[str, int], source: str) -> None:
+    """Ghi số token của prompt vào PROMPT_LOG_PATH để theo dõi kích thước prompt theo thời gian"""
+    log(f"📉 Dữ liệu Excel trong prompt: {stats['raw_tokens']} -> {stats['compact_tokens']} token (tiết kiệm {stats['saved_tokens']})")
+    try:
+        os.makedirs(os.path.dirname(PROMPT_LOG_PATH), exist_ok=True)
+        with open(PROMPT_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": time.time(), "source": source, **stats}, ensure_ascii=False) + "\n")
+    except OSError as e:
+        log(f"❌ Không ghi được nhật ký kích thước prompt: {e}")
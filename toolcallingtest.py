@@ -1,5 +1,4 @@
-from langchain.memory import ConversationBufferMemory
-from langchain.prompts import  (ChatPromptTemplate,
+from langchain_core.prompts import  (ChatPromptTemplate,
                                 SystemMessagePromptTemplate,
                                 HumanMessagePromptTemplate,
                                 MessagesPlaceholder)
@@ -7,6 +6,7 @@ from langchain_core.messages import AIMessage
 from langchain_google_genai import ChatGoogleGenerativeAI
 import ast
 from tools import make_file_txt, make_file_docx, make_invoice
+from conversation_memory import SummaryBufferMemory, count_prompt_tokens
 
 system_promt = "Bạn là một trợ lý ảo thông minh. Bạn có thể tạo file .txt và .docx với nội dung được người dùng cung cấp."
 class ChatBot:
@@ -14,11 +14,13 @@ class ChatBot:
         llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash")
         self.llm_with_tools = llm.bind_tools([make_file_txt, make_file_docx, make_invoice])
 
-        self.memory = ConversationBufferMemory(memory_key= "history", return_messages=True)
+        # Giữ nguyên văn vài lượt gần nhất, các lượt cũ hơn được tóm tắt để prompt không lớn dần
+        self.memory = SummaryBufferMemory(llm= llm)
+        self.prompt_tokens = []
 
-        prompt = ChatPromptTemplate.from_messages([
+        self.prompt = prompt = ChatPromptTemplate.from_messages([
             SystemMessagePromptTemplate.from_template(
-                system_promt
+                system_promt + "\nTóm tắt phần hội thoại trước: {summary}"
             ),
             MessagesPlaceholder(variable_name="history"),
             HumanMessagePromptTemplate.from_template("{input}")
@@ -27,7 +29,7 @@ class ChatBot:
         # Kết hợp prompt với LLM và tools   
         self.chain = prompt | self.llm_with_tools
 
-    def process_tool_calls(self, ai_msg: AIMessage, memory: ConversationBufferMemory) -> None:
+    def process_tool_calls(self, ai_msg: AIMessage, memory: SummaryBufferMemory) -> None:
         # Mapping tên function -> tool object
         tool_map = {
             "make_file_txt": make_file_txt,
@@ -60,18 +62,12 @@ class ChatBot:
                 if tool_name in tool_map:
                     try:
                         # invoke chạy tool tương ứng với tham số tool_args tương ứng
-                        tool_map[tool_name].invoke(tool_args)
+                        result = tool_map[tool_name].invoke(tool_args)
                         
-                        # Lưu lại vào memory sau khi gọi tool đánh dấu cho llm biết đã thực hiện tool call
-                        memory.save_context(
-                            {"input": "Yêu cầu"},
-                            {"output": f"Đã chạy tool {tool_name} với args: {tool_args}, thoát khỏi chế độ tool call"}
-                        )
+                        # Ghi chú ngắn vào lượt hiện tại để llm biết đã thực hiện tool call (không chép lại args)
+                        memory.add_note(f"Đã chạy tool {tool_name}: {result}")
                     except Exception as e:
-                        memory.save_context(
-                            {"input": "Yêu cầu"},
-                            {"output": f"Yêu cầu chạy {tool_name} với args: {tool_args} chưa được thực hiện do lỗi: {e}"}
-                        )
+                        memory.add_note(f"Chưa chạy được tool {tool_name} do lỗi: {e}")
                 else:
                     print(f"Tool chưa định nghĩa: {tool_name}")
 
@@ -79,10 +75,15 @@ class ChatBot:
         # Tạo input context
         inputs = {
             "input": message,
-            "history": self.memory.load_memory_variables({})["history"]
+            **self.memory.load_memory_variables({})
         }
+        # Số token của prompt mỗi lượt, giữ ổn định khi hội thoại dài ra
+        prompt_value = self.prompt.invoke(inputs)
+        self.prompt_tokens.append(count_prompt_tokens(prompt_value))
+        print(f"📏 Prompt lượt {len(self.prompt_tokens)}: {self.prompt_tokens[-1]} token")
 
-        response = self.chain.invoke(input= inputs)
+        # Tương đương self.chain.invoke(inputs), dùng lại prompt đã dựng
+        response = self.llm_with_tools.invoke(prompt_value)
 
         # Lưu vào memory
         self.memory.save_context(
@@ -1,15 +1,20 @@
 from langchain_core.tools import tool
-from docx import Document
 from dotenv import load_dotenv
 import os
-from docx.enum.text import WD_ALIGN_PARAGRAPH
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-import pandas as pd
-from typing import List, Optional
+import io
+from typing import TYPE_CHECKING, BinaryIO, List, Optional, Union
 from pydantic import BaseModel, Field
-from langgraph.graph import state
-from langchain_google_genai import GoogleGenerativeAI
+# python-docx chỉ cần khi ghi file, import trong hàm để import tools nhanh hơn
+if TYPE_CHECKING:
+    from docx.document import Document as DocumentObject
+from workbook_cache import cached_read_excel_rows
+from invoice_template import TEMPLATE_PATH, get_invoice_template
+from docx_table import add_table_rows
+from sheet_serializer import DEFAULT_TOKEN_BUDGET, serialize_sheet, log_prompt_stats
+from invoice_totals import apply_totals
+from tracing import log, traced
 @tool
 def make_file_txt(filename: str, content: str) -> str:
     """ Tạo một file định dạng txt
@@ -34,6 +39,8 @@ def make_file_docx(filename: str, content: str) -> None:
         filename (str): tên file để tạo và ghi nội dung vào đó không cân phần mở rộng
         content (str): nội dung muốn ghi vào file 
     """
+    from docx import Document
+
     try:
         document = Document()
         document.add_paragraph(text= content)
@@ -44,20 +51,28 @@ def make_file_docx(filename: str, content: str) -> None:
         return f'Đã tạo thành công file {filename}'
 
 
-def read_excel_data(file_path: str) -> List[List[str]]:
+@traced("tool.read_excel_data")
+def read_excel_data(
+    file_path: str,
+    sheet_name: Optional[Union[str, int]] = None,
+    cell_range: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> List[List[str]]:
     """Đọc nội dung từ file Excel hoá đơn và trả về nội dung dưới dạng list, list chứa các chuỗi
     Args:
-        file_name (str): Tên file Excel cần đọc
+        file_path (str): Tên file Excel cần đọc
+        sheet_name (str | int, optional): Tên hoặc vị trí sheet, mặc định là sheet đầu tiên
+        cell_range (str, optional): Vùng ô cần đọc, ví dụ 'A1:F200'
+        max_rows (int, optional): Số hàng tối đa cần đọc
 
     Returns:
         list[list[str]]: Nội dung của file Excel theo định dạng list, mỗi list con là một hàng trong file Excel
         Nếu có lỗi xảy ra, trả về thông báo lỗi
     """
-    print(f"--- TOOL: Đang đọc file: {file_path} ---")
+    log(f"--- TOOL: Đang đọc file: {file_path} ---")
     try:
-        df = pd.read_excel(file_path)
-        # Chuyển DataFrame thành chuỗi để LLM có thể đọc dễ dàng
-        return df.values.tolist()
+        # Đọc từng hàng ở chế độ read-only (excel_reader.iter_excel_rows) thay vì tạo DataFrame
+        return cached_read_excel_rows(file_path, sheet_name=sheet_name, cell_range=cell_range, max_rows=max_rows)
     except FileNotFoundError:
         return "Lỗi: Không tìm thấy file Excel."
     except Exception as e:
@@ -82,107 +97,175 @@ class InvoiceDetails(BaseModel):
     dien_thoai_mua: Optional[str] = Field(default=None, description='Điện thoại người mua')
     so_tai_khoan_mua: Optional[str] = Field(default=None, description='Số tài khoản người mua')
     hinh_thuc_thanh_toan: Optional[str] = Field(default=None, description='Hình thức thanh toán')
+    # Các trường dưới đây được tính lại từ du_lieu_bang (invoice_totals), không cần LLM trích xuất
+    tong_tien_hang: Optional[str] = Field(default=None, description='Cộng tiền hàng, tự tính từ bảng hàng hoá')
+    thue_suat_gtgt: Optional[str] = Field(default=None, description='Thuế suất GTGT, ví dụ 10%')
+    tien_thue_gtgt: Optional[str] = Field(default=None, description='Tiền thuế GTGT, tự tính')
+    tong_thanh_toan: Optional[str] = Field(default=None, description='Tổng tiền thanh toán, tự tính')
+    so_tien_bang_chu: Optional[str] = Field(default=None, description='Tổng tiền thanh toán bằng chữ, tự tính')
+
+
+def _build_invoice_document(invoice_data: InvoiceDetails) -> "DocumentObject":
+    """Dựng hoá đơn bằng python-docx, chỉ dùng khi không có file template.docx"""
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+
+    doc = Document()
+    
+    # Tiêu đề hóa đơn
+    title_para = doc.add_paragraph()
+    title_run = title_para.add_run('HÓA ĐƠN BÁN HÀNG TÍCH HỢP BIÊN LAI THU THUẾ, PHÍ, LỆ PHÍ')
+    title_run.font.name = 'Times New Roman'
+    title_run.font.size = 14
+    title_run.bold = True
+    title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    # Thông tin thời gian và ký hiệu
+    time_para = doc.add_paragraph()
+    time_run = time_para.add_run(f'Ngày {invoice_data.ngay or "..."} tháng {invoice_data.thang or "..."} năm {invoice_data.nam or "..."}')
+    time_run.font.name = 'Times New Roman'
+    time_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    
+    symbol_para = doc.add_paragraph()
+    symbol_run = symbol_para.add_run(f'Ký hiệu: {invoice_data.ki_hieu or "..."}')
+    symbol_run.font.name = 'Times New Roman'
+    symbol_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
+    
+    # # Phần I
+    # section_para = doc.add_paragraph()
+    # section_run = section_para.add_run('PHẦN I: HÓA ĐƠN BÁN HÀNG')
+    # section_run.font.name = 'Times New Roman'
+    # section_run.bold = True
+    
+    # Thông tin người bán
+    doc.add_paragraph(f'Tên người bán: {invoice_data.ten_nguoi_ban}')
+    if invoice_data.ma_so_thue_ban:
+        doc.add_paragraph(f'Mã số thuế: {invoice_data.ma_so_thue_ban}')
+    if invoice_data.dia_chi_ban:
+        doc.add_paragraph(f'Địa chỉ: {invoice_data.dia_chi_ban}')
+    if invoice_data.dien_thoai_ban:
+        doc.add_paragraph(f'Điện thoại: {invoice_data.dien_thoai_ban}')
+    if invoice_data.so_tai_khoan_ban:
+        doc.add_paragraph(f'Số tài khoản: {invoice_data.so_tai_khoan_ban}')
+
+    # Thông tin người mua
+    doc.add_paragraph(f'Tên người mua: {invoice_data.ten_nguoi_mua}')
+    if invoice_data.ma_so_thue_mua:
+        doc.add_paragraph(f'Mã số thuế: {invoice_data.ma_so_thue_mua}')
+    if invoice_data.dia_chi_mua:
+        doc.add_paragraph(f'Địa chỉ: {invoice_data.dia_chi_mua}')
+    if invoice_data.dien_thoai_mua:
+        doc.add_paragraph(f'Điện thoại: {invoice_data.dien_thoai_mua}')
+    if invoice_data.so_tai_khoan_mua:
+        doc.add_paragraph(f'Số tài khoản: {invoice_data.so_tai_khoan_mua}')
+    
+    # Thông tin thanh toán
+    if invoice_data.hinh_thuc_thanh_toan:
+        doc.add_paragraph(f'Hình thức thanh toán: {invoice_data.hinh_thuc_thanh_toan}')
+    doc.add_paragraph('Đồng tiền thanh toán: VNĐ')
+    
+    # Bảng hàng hóa
+    if invoice_data.du_lieu_bang and len(invoice_data.du_lieu_bang) > 0:
+        # Ghi toàn bộ các dòng trong một lượt, dòng tiêu đề in đậm qua table style
+        add_table_rows(doc, invoice_data.du_lieu_bang, style_name='Table Grid')
+
+    # Các số tổng (invoice_totals)
+    if invoice_data.tong_tien_hang:
+        doc.add_paragraph(f'Cộng tiền hàng: {invoice_data.tong_tien_hang}')
+    if invoice_data.thue_suat_gtgt:
+        doc.add_paragraph(f'Thuế suất GTGT: {invoice_data.thue_suat_gtgt}    Tiền thuế GTGT: {invoice_data.tien_thue_gtgt}')
+    doc.add_paragraph(f'Tổng tiền thanh toán: {invoice_data.tong_thanh_toan or ""}')
+    doc.add_paragraph(f'Số tiền bằng chữ: {invoice_data.so_tien_bang_chu or ""}')
+    
+    return doc
 
 
+def write_invoice_docx(invoice_data: InvoiceDetails, stream: BinaryIO) -> int:
+    """Ghi hoá đơn DOCX vào stream bất kỳ (BytesIO, file đã mở, body của HTTP response, ...) mà không tạo file
+
+    Args:
+        invoice_data (InvoiceDetails): Dữ liệu hoá đơn
+        stream (BinaryIO): Đối tượng có phương thức write(bytes)
+
+    Returns:
+        int: Số byte đã ghi
+    """
+    if invoice_data.tong_thanh_toan is None:
+        # Dữ liệu do LLM/người dùng đưa vào chưa có số tổng thì tính từ bảng hàng
+        invoice_data, _ = apply_totals(invoice_data)
+    if os.path.exists(TEMPLATE_PATH):
+        # Điền dữ liệu vào template.docx đã biên dịch sẵn (invoice_template)
+        return get_invoice_template().write_to(invoice_data, stream)
+    buffer = io.BytesIO()
+    _build_invoice_document(invoice_data).save(buffer)
+    return stream.write(buffer.getvalue())
+
+
+def render_invoice_bytes(invoice_data: InvoiceDetails) -> bytes:
+    """Nội dung file DOCX hoá đơn trong bộ nhớ, không ghi ra đĩa"""
+    buffer = io.BytesIO()
+    write_invoice_docx(invoice_data, buffer)
+    return buffer.getvalue()
+
+
+def render_invoice_docx(invoice_data: InvoiceDetails, output_path: str) -> str:
+    """Tạo file DOCX hoá đơn, khác create_invoice_docx là ném lỗi thay vì trả về thông báo
+
+    Args:
+        invoice_data (InvoiceDetails): Dữ liệu hoá đơn
+        output_path (str): Đường dẫn file đầu ra, không cần phần mở rộng
+
+    Returns:
+        str: Đường dẫn file .docx đã tạo
+    """
+    # Dựng xong nội dung rồi mới mở file để lỗi khi dựng không để lại file rỗng
+    data = render_invoice_bytes(invoice_data)
+    file_path = output_path + '.docx'
+    with open(file_path, 'wb') as f:
+        f.write(data)
+    return file_path
+
+
+@traced("tool.create_invoice_docx")
 def create_invoice_docx(invoice_data: InvoiceDetails, output_path: str) -> str:
     """
     Tạo một file DOCX hoá đơn từ đối tượng InvoiceDetails đã được trích xuất.
     # Node 'create_docx_node' sẽ gọi tool này.
     """
-    print(f"--- TOOL: Đang tạo file DOCX tại: {output_path} ---")
+    log(f"--- TOOL: Đang tạo file DOCX tại: {output_path} ---")
     try:
-        doc = Document()
-        
-        # Tiêu đề hóa đơn
-        title_para = doc.add_paragraph()
-        title_run = title_para.add_run('HÓA ĐƠN BÁN HÀNG TÍCH HỢP BIÊN LAI THU THUẾ, PHÍ, LỆ PHÍ')
-        title_run.font.name = 'Times New Roman'
-        title_run.font.size = 14
-        title_run.bold = True
-        title_para.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # Thông tin thời gian và ký hiệu
-        time_para = doc.add_paragraph()
-        time_run = time_para.add_run(f'Ngày {invoice_data.ngay or "..."} tháng {invoice_data.thang or "..."} năm {invoice_data.nam or "..."}')
-        time_run.font.name = 'Times New Roman'
-        time_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        
-        symbol_para = doc.add_paragraph()
-        symbol_run = symbol_para.add_run(f'Ký hiệu: {invoice_data.ki_hieu or "..."}')
-        symbol_run.font.name = 'Times New Roman'
-        symbol_para.alignment = WD_ALIGN_PARAGRAPH.RIGHT
-        
-        # # Phần I
-        # section_para = doc.add_paragraph()
-        # section_run = section_para.add_run('PHẦN I: HÓA ĐƠN BÁN HÀNG')
-        # section_run.font.name = 'Times New Roman'
-        # section_run.bold = True
-        
-        # Thông tin người bán
-        doc.add_paragraph(f'Tên người bán: {invoice_data.ten_nguoi_ban}')
-        if invoice_data.ma_so_thue_ban:
-            doc.add_paragraph(f'Mã số thuế: {invoice_data.ma_so_thue_ban}')
-        if invoice_data.dia_chi_ban:
-            doc.add_paragraph(f'Địa chỉ: {invoice_data.dia_chi_ban}')
-        if invoice_data.dien_thoai_ban:
-            doc.add_paragraph(f'Điện thoại: {invoice_data.dien_thoai_ban}')
-        if invoice_data.so_tai_khoan_ban:
-            doc.add_paragraph(f'Số tài khoản: {invoice_data.so_tai_khoan_ban}')
-
-        # Thông tin người mua
-        doc.add_paragraph(f'Tên người mua: {invoice_data.ten_nguoi_mua}')
-        if invoice_data.ma_so_thue_mua:
-            doc.add_paragraph(f'Mã số thuế: {invoice_data.ma_so_thue_mua}')
-        if invoice_data.dia_chi_mua:
-            doc.add_paragraph(f'Địa chỉ: {invoice_data.dia_chi_mua}')
-        if invoice_data.dien_thoai_mua:
-            doc.add_paragraph(f'Điện thoại: {invoice_data.dien_thoai_mua}')
-        if invoice_data.so_tai_khoan_mua:
-            doc.add_paragraph(f'Số tài khoản: {invoice_data.so_tai_khoan_mua}')
-        
-        # Thông tin thanh toán
-        if invoice_data.hinh_thuc_thanh_toan:
-            doc.add_paragraph(f'Hình thức thanh toán: {invoice_data.hinh_thuc_thanh_toan}')
-        doc.add_paragraph('Đồng tiền thanh toán: VNĐ')
-        
-        # Bảng hàng hóa
-        if invoice_data.du_lieu_bang and len(invoice_data.du_lieu_bang) > 0:
-            # Tạo bảng
-            table = doc.add_table(rows=len(invoice_data.du_lieu_bang), cols=len(invoice_data.du_lieu_bang[0]))
-            table.style = 'Table Grid'
-            
-            # Điền dữ liệu vào bảng
-            for i, row in enumerate(invoice_data.du_lieu_bang):
-                for j, value in enumerate(row):
-                    cell = table.cell(i, j)
-                    cell.text = str(value) if value is not None else ""
-                    
-                    # Định dạng header
-                    if i == 0:  # Header row
-                        for paragraph in cell.paragraphs:
-                            for run in paragraph.runs:
-                                run.bold = True
-                                run.font.name = 'Times New Roman'
-        
-        # Lưu file
-        doc.save(output_path + '.docx')
+        render_invoice_docx(invoice_data, output_path)
         return f'Đã tạo thành công hóa đơn {output_path}.docx'
-        
     except Exception as e:
         return f'Lỗi {e} khi tạo hóa đơn {output_path}'
 
-def get_prompt_for_data_excel(data_excel_str: List[List[str]]) -> str:
+@tool
+def make_invoice(data_input: InvoiceDetails, filename: str) -> str:
+    """Tạo file hoá đơn DOCX từ thông tin hoá đơn đã trích xuất
+
+    Args:
+        data_input (InvoiceDetails): thông tin hoá đơn đã trích xuất
+        filename (str): tên file hoá đơn cần tạo không cần phần mở rộng
+    """
+    return create_invoice_docx(data_input, filename)
+
+@traced("tool.get_prompt_for_data_excel")
+def get_prompt_for_data_excel(data_excel_str: List[List[str]], token_budget: Optional[int] = DEFAULT_TOKEN_BUDGET) -> str:
     """Tạo prompt hướng dẫn LLM trích xuất thông tin từ dữ liệu Excel
 
     Args:
         data_excel_str (List[List[str]]): Dữ liệu Excel dưới dạng list of lists
+        token_budget (int, optional): Số token tối đa cho phần dữ liệu Excel, vượt quá thì lược bớt đuôi bảng hàng
 
     Returns:
         str: Prompt được tạo để hướng dẫn LLM
     """
+    # Dữ liệu dạng TSV gọn thay cho repr của list (bỏ nan, hàng/cột trống, 150000.0 -> 150000)
+    data_tsv, stats = serialize_sheet(data_excel_str, token_budget=token_budget)
+    log_prompt_stats(stats, source="tools")
     prompt = f"""
-    DỮ LIỆU EXCEL CẦN PHÂN TÍCH:
-    {data_excel_str}
+    DỮ LIỆU EXCEL CẦN PHÂN TÍCH (mỗi dòng là một hàng, các ô cách nhau bằng dấu tab, ô trống đã được bỏ):
+{data_tsv}
 
     HÃY TRÍCH XUẤT THÔNG TIN SAU ĐÂY TỪ DỮ LIỆU EXCEL TRÊN:
 
@@ -220,7 +303,7 @@ def get_prompt_for_data_excel(data_excel_str: List[List[str]]) -> str:
     LƯU Ý: 
     - Nếu không tìm thấy thông tin nào, hãy để giá trị None hoặc chuỗi rỗng
     - Đảm bảo dữ liệu bảng hàng hóa có đúng định dạng list of lists
-    - Tính toán lại thành tiền = số lượng x đơn giá nếu cần
+    - Giữ nguyên số lượng, đơn giá, thành tiền như trong file, không cần tự tính: thành tiền và các số tổng được tính lại tự động
     """
     
     return prompt
@@ -0,0 +1,416 @@
+import asyncio
+import contextvars
+import functools
+import atexit
+import json
+import multiprocessing.util
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import uuid4
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Mỗi span (node của graph, tool, lượt yêu cầu) được ghi thành một dòng JSON vào TRACE_LOG_PATH
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(_ROOT, "logs", "trace.jsonl"))
+# File trace vượt TRACE_LOG_MAX_BYTES thì được đổi tên thành TRACE_LOG_PATH.1 (chỉ giữ một bản cũ)
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+# Số span tối đa chờ ghi, hàng đợi đầy thì bỏ span thay vì chặn request
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+# TRACING=0 tắt cả span và metrics
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+# QUIET_LOGS=1 tắt các dòng print tiến trình (📥, 🧠, --- TOOL ...) của pipeline
+QUIET_LOGS = os.getenv("QUIET_LOGS", "0") == "1"
+
+# Ngưỡng (giây) các bucket histogram thời gian
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_HELP = {
+    "invoice_span_duration_seconds": "Thời gian chạy của từng node/tool",
+    "invoice_span_errors_total": "Số lần node/tool ném lỗi",
+    "invoice_llm_calls_total": "Số lần gọi LLM thật (không tính trúng cache)",
+    "invoice_llm_latency_seconds": "Độ trễ mỗi lần gọi LLM",
+    "invoice_llm_tokens_total": "Số token prompt/completion do LLM báo về",
+    "invoice_cache_lookups_total": "Số lần tra cache theo loại cache và kết quả",
+    "invoice_llm_limiter_queue_depth": "Số lần gọi LLM đang xếp hàng chờ bộ giới hạn",
+    "invoice_llm_limiter_inflight": "Số lần gọi LLM đang chạy",
+    "invoice_llm_limiter_concurrency_limit": "Giới hạn số lần gọi cùng lúc hiện tại (AIMD)",
+    "invoice_llm_limiter_wait_seconds": "Thời gian chờ bộ giới hạn trước mỗi lần gọi LLM",
+    "invoice_llm_retries_total": "Số lần gọi lại LLM theo lý do lỗi",
+    "invoice_extract_tier_total": "Kết quả từng tầng của cascade trích xuất (accepted/escalated/error)",
+    "invoice_extract_tier_latency_seconds": "Thời gian trích xuất của từng tầng cascade",
+    "invoice_ttft_seconds": "Thời gian từ lúc nhận câu hỏi tới token đầu tiên người dùng thấy",
+    "invoice_trace_dropped_total": "Số span bị bỏ vì hàng đợi ghi trace đầy",
+}
+
+
+def log(*args: Any, **kwargs: Any) -> None:
+    """print các dòng tiến trình của pipeline, im lặng khi QUIET_LOGS bật"""
+    if not QUIET_LOGS:
+        print(*args, **kwargs)
+
+
+def set_quiet(quiet: bool) -> None:
+    """Bật/tắt các dòng print tiến trình lúc chạy"""
+    global QUIET_LOGS
+    QUIET_LOGS = quiet
+
+
+class Metrics:
+    """Counter, gauge và histogram trong bộ nhớ, xuất ra định dạng text của Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+        return name, tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """Gán giá trị hiện tại cho gauge (độ dài hàng đợi, số lần gọi đang chạy, ...)"""
+        key = self._key(name, labels)
+        with self._lock:
+            self._gauges[key] = float(value)
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = self._key(name, labels)
+        with self._lock:
+            # [count từng bucket..., tổng, số lần]
+            state = self._histograms.setdefault(key, [0.0] * (len(self.buckets) + 2))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Giá trị hiện tại dạng dict (để in hoặc ghi JSON)"""
+        with self._lock:
+            counters = {f"{name}{_labels(labels)}": value for (name, labels), value in self._counters.items()}
+            gauges = {f"{name}{_labels(labels)}": value for (name, labels), value in self._gauges.items()}
+            histograms = {
+                f"{name}{_labels(labels)}": {"count": state[-1], "sum": state[-2]}
+                for (name, labels), state in self._histograms.items()
+            }
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def render_prometheus(self) -> str:
+        """Nội dung cho endpoint /metrics"""
+        lines: List[str] = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            histograms = sorted((key, list(state)) for key, state in self._histograms.items())
+        typed = set()
+        for kind, values in (("counter", counters), ("gauge", gauges)):
+            for (name, labels), value in values:
+                if name not in typed:
+                    typed.add(name)
+                    lines += [f"# HELP {name} {_HELP.get(name, name)}", f"# TYPE {name} {kind}"]
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+        for (name, labels), state in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines += [f"# HELP {name} {_HELP.get(name, name)}", f"# TYPE {name} histogram"]
+            for bound, count in zip(self.buckets, state):
+                lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {_number(count)}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {_number(state[-1])}")
+            lines.append(f"{name}_sum{_labels(labels)} {state[-2]:.6f}")
+            lines.append(f"{name}_count{_labels(labels)} {_number(state[-1])}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+METRICS = Metrics()
+
+
+_counter_lock = threading.Lock()
+
+
+class Span:
+    """Một đoạn công việc có thời gian: node của graph, tool, hoặc cả lượt yêu cầu
+
+    Các số đếm (thời gian LLM, token, cache hit) cộng vào span hiện tại và mọi span cha,
+    nên span gốc của một yêu cầu có tổng của cả lượt.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes: Any):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid4().hex
+        self.span_id = uuid4().hex[:16]
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.counters: Dict[str, float] = {}
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def add(self, **counts: float) -> None:
+        span: Optional[Span] = self
+        # Các span con có thể chạy ở nhiều luồng (trích xuất theo khúc) cùng cộng vào span cha
+        with _counter_lock:
+            while span is not None:
+                for key, value in counts.items():
+                    span.counters[key] = span.counters.get(key, 0) + value
+                span = span.parent
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+            **{key: round(value, 6) if isinstance(value, float) else value for key, value in self.counters.items()},
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """Span đang chạy trong context hiện tại (thread / task), None nếu không có"""
+    return _current_span.get()
+
+
+class _TraceWriter:
+    """Ghi span ra TRACE_LOG_PATH bằng một thread nền
+
+    Span kết thúc (kể cả trong node async) chỉ đẩy một dòng JSON vào hàng đợi, thread nền gom các dòng
+    đang chờ rồi ghi một lần, nên không có I/O file trên event loop. Thread được tạo lại sau khi fork
+    (process con của batch) và ghi nốt hàng đợi khi process thoát.
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[str]" = queue.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def write(self, line: str) -> None:
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            METRICS.inc("invoice_trace_dropped_total")
+
+    def flush(self) -> None:
+        """Chờ tới khi mọi span đã vào hàng đợi được ghi ra file"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="trace-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+        # Process con của multiprocessing thoát bằng os._exit (không chạy atexit) nhưng vẫn chạy finalizer
+        multiprocessing.util.Finalize(None, self.flush, exitpriority=0)
+
+    def _run(self) -> None:
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._append(lines)
+            except Exception as e:
+                log(f"❌ Không ghi được trace: {e}")
+            finally:
+                for _ in lines:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _append(lines: List[str]) -> None:
+        os.makedirs(os.path.dirname(TRACE_LOG_PATH), exist_ok=True)
+        if os.path.exists(TRACE_LOG_PATH) and os.path.getsize(TRACE_LOG_PATH) >= TRACE_LOG_MAX_BYTES:
+            os.replace(TRACE_LOG_PATH, TRACE_LOG_PATH + ".1")
+        with open(TRACE_LOG_PATH, "a", encoding="utf-8") as f:
+            f.write("".join(line + "\n" for line in lines))
+
+
+_writer = _TraceWriter()
+
+
+def _reset_writer() -> None:
+    global _writer
+    _writer = _TraceWriter()
+
+
+# Thread ghi không đi theo sang process con khi fork: process con dùng hàng đợi và thread mới
+os.register_at_fork(after_in_child=_reset_writer)
+
+
+def flush_traces() -> None:
+    """Ghi hết các span đang chờ ra TRACE_LOG_PATH (gọi trước khi đọc file trace trong cùng process)"""
+    _writer.flush()
+
+
+def _export(span: Span) -> None:
+    """Đưa span vào hàng đợi ghi ra TRACE_LOG_PATH (mỗi span một dòng JSON)"""
+    try:
+        _writer.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str))
+    except Exception as e:
+        log(f"❌ Không ghi được trace: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Đo thời gian một đoạn code, span tạo trong khối with là span con
+
+    Ví dụ:
+        with span("tool.read_excel_data", file=file_path) as s:
+            ...
+    """
+    if not TRACING_ENABLED:
+        yield None
+        return
+    current = Span(name, parent=_current_span.get(), **attributes)
+    token = _current_span.set(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        METRICS.inc("invoice_span_errors_total", span=name)
+        raise
+    finally:
+        current.duration = time.perf_counter() - started
+        _current_span.reset(token)
+        METRICS.observe("invoice_span_duration_seconds", current.duration, span=name)
+        _export(current)
+
+
+def traced(name: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator bọc hàm (sync hoặc async) trong một span tên name"""
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def mark_error(error: BaseException) -> None:
+    """Đánh dấu span hiện tại là lỗi khi node tự bắt exception (không ném ra ngoài span)"""
+    current = _current_span.get()
+    if current is not None and current.error is None:
+        current.error = f"{type(error).__name__}: {error}"
+        METRICS.inc("invoice_span_errors_total", span=current.name)
+
+
+def _usage(response: Any) -> Tuple[int, int]:
+    """(prompt token, completion token) từ usage_metadata của AIMessage, (0, 0) nếu model không báo"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    return int(usage.get("input_tokens", 0) or 0), int(usage.get("output_tokens", 0) or 0)
+
+
+def record_llm_call(node: Optional[str], response: Any, latency: float) -> None:
+    """Ghi một lần gọi LLM thật: độ trễ và số token vào span hiện tại và metrics"""
+    if not TRACING_ENABLED:
+        return
+    node = node or "unknown"
+    prompt_tokens, completion_tokens = _usage(response)
+    METRICS.inc("invoice_llm_calls_total", node=node)
+    METRICS.observe("invoice_llm_latency_seconds", latency, node=node)
+    METRICS.inc("invoice_llm_tokens_total", prompt_tokens, node=node, kind="prompt")
+    METRICS.inc("invoice_llm_tokens_total", completion_tokens, node=node, kind="completion")
+    current = _current_span.get()
+    if current is not None:
+        current.add(llm_calls=1, llm_latency_s=latency, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+def record_ttft(surface: str, seconds: float) -> None:
+    """Ghi thời gian tới token đầu tiên (time-to-first-token) của một câu trả lời dạng stream (cli, api, agent, ...)"""
+    if not TRACING_ENABLED:
+        return
+    METRICS.observe("invoice_ttft_seconds", seconds, surface=surface)
+    current = _current_span.get()
+    if current is not None:
+        current.set(ttft_ms=round(seconds * 1000, 3))
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Ghi một lần tra cache (llm, extract_info, workbook, ...)"""
+    if not TRACING_ENABLED:
+        return
+    METRICS.inc("invoice_cache_lookups_total", cache=cache, result="hit" if hit else "miss")
+    current = _current_span.get()
+    if current is not None:
+        current.add(**{f"{cache}_cache_{'hits' if hit else 'misses'}": 1})
+
+
+def summarize(trace_path: str = TRACE_LOG_PATH) -> Dict[str, Dict[str, float]]:
+    """Tổng hợp file trace: số lần, tổng và trung bình thời gian (ms) theo tên span"""
+    summary: Dict[str, Dict[str, float]] = {}
+    flush_traces()
+    with open(trace_path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            entry = summary.setdefault(record["name"], {"count": 0, "total_ms": 0.0, "llm_latency_ms": 0.0, "errors": 0})
+            entry["count"] += 1
+            entry["total_ms"] += record["duration_ms"]
+            entry["llm_latency_ms"] += record.get("llm_latency_s", 0) * 1000
+            entry["errors"] += record["status"] == "error"
+    for entry in summary.values():
+        entry["mean_ms"] = entry["total_ms"] / entry["count"]
+    return summary
+
+
+if __name__ == "__main__":
+    import sys
+
+    path = sys.argv[1] if len(sys.argv) > 1 else TRACE_LOG_PATH
+    for name, entry in sorted(summarize(path).items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"{name:<36} {int(entry['count']):>6} lần  tb {entry['mean_ms']:>10.2f} ms  "
+              f"LLM {entry['llm_latency_ms']:>10.2f} ms  lỗi {int(entry['errors'])}")
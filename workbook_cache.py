@@ -0,0 +1,167 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, List, Optional, Union
+
+from excel_reader import read_excel_rows
+from tracing import record_cache
+
+# Thư mục cache dữ liệu sheet đã đọc, đổi bằng biến môi trường WORKBOOK_CACHE_DIR
+WORKBOOK_CACHE_DIR = os.getenv(
+    "WORKBOOK_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "workbooks"),
+)
+WORKBOOK_CACHE_MAX_BYTES = int(os.getenv("WORKBOOK_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+WORKBOOK_CACHE_ENABLED = os.getenv("WORKBOOK_CACHE", "1") != "0"
+# Tăng khi cách đọc Excel (excel_reader) thay đổi để bỏ các mục cache cũ
+READER_VERSION = 1
+
+
+class WorkbookCache:
+    """Cache dữ liệu sheet đã đọc, khoá theo sha256 nội dung file + tham số đọc
+
+    Mỗi mục là một file pickle (nhị phân, giữ nguyên kiểu số/ngày của ô). Bảng files trong SQLite
+    nhớ (mtime, size) -> hash của từng đường dẫn để không phải băm lại file chưa đổi; file đổi
+    mtime hoặc size thì được băm lại và tự nhận khoá mới.
+    """
+
+    def __init__(self, root: str = WORKBOOK_CACHE_DIR, max_bytes: int = WORKBOOK_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, digest TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def file_digest(self, file_path: str) -> str:
+        """sha256 nội dung file, chỉ băm lại khi mtime hoặc size thay đổi"""
+        path = os.path.abspath(file_path)
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT mtime_ns, size, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return row[2]
+
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, digest),
+            )
+            self._conn.commit()
+        return digest
+
+    def make_key(self, file_path: str, **options: Any) -> str:
+        """Khoá cache: hash nội dung file + tham số đọc + phiên bản cách đọc"""
+        payload = json.dumps([self.file_digest(file_path), READER_VERSION, options], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.pkl")
+
+    def get_or_read(self, file_path: str, reader: Callable[..., Any], **options: Any) -> Any:
+        """Dữ liệu đã cache của file với các tham số options, chưa có thì gọi reader(file_path, **options) rồi lưu"""
+        key = self.make_key(file_path, **options)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            value = None
+        record_cache("workbook", value is not None)
+        if value is not None:
+            self.hits += 1
+            with self._lock:
+                self._conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._conn.commit()
+            return value
+
+        self.misses += 1
+        value = reader(file_path, **options)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Ghi ra file tạm rồi đổi tên để process khác không đọc phải file ghi dở
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, accessed) VALUES (?, ?, ?)", (key, len(data), time.time())
+            )
+            self._evict()
+            self._conn.commit()
+        return value
+
+    def _evict(self) -> None:
+        """Xoá các mục truy cập lâu nhất khi tổng dung lượng vượt max_bytes"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY accessed ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+    def clear(self) -> None:
+        """Xoá toàn bộ cache"""
+        with self._lock:
+            for (key,) in self._conn.execute("SELECT key FROM entries").fetchall():
+                try:
+                    os.remove(self._path(key))
+                except FileNotFoundError:
+                    pass
+            self._conn.execute("DELETE FROM entries")
+            self._conn.execute("DELETE FROM files")
+            self._conn.commit()
+
+
+_default_cache: Optional[WorkbookCache] = None
+
+
+def get_workbook_cache() -> WorkbookCache:
+    """Cache dùng chung trong process, tạo khi dùng lần đầu"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = WorkbookCache()
+    return _default_cache
+
+
+def cached_read_excel_rows(
+    file_path: str,
+    sheet_name: Optional[Union[str, int]] = None,
+    cell_range: Optional[str] = None,
+    max_rows: Optional[int] = None,
+) -> List[List[Any]]:
+    """Như excel_reader.read_excel_rows nhưng đọc lại cùng một file (chưa đổi) thì lấy từ cache
+
+    Tắt bằng biến môi trường WORKBOOK_CACHE=0.
+    """
+    if not WORKBOOK_CACHE_ENABLED:
+        return read_excel_rows(file_path, sheet_name=sheet_name, cell_range=cell_range, max_rows=max_rows)
+    return get_workbook_cache().get_or_read(
+        file_path, read_excel_rows, sheet_name=sheet_name, cell_range=cell_range, max_rows=max_rows
+    )
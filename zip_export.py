@@ -0,0 +1,136 @@
+import io
+import json
+import queue
+import threading
+import time
+import zipfile
+from typing import Any, BinaryIO, Iterator, Optional
+
+# Các byte ZIP được gom thành khúc cỡ này trước khi đẩy cho người đọc
+CHUNK_SIZE = 64 * 1024
+
+
+class ZipStream:
+    """Ghi dần các file vào một file ZIP, mỗi file được ghi xong ngay khi add() trả về
+
+    stream không cần seek được (socket, body của HTTP response, QueueStream): zipfile khi đó
+    ghi kích thước file sau nội dung (data descriptor), bộ nhớ chỉ giữ danh mục các file đã ghi.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.count = 0
+        self.bytes = 0
+        self._zip = zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED)
+
+    def add(self, name: str, data: bytes, compress: bool = True) -> None:
+        """Thêm một file vào ZIP
+
+        Args:
+            name (str): Đường dẫn file trong ZIP
+            data (bytes): Nội dung file
+            compress (bool): Nén hay không, file đã nén sẵn (.docx cũng là ZIP) thì nén lại không được gì
+        """
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+        self._zip.writestr(info, data)
+        self.count += 1
+        self.bytes += len(data)
+        flush = getattr(self.stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def add_json(self, name: str, value: Any) -> None:
+        self.add(name, json.dumps(value, ensure_ascii=False, indent=2).encode('utf-8'))
+
+    def close(self) -> None:
+        """Ghi danh mục cuối file ZIP, sau đó file mới mở được"""
+        self._zip.close()
+        flush = getattr(self.stream, 'flush', None)
+        if flush is not None:
+            flush()
+
+    def __enter__(self) -> "ZipStream":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class QueueStream(io.RawIOBase):
+    """Stream chỉ ghi, không seek được: bên ghi (thread tạo ZIP) đẩy từng khúc byte vào hàng đợi
+    có giới hạn, bên đọc (HTTP response) lặp qua stream để lấy các khúc
+
+    Hàng đợi đầy thì bên ghi phải chờ, nên bộ nhớ không tăng theo số hoá đơn khi người tải chậm.
+    """
+
+    _END = object()
+
+    def __init__(self, max_chunks: int = 16, chunk_size: int = CHUNK_SIZE):
+        super().__init__()
+        self.chunk_size = chunk_size
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_chunks)
+        self._buffer = bytearray()
+        self._offset = 0
+        self._error: Optional[BaseException] = None
+        self._finished = threading.Event()
+        self._cancelled = threading.Event()
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        # zipfile cần vị trí hiện tại để ghi danh mục, seek() vẫn không hỗ trợ
+        return self._offset
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self._buffer += data
+        self._offset += len(data)
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def _put(self, item: Any) -> None:
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        # Người tải đã ngắt kết nối, dừng việc tạo ZIP thay vì chờ mãi
+        raise BrokenPipeError("Người đọc đã dừng nhận dữ liệu")
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Bên ghi đã xong (hoặc lỗi): đẩy phần còn lại và báo cho bên đọc dừng"""
+        if self._finished.is_set():
+            return
+        self._finished.set()
+        self._error = error
+        try:
+            self.flush()
+            self._put(self._END)
+        except BrokenPipeError:
+            pass
+
+    def cancel(self) -> None:
+        """Bên đọc dừng giữa chừng: lần ghi tiếp theo của bên ghi sẽ ném BrokenPipeError"""
+        self._cancelled.set()
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            while True:
+                chunk = self._queue.get()
+                if chunk is self._END:
+                    break
+                yield chunk
+        finally:
+            # Đọc hết hoặc bị ngắt giữa chừng đều không còn ai nhận dữ liệu nữa
+            self.cancel()
+        if self._error is not None:
+            raise self._error